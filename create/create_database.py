@@ -3,8 +3,10 @@ SQL Tables should only have to be made once. After that any modifications to the
 Tables that we need based on the OGP measurements so far:
 '''
 
-import asyncio, asyncpg, yaml, os, argparse, base64, pwinput
+import asyncio, asyncpg, yaml, os, sys, argparse, base64, pwinput
 from cryptography.fernet import Fernet
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from HGC_DB_postgres.src.db_session import get_password, get_conn, get_conn_info
 
 ## Database connection parameters for new database
 parser = argparse.ArgumentParser(description="A script that modifies a table and requires the -t argument.")
@@ -18,21 +20,8 @@ loc = 'dbase_info'
 tables_subdir = 'postgres_tables'
 table_yaml_file = os.path.join(loc, 'tables.yaml')
 conn_yaml_file = os.path.join(loc, 'conn.yaml')
-conn_info = yaml.safe_load(open(conn_yaml_file, 'r'))
-db_params = {
-    'database': 'postgres', ### default prior to creation of the database
-    'user': 'postgres',
-    'host': conn_info.get('db_hostname'),
-    'port': conn_info.get('port'),}
-
-if args.password is None:
-        dbpassword = pwinput.pwinput(prompt='Enter superuser password: ', mask='*')
-else:
-    if args.encrypt_key is None:
-        print("Encryption key not provided. Exiting..."); exit()
-    cipher_suite = Fernet((args.encrypt_key).encode())
-    dbpassword = cipher_suite.decrypt( base64.urlsafe_b64decode(args.password)).decode() ## Decode base64 to get encrypted string and then decrypt
-    db_params.update({'password': dbpassword})
+conn_info = get_conn_info()
+dbpassword = get_password(args.password, args.encrypt_key, prompt='Enter superuser password: ')
 
 user_password = args.userpass
 if user_password is None:
@@ -45,7 +34,7 @@ if viewer_password is None:
 async def create_db():
     print("Creating a new database...")
     # Connect to the default PostgreSQL database
-    default_conn = await asyncpg.connect(**db_params)
+    default_conn = await get_conn(user = 'postgres', dbpassword = dbpassword, database = 'postgres') ### default prior to creation of the database
 
     # Create a new database
     db_name = conn_info.get('dbname')
@@ -60,9 +49,8 @@ async def create_db():
     await default_conn.close()
 
     # Connect to the newly created database
-    conn = await asyncpg.connect(**db_params)
-    db_params.update({'database': db_name})
-    print(f"Connected to database '{db_params['database']}' successfully.\n")
+    conn = await get_conn(user = 'postgres', dbpassword = dbpassword, database = 'postgres')
+    print(f"Connected to database '{db_name}' successfully.\n")
 
     # Create user roles and assign privileges
     async def create_role(role_name, user_type):
@@ -1,8 +1,11 @@
 import asyncio, asyncpg
-import glob, os, csv, yaml, argparse, base64
+import glob, os, sys, csv, yaml, argparse, base64
 import numpy as np
 import pwinput
 from cryptography.fernet import Fernet
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from HGC_DB_postgres.src.db_session import get_password, get_conn, get_conn_info
+from HGC_DB_postgres.export.kind_of_part import kind_of_part_function_sql
 
 parser = argparse.ArgumentParser(description="A script that modifies a table and requires the -t argument.")
 parser.add_argument('-p', '--password', default=None, required=False, help="Password to access database.")
@@ -15,24 +18,12 @@ loc = 'dbase_info'
 tables_subdir = 'postgres_tables'
 table_yaml_file = os.path.join(loc, 'tables.yaml')
 conn_yaml_file = os.path.join(loc, 'conn.yaml')
-conn_info = yaml.safe_load(open(conn_yaml_file, 'r'))
-db_params = {
-    'database': conn_info.get('dbname'),
-    'user': 'postgres',
-    'host': conn_info.get('db_hostname'),
-    'port': conn_info.get('port'),}
-
-if args.password is None:
-        dbpassword = pwinput.pwinput(prompt='Enter superuser password: ', mask='*')
-else:
-    if args.encrypt_key is None:
-        print("Encryption key not provided. Exiting..."); exit()
-    cipher_suite = Fernet((args.encrypt_key).encode())
-    db_params.update({'password': cipher_suite.decrypt( base64.urlsafe_b64decode(args.password)).decode()}) ## Decode base64 to get encrypted string and then decrypt
+conn_info = get_conn_info()
+dbpassword = get_password(args.password, args.encrypt_key, prompt='Enter superuser password: ')
 
 async def create_tables():
     # Connect to the database
-    conn = await asyncpg.connect(**db_params)
+    conn = await get_conn(user = 'postgres', dbpassword = dbpassword)
     schema_name = 'public'  # Change this if your tables are in a different schema
     print('Connection successful. \n')
 
@@ -87,27 +78,111 @@ async def create_tables():
         print(f"Schema permission access granted to {user}.")
 
     # Function creation SQL
+    ## One notification per INSERT statement, read from its transition table, with the payload
+    ## {"table", "op", "rows", "pk": [min, max], "parts": [...]}. The distinct part names are split
+    ## over several notifications, each below the 8000 byte limit of NOTIFY.
     create_function_sql = """
+        DROP FUNCTION IF EXISTS notify_insert() CASCADE;
         CREATE OR REPLACE FUNCTION notify_insert()
         RETURNS TRIGGER AS $$
+        DECLARE
+            pk_col TEXT := TG_ARGV[0];
+            part_col TEXT := NULLIF(TG_ARGV[1], '');
+            max_payload CONSTANT INT := 7900;
+            n_rows BIGINT;
+            pk_min BIGINT;
+            pk_max BIGINT;
+            header TEXT;
+            parts TEXT[];
+            part TEXT;
+            chunk TEXT[] := '{}';
+            size INT;
         BEGIN
-            PERFORM pg_notify('incoming_data_notification', '');
-            RETURN NEW;
+            EXECUTE format('SELECT count(*), min(%1$I), max(%1$I) FROM new_rows', pk_col) INTO n_rows, pk_min, pk_max;
+            IF n_rows = 0 THEN
+                RETURN NULL;
+            END IF;
+            header := json_build_object('table', TG_TABLE_NAME, 'op', TG_OP, 'rows', n_rows, 'pk', json_build_array(pk_min, pk_max))::text;
+            IF part_col IS NOT NULL THEN
+                EXECUTE format('SELECT array_agg(DISTINCT %1$I ORDER BY %1$I) FROM new_rows WHERE %1$I IS NOT NULL', part_col) INTO parts;
+            END IF;
+            size := octet_length(header) + 12;
+            FOREACH part IN ARRAY coalesce(parts, '{}') LOOP
+                IF size + octet_length(to_json(part)::text) + 1 > max_payload AND cardinality(chunk) > 0 THEN
+                    PERFORM pg_notify('incoming_data_notification', left(header, -1) || ', "parts" : ' || to_json(chunk)::text || '}');
+                    chunk := '{}';
+                    size := octet_length(header) + 12;
+                END IF;
+                chunk := chunk || part;
+                size := size + octet_length(to_json(part)::text) + 1;
+            END LOOP;
+            PERFORM pg_notify('incoming_data_notification', left(header, -1) || ', "parts" : ' || to_json(chunk)::text || '}');
+            RETURN NULL;
         END;
         $$ LANGUAGE plpgsql;
         """
     
+    ## Parts inserted or updated by every statement, for the incremental export (export/export_watermark.py).
+    ## The status columns written by the export itself (export/src.py update_status_cols) set
+    ## export.status_update for their transaction and are not logged. export.status_update is a
+    ## cooperative flag, not an access control: any user can set it and skip the log of a transaction.
+    ## Runs as the owner, so the users inserting data need no permission on export_change_log. The
+    ## search_path is pinned and the log is schema-qualified, so a caller's own search_path cannot
+    ## redirect the names it uses, and only the triggers may execute it.
+    create_change_log_function_sql = """
+        CREATE OR REPLACE FUNCTION log_change()
+        RETURNS TRIGGER AS $$
+        DECLARE
+            part_col TEXT;
+            changed_rows TEXT;
+        BEGIN
+            IF pg_catalog.current_setting('export.status_update', true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+            changed_rows := CASE WHEN TG_OP = 'UPDATE' THEN '(SELECT %1$I FROM new_rows UNION SELECT %1$I FROM old_rows)' ELSE 'new_rows' END;
+            FOREACH part_col IN ARRAY TG_ARGV LOOP
+                EXECUTE pg_catalog.format('INSERT INTO public.export_change_log (table_name, part_col, part_name, txid, change_datetime)
+                                SELECT DISTINCT $1, $2, %1$I, pg_catalog.txid_current(), pg_catalog.now() FROM ' || changed_rows || ' AS changed WHERE %1$I IS NOT NULL', part_col)
+                USING TG_TABLE_NAME, part_col;
+            END LOOP;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = pg_catalog, public, pg_temp;
+        REVOKE EXECUTE ON FUNCTION log_change() FROM PUBLIC;
+        """
+
+    create_change_log_trigger_sql_template = """
+        DROP TRIGGER IF EXISTS {table_name}_change_log_insert ON {table_name};
+        CREATE TRIGGER {table_name}_change_log_insert
+        AFTER INSERT ON {table_name}
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION log_change({part_cols});
+        DROP TRIGGER IF EXISTS {table_name}_change_log_update ON {table_name};
+        CREATE TRIGGER {table_name}_change_log_update
+        AFTER UPDATE ON {table_name}
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION log_change({part_cols});
+        """
+
     create_trigger_sql_template = """
+        DROP TRIGGER IF EXISTS {table_name}_insert_trigger ON {table_name};
         CREATE TRIGGER {table_name}_insert_trigger
         AFTER INSERT ON {table_name}
-        FOR EACH ROW
-        EXECUTE FUNCTION notify_insert();
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION notify_insert('{pk_col}', '{part_col}');
         """
+    part_cols = ['module_name', 'proto_name', 'hxb_name', 'sen_name', 'bp_name'] ## part name of the notifications, in this order of preference
 
     try:
         # Create a cursor and execute the function creation SQL
         async with conn.transaction():
             await conn.execute(create_function_sql)
+            await conn.execute(create_change_log_function_sql)
+            ## kind_of_part(text) decodes serial numbers set-wise with the code tables of export/resource.yaml
+            await conn.execute(kind_of_part_function_sql())
 
         ## Define the table name and schema
         with open(table_yaml_file, 'r') as file:
@@ -125,12 +200,22 @@ async def create_tables():
                 table_name, table_header, dat_type, fk_name, fk_ref, parent_table = get_table_info(loc, tables_subdir, fname)
                 table_columns = get_column_names(table_header, dat_type, fk_name, fk_ref, parent_table)
                 await create_table(table_name, table_columns)
+                for n, index_cols in enumerate(i.get('index', [])):
+                    await conn.execute(f"CREATE INDEX IF NOT EXISTS {table_name}_idx{n} ON {table_name} ({index_cols});")
                 pk_seq = f'{table_name}_{table_header[0]}_seq'
-                try:
-                    create_trigger_sql = create_trigger_sql_template.format(table_name=table_name)
-                    await conn.execute(create_trigger_sql)
-                except:
-                    print('Trigger already exists..')
+                if i.get('notify', True):
+                    try:
+                        part_col = next((col for col in part_cols if col in table_header), '')
+                        create_trigger_sql = create_trigger_sql_template.format(table_name=table_name, pk_col=table_header[0], part_col=part_col)
+                        await conn.execute(create_trigger_sql)
+                        table_part_cols = [col for col in part_cols if col in table_header]
+                        if table_part_cols:
+                            await conn.execute(create_change_log_trigger_sql_template.format(table_name=table_name, part_cols=', '.join(f"'{col}'" for col in table_part_cols)))
+                    except Exception as e:
+                        print(f'Trigger not created: {e}')
+                else:
+                    ## tables written by the export itself would wake up export_daemon.py after every cycle
+                    await conn.execute(f"DROP TRIGGER IF EXISTS {table_name}_insert_trigger ON {table_name};")
                 for k in i['permission'].keys():
                     try:
                         await allow_perm(table_name, i['permission'][k], k)
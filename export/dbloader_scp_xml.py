@@ -2,6 +2,11 @@ import platform, os, argparse, base64
 from scp import SCPClient
 import numpy as np
 import datetime, yaml, paramiko, pwinput, sys
+import json, time, threading, queue
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from HGC_DB_postgres.export.upload_manifest import get_pending_files, record_upload_results
+from HGC_DB_postgres.export.export_dag import get_xml_nodes, UploadDAG
 from tqdm import tqdm
 from cryptography.fernet import Fernet
 
@@ -13,6 +18,7 @@ cern_dbase  = 'dev_db'## for testing purpose, otherwise uncomment above.
 cerndb_types = {"dev_db": {'dbtype': 'Development', 'dbname': 'INT2R'}, 
                 "prod_db": {'dbtype': 'Production','dbname':'CMSR'}}
 cern_dbname = (cerndb_types[cern_dbase]['dbname']).lower()
+UPLOAD_LOG_FILE = 'export/logs/dbloader_upload_log.jsonl' ## one JSON line per uploaded file
 
 def valid_directory(path):
     if os.path.isdir(path):
@@ -41,65 +47,205 @@ def find_files_by_date(directory, target_date):
     return matched_files
 
 
-def get_build_files(files_list):
-    build_files = []
-    other_files = []
-    for fname in files_list:
-        if 'build' in fname.lower(): 
-            build_files.append(fname)
-        else:
-            other_files.append(fname)
-    return build_files, other_files
-
-
-def scp_to_dbloader(dbl_username, dbl_password, fname, encryption_key = None):
-    ssh_server1 = paramiko.SSHClient()
-    ssh_server1.load_system_host_keys()
-    ssh_server1.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-    try:
+class DBLoaderSession:
+    '''
+    Two-hop SSH session, lxplus -> dbloader-hgcal, set up once and reused for every file.
+    The password is decrypted once. If the transport drops, put() reconnects and retries the file.
+    '''
+    def __init__(self, dbl_username, dbl_password, encryption_key = None,
+                 jump_host = 'lxplus.cern.ch', target_host = 'dbloader-hgcal', port = 22,
+                 remote_dir = f'/home/dbspool/spool/hgc/{cern_dbname}/'):
+        self.dbl_username = dbl_username
         if encryption_key is not None:
             cipher_suite = Fernet(encryption_key.encode())  ## Decode base64 to get encrypted string and then decrypt
-            ssh_server1.connect(hostname='lxplus.cern.ch', username=dbl_username, password = cipher_suite.decrypt( base64.urlsafe_b64decode(dbl_password)).decode() )
+            self.dbl_password = cipher_suite.decrypt( base64.urlsafe_b64decode(dbl_password)).decode()
         else:
-            ssh_server1.connect(hostname='lxplus.cern.ch', username=dbl_username, password=dbl_password)
+            self.dbl_password = dbl_password
+        self.jump_host, self.target_host, self.port = jump_host, target_host, port
+        self.remote_dir = remote_dir
+        self.ssh_server1, self.ssh_server2, self.scp = None, None, None
+
+    def _ssh_client(self):
+        client = paramiko.SSHClient()
+        client.load_system_host_keys()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        return client
+
+    def connect(self):
+        self.close()
+        self.ssh_server1 = self._ssh_client()
+        self.ssh_server1.connect(hostname=self.jump_host, port=self.port, username=self.dbl_username, password=self.dbl_password)
 
-        transport = ssh_server1.get_transport()
-        dest_addr = ('dbloader-hgcal', 22)  
+        transport = self.ssh_server1.get_transport()
+        dest_addr = (self.target_host, self.port)
         local_addr = ('127.0.0.1', 22) # localhost
         channel = transport.open_channel("direct-tcpip", dest_addr, local_addr)
-        ssh_server2 = paramiko.SSHClient()
-        ssh_server2.load_system_host_keys()
-        ssh_server2.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        if encryption_key is not None:
-            ssh_server2.connect(hostname='dbloader-hgcal', username=dbl_username, password = cipher_suite.decrypt( base64.urlsafe_b64decode(dbl_password)).decode() , sock=channel)
-        else:
-            ssh_server2.connect(hostname='dbloader-hgcal', username=dbl_username, password=dbl_password, sock=channel)
+        self.ssh_server2 = self._ssh_client()
+        self.ssh_server2.connect(hostname=self.target_host, port=self.port, username=self.dbl_username, password=self.dbl_password, sock=channel)
+        self.scp = SCPClient(self.ssh_server2.get_transport())
 
-        with SCPClient(ssh_server2.get_transport()) as scp:
-            scp.put(fname, f'/home/dbspool/spool/hgc/{cern_dbname}/')
+    def is_active(self):
+        for client in [self.ssh_server1, self.ssh_server2]:
+            if client is None or client.get_transport() is None or not client.get_transport().is_active():
+                return False
+        return True
 
-        scp.close()
-        ssh_server2.close()
-        ssh_server1.close()    
-        
+    def put(self, fname):
+        if not self.is_active():
+            self.connect()
+        try:
+            self.scp.put(fname, self.remote_dir)
+        except (paramiko.SSHException, EOFError, OSError) as e:
+            if self.is_active():
+                raise
+            print(f"Connection to {self.target_host} dropped ({e}). Reconnecting ...")
+            self.connect()
+            self.scp.put(fname, self.remote_dir)
+
+    def close(self):
+        for client in [self.scp, self.ssh_server2, self.ssh_server1]:
+            if client is not None:
+                client.close()
+        self.ssh_server1, self.ssh_server2, self.scp = None, None, None
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def scp_to_dbloader(dbl_username, dbl_password, fname, encryption_key = None, session = None):
+    try:
+        if session is not None:
+            session.put(fname)
+        else:
+            with DBLoaderSession(dbl_username, dbl_password, encryption_key) as session:
+                session.put(fname)
+        return True
     except paramiko.AuthenticationException:
         print("Authentication failed, please verify your credentials.")
     except paramiko.SSHException as e:
         print(f"SSH exception occurred: {e}")
     except Exception as e:
         print(f"An error occurred: {e}")
+    return False
         
         
+class UploadScheduler:
+    '''
+    Uploads files with N concurrent transfers. Every transfer borrows a DBLoaderSession from a pool of
+    at most N sessions, kept open across phases.
+    A failed file is retried with exponential backoff (backoff, 2*backoff, 4*backoff, ... seconds)
+    and the outcome of every file is appended to result_log as one JSON line.
+    A file is 'spooled' once it is copied to the DBLoader spool. Whether DBLoader then loads it is
+    not reported back over SCP, it is checked in the DBLoader logs.
+    '''
+    def __init__(self, dbl_username, dbl_password, encryption_key = None, workers = 4, retries = 3, backoff = 2.0,
+                 result_log = UPLOAD_LOG_FILE, **session_kwargs):
+        if encryption_key is not None:
+            cipher_suite = Fernet(encryption_key.encode())  ## decrypted once, shared by all sessions
+            dbl_password = cipher_suite.decrypt( base64.urlsafe_b64decode(dbl_password)).decode()
+        self.dbl_username, self.dbl_password = dbl_username, dbl_password
+        self.workers, self.retries, self.backoff = max(workers, 1), max(retries, 1), backoff
+        self.result_log = result_log
+        self.session_kwargs = session_kwargs
+        self.run_id = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        self._idle_sessions = queue.Queue()
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def _acquire_session(self):
+        try:
+            return self._idle_sessions.get_nowait()
+        except queue.Empty:
+            session = DBLoaderSession(self.dbl_username, self.dbl_password, **self.session_kwargs)
+            with self._lock:
+                self._sessions.append(session)
+            return session
+
+    def _write_result(self, result):
+        if self.result_log is None:
+            return
+        with self._lock:
+            os.makedirs(os.path.dirname(self.result_log) or '.', exist_ok=True)
+            with open(self.result_log, 'a') as file:
+                file.write(json.dumps(result) + '\n')
+
+    def upload(self, fname, phase = ''):
+        start_time = time.perf_counter()
+        status, error, attempt = 'failed', None, 0
+        if not os.path.isfile(fname):
+            error = 'File not found'
+        else:
+            session = self._acquire_session()
+            for attempt in range(1, self.retries + 1):
+                try:
+                    session.put(fname)
+                    status, error = 'spooled', None
+                    break
+                except Exception as e:
+                    error = f'{type(e).__name__}: {e}'
+                    session.close() ## start over with a fresh connection
+                    if attempt < self.retries:
+                        time.sleep(self.backoff * 2 ** (attempt - 1))
+            self._idle_sessions.put(session)
+        result = {'run_id': self.run_id, 'file': fname, 'phase': phase, 'status': status, 'attempts': attempt,
+                  'error': error, 'elapsed_s': round(time.perf_counter() - start_time, 3),
+                  'datetime': datetime.datetime.now().isoformat()}
+        self._write_result(result)
+        return result
+
+    def skip(self, fname, prerequisite, phase = ''):
+        result = {'run_id': self.run_id, 'file': fname, 'phase': phase, 'status': 'skipped', 'attempts': 0,
+                  'error': f'Prerequisite not uploaded: {prerequisite}', 'elapsed_s': 0.0,
+                  'datetime': datetime.datetime.now().isoformat()}
+        self._write_result(result)
+        return result
+
+    def run_dag(self, dag):
+        '''
+        Does: uploads the files of an UploadDAG, each one as soon as the files it depends on are spooled.
+              Like the build files first order before, this relies on DBLoader loading the spool in arrival order.
+              The dependents of a failed file are skipped and stay pending for the next upload.
+        Return: list of per-file results
+        '''
+        results = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor, tqdm(total=len(dag)) as progress:
+            running = {executor.submit(self.upload, fname, dag.xml_type(fname)): fname for fname in dag.ready()}
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    fname = running.pop(future)
+                    result = future.result()
+                    results.append(result)
+                    progress.update()
+                    if result['status'] == 'spooled':
+                        for dependent in dag.spooled(fname):
+                            running[executor.submit(self.upload, dependent, dag.xml_type(dependent))] = dependent
+                    else:
+                        print(f"Upload failed after {result['attempts']} attempt(s): {result['file']} -- {result['error']}")
+                        for dependent in dag.reject(fname):
+                            results.append(self.skip(dependent, fname, dag.xml_type(dependent)))
+                            progress.update()
+        return results
+
+    def close(self):
+        for session in self._sessions:
+            session.close()
+
 def main(): #dbl_username, dbl_password, directory_to_search, search_date, encryption_key = None):
     default_dir = os.path.abspath(os.path.join(os.getcwd(), "../../xmls_for_dbloader_upload"))
     today = str(datetime.datetime.today().strftime('%Y-%m-%d'))
     parser = argparse.ArgumentParser(description="Script to process files in a directory.")
     parser.add_argument('-dir','--directory', type=valid_directory, default=default_dir, help="The directory to process. Default is ../../xmls_for_dbloader_upload.")
-    parser.add_argument('-date', '--date', type=lambda s: str(datetime.datetime.strptime(s, '%Y-%m-%d').date()), default=today, help=f"Date for XML generated (format: YYYY-MM-DD). Default is today's date: {today}")
+    parser.add_argument('-date', '--date', type=lambda s: str(datetime.datetime.strptime(s, '%Y-%m-%d').date()), default=None, help=f"Upload the XMLs modified on this date (format: YYYY-MM-DD), i.e. {today}, instead of the files pending in the manifest.")
     parser.add_argument('-lxu', '--dbl_username', default=None, required=False, help="Username to access lxplus.")
     parser.add_argument('-lxp', '--dbl_password', default=None, required=False, help="Password to access lxplus.")
     parser.add_argument('-k', '--encrypt_key', default=None, required=False, help="The encryption key")
+    parser.add_argument('-n', '--workers', type=int, default=4, help="Number of concurrent transfers. Default is 4.")
+    parser.add_argument('-r', '--retries', type=int, default=3, help="Attempts per file before giving up. Default is 3.")
+    parser.add_argument('-log', '--result_log', default=UPLOAD_LOG_FILE, help=f"JSON lines log of the upload result of every file. Default is {UPLOAD_LOG_FILE}.")
     args = parser.parse_args()
 
     dbl_username = args.dbl_username
@@ -108,8 +254,12 @@ def main(): #dbl_username, dbl_password, directory_to_search, search_date, encry
     encryption_key = args.encrypt_key
     search_date = args.date
 
-    print(f"Searching XML files in {directory_to_search} genetated on {search_date} ...")
-    files_found = find_files_by_date(directory_to_search, search_date)
+    if search_date is None:
+        print(f"Searching XML files in {directory_to_search} not uploaded yet ...")
+        files_found = get_pending_files(directory_to_search)
+    else:
+        print(f"Searching XML files in {directory_to_search} genetated on {search_date} ...")
+        files_found = find_files_by_date(directory_to_search, search_date)
 
     if files_found:
         print("Files found: ")
@@ -118,16 +268,24 @@ def main(): #dbl_username, dbl_password, directory_to_search, search_date, encry
         # dbl_username = input('LXPLUS Username: ')
         # dbl_password = pwinput.pwinput(prompt='LXPLUS Password: ', mask='*')
         
-        build_files, other_files = get_build_files(files_found)
-        print("Uploading build files ...")
-        for fname in tqdm(build_files):
-            scp_to_dbloader(dbl_username = dbl_username, dbl_password = dbl_password, fname = fname, encryption_key = encryption_key)
-
-        print("Uploading other files ...")
-        for fname in tqdm(other_files):
-            scp_to_dbloader(dbl_username = dbl_username, dbl_password = dbl_password, fname = fname, encryption_key = encryption_key)
+        ## a file is sent once the XMLs creating the parts it refers to are spooled, see export_dag.py
+        dag = UploadDAG(files_found, get_xml_nodes())
+        scheduler = UploadScheduler(dbl_username, dbl_password, encryption_key, workers = args.workers, retries = args.retries, result_log = args.result_log)
+        results = []
+        try:
+            print("Uploading files ...")
+            results = scheduler.run_dag(dag)
+        finally:
+            record_upload_results(results)
+            scheduler.close()
+
+        n_failed = len([result for result in results if result['status'] != 'spooled'])
+        n_skipped = len([result for result in results if result['status'] == 'skipped'])
+        print(f"Spooled {len(results) - n_failed}/{len(results)} files ({n_skipped} skipped after a failed prerequisite). Results written to {args.result_log}.")
+        if n_failed:
+            sys.exit(1)
     else:
-        print("No files found for the given date.")
+        print("No files to upload.")
 
 if __name__ == "__main__":
     main()
@@ -1,75 +1,91 @@
-import asyncpg, asyncio, os, yaml, pwinput
+import asyncio, os, sys, argparse
 from jinja2 import Template
 import numpy as np
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+from HGC_DB_postgres.src.db_session import get_conn, get_password
+from HGC_DB_postgres.export.xml_stream import format_array
 
+IV_ARRAY_COLS = ['meas_v', 'meas_i', 'meas_r']
 
-def round_to_n_sig_figs(num, n = 4):
-    if num == 0:
-        return 0.0
-    else:
-        return round(num, n - int(np.floor(np.log10(abs(num)))) - 1)
+def round_to_n_sig_figs(values, n = 4):
+    '''
+    Does: rounds a whole array to n significant figures. The exponents are computed in one NumPy pass,
+          the rounding itself is Python's round(num, n - 1 - exponent), which rounds halfway cases
+          on the exact binary value, so the text in the XML is the same as rounding number by number.
+    Return: list of floats
+    '''
+    arr = np.asarray(values, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        exponents = np.floor(np.log10(np.abs(arr)))
+    exponents[~np.isfinite(exponents)] = n - 1  ## zeros stay 0.0
+    decimals = (n - 1 - exponents).astype(int).tolist()
+    return [0.0 if value == 0 else round(value, digits) for value, digits in zip(arr.tolist(), decimals)]
 
-async def get_conn():
-    loc = '../../dbase_info/'
-    yaml_file = f'{loc}tables.yaml'
-    db_params = {
-        'database': yaml.safe_load(open(yaml_file, 'r'))['dbname'],
-        'user': 'postgres',
-        'password': pwinput.pwinput(prompt='Enter superuser password: ', mask='*'),
-        'host': yaml.safe_load(open(yaml_file, 'r'))['db_hostname']}   
-    conn = await asyncpg.connect(**db_params)
-    return conn
+def format_value(value):
+    if isinstance(value, list):
+        return ''.join(format_array(value))
+    return str(value).replace(" ","")
 
-async def get_last_entry(tech_name):    
-    conn = await get_conn()
-    col_names = ['module_name', 
+async def get_last_entry(conn, tech_name):
+    col_names = ['module_name',
                  'status', 'status_desc', 'grade', 'ratio_i_at_vs', 'ratio_at_vs', 'rel_hum', 'temp_c',
                   'program_v', 'meas_v', 'meas_i', 'meas_r','date_test','time_test','comment',
                  'inspector',]
     col_query = ', '.join(col_names)
     query = f'''SELECT DISTINCT ON (module_name) {col_query} FROM module_iv_test ORDER BY module_name, mod_ivtest_no DESC;'''
     rows = await conn.fetch(query)
-    if rows:
-        data = [{key: row[key] for key in row.keys()} for row in rows]
-        for rown in range(len(data)):
-            for key in ['meas_v', 'meas_i', 'meas_r']:
-                data[rown][key] = [round_to_n_sig_figs(num) for num in data[rown][key]]
-        data = [{key: str(row[key]).replace(" ","") for key in row.keys()} for row in data]
-        for row in data:
-            row["run_type"] = f"SI MODULE IV TEST {row['module_name'].replace('-','')}"
-            row["run_number"] = f"1"
-            row["run_begin_timestamp"] = f"{row['date_test']} {row['time_test']}"
-            row["run_end_timestamp"] = f"{row['date_test']} {row['time_test']}"
-            row["initiated_by_user"] = str(tech_name)
-            row["comment_description"] = row.pop("comment")
-            row["serial_number"] = row["module_name"]
-    await conn.close()
+    data = []
+    for row in rows:
+        row = dict(row)
+        for key in IV_ARRAY_COLS:
+            if row[key] is not None:
+                row[key] = round_to_n_sig_figs(row[key])
+        row = {key: format_value(value) for key, value in row.items()}
+        row["run_type"] = f"SI MODULE IV TEST {row['module_name'].replace('-','')}"
+        row["run_number"] = f"1"
+        row["run_begin_timestamp"] = f"{row['date_test']} {row['time_test']}"
+        row["run_end_timestamp"] = f"{row['date_test']} {row['time_test']}"
+        row["initiated_by_user"] = str(tech_name)
+        row["comment_description"] = row.pop("comment")
+        row["serial_number"] = row["module_name"]
+        data.append(row)
     return data
 
-def save_xml(data, template_file):
-    filedir = "./xmls"
+def save_xml(data, template_file, filedir = "./xmls"):
+    '''
+    Does: compiles the template once and writes the XML of every module with it
+    '''
     if not os.path.exists(filedir): os.makedirs(filedir)
+    with open(template_file, 'r') as file:
+        template = Template(file.read())
     for prop_dict in data:
-        template_file_name = os.path.basename(template_file)
         outfile = f"module_{prop_dict['module_name']}_iv_test_upload.xml"
-        with open(template_file, 'r') as file:
-            template_content = file.read()
-            template = Template(template_content)
-            rendered = template.render(prop_dict)
         with open(os.path.join(filedir, outfile), 'w') as file:
             print("Writing to", os.path.join(filedir, outfile))
-            file.write(rendered)
+            file.write(template.render(prop_dict))
 
-def main():
-    template_dir = "./"
-    template = "module_iv_test_upload.xml"
-    template_file = os.sep.join([template_dir, template])
-    tech_name = "simurthy"
+async def export_iv(dbpassword, encryption_key, tech_name, template_file, filedir):
+    dbpassword = get_password(dbpassword, encryption_key, prompt='Enter shipper password: ')
+    conn = await get_conn(user='shipper', dbpassword=dbpassword)
     try:
-        data = asyncio.run(get_last_entry(tech_name)) ## python 3.7
-    except:
-        data = (asyncio.get_event_loop()).run_until_complete(get_last_entry(tech_name)) ## python 3.6
+        data = await get_last_entry(conn, tech_name)
+    finally:
+        await conn.close()
+    save_xml(data, template_file, filedir)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates the module IV test XMLs. Run from the repository root.")
+    parser.add_argument('-dbp', '--dbpassword', default=None, required=False, help="Password to access database.")
+    parser.add_argument('-k', '--encrypt_key', default=None, required=False, help="The encryption key")
+    parser.add_argument('-dir','--directory', default=os.path.join(os.path.dirname(__file__), 'xmls'), help="The directory to save the XMLs to. Default is export/electrical_testing_xml/xmls.")
+    parser.add_argument('-u', '--initiated_by', default="simurthy", required=False, help="INITIATED_BY_USER of the XMLs.")
+    args = parser.parse_args()
 
-    save_xml(data, template_file)
+    template_file = os.path.join(os.path.dirname(__file__), "module_iv_test_upload.xml")
+    try:
+        asyncio.run(export_iv(args.dbpassword, args.encrypt_key, args.initiated_by, template_file, args.directory)) ## python 3.7
+    except AttributeError:
+        (asyncio.get_event_loop()).run_until_complete(export_iv(args.dbpassword, args.encrypt_key, args.initiated_by, template_file, args.directory)) ## python 3.6
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
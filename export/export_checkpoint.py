@@ -0,0 +1,150 @@
+'''
+Resumable export runs.
+
+Every export_pipeline run gets a run_id in export_run. The generators record the outcome of
+every part they write in export_checkpoint, in chunks as the render pool finishes them. When a
+run is resumed (-resume of export_pipeline.py), each generator skips the parts already written
+in that run and retries only the failed and unvisited ones.
+
+A resumed generator keeps the snapshot_xmin taken when the run first started it, so rows that
+changed after a part was written are still picked up by the next incremental run. The
+watermark of a generator is only saved once none of its parts failed.
+'''
+from datetime import datetime
+
+async def start_run(conn, full_run = False):
+    '''
+    Does: registers a new export run
+    Return: run_id
+    '''
+    query = """
+    INSERT INTO export_run (started_datetime, status, full_run)
+    VALUES ($1, 'running', $2) RETURNING run_id;
+    """
+    return await conn.fetchval(query, datetime.now(), full_run)
+
+async def resume_run(conn, run_id = None):
+    '''
+    Does: reopens run_id, or the latest run that did not finish, for export_pipeline -resume
+    Return: (run_id, full_run), or None if there is no run to resume
+    '''
+    if run_id is None:
+        row = await conn.fetchrow("SELECT run_id, full_run FROM export_run WHERE status != 'done' ORDER BY run_id DESC LIMIT 1;")
+    else:
+        row = await conn.fetchrow("SELECT run_id, full_run FROM export_run WHERE run_id = $1;", run_id)
+    if row is None:
+        return None
+    await conn.execute("UPDATE export_run SET status = 'running', finished_datetime = NULL WHERE run_id = $1;", row['run_id'])
+    return row['run_id'], row['full_run']
+
+async def get_failed_parts(conn, run_id):
+    '''
+    Does: lists the parts whose latest checkpoint in the run is a failure
+    Return: [(generator, part_name, error)]
+    '''
+    query = """
+    SELECT generator, part_name, error FROM (
+        SELECT DISTINCT ON (generator, part_name) generator, part_name, status, error
+        FROM export_checkpoint
+        WHERE run_id = $1 AND part_name IS NOT NULL
+        ORDER BY generator, part_name, checkpoint_no DESC) latest
+    WHERE status = 'failed'
+    ORDER BY generator, part_name;
+    """
+    return [tuple(row) for row in await conn.fetch(query, run_id)]
+
+async def finish_run(conn, run_id, generators_ok = True):
+    '''
+    Does: closes a run, as 'done' only if every generator finished and no part is left failed
+    Return: status
+    '''
+    failed_parts = await get_failed_parts(conn, run_id)
+    status = 'done' if generators_ok and not failed_parts else 'failed'
+    await conn.execute("UPDATE export_run SET status = $2, finished_datetime = $3 WHERE run_id = $1;", run_id, status, datetime.now())
+    if status != 'done':
+        for generator, part_name, error in failed_parts:
+            print(f'FAILED {generator}: {part_name}: {error}')
+        print(f'Export run {run_id} did not finish. Resume it with -resume {run_id}.')
+    return status
+
+class RunCheckpoint:
+    '''
+    Checkpoints of one generator in one run. Without a run_id (a generator run on its own)
+    nothing is recorded and every part is exported.
+    '''
+    def __init__(self, conn, run_id, generator, snapshot_xmin):
+        self.conn = conn
+        self.run_id = run_id
+        self.generator = generator
+        self.snapshot_xmin = snapshot_xmin
+        self.completed = set()
+        self.failed = {}
+
+    @classmethod
+    async def open(cls, conn, run_id, generator, snapshot_xmin):
+        '''
+        Does: loads the parts the run already wrote for this generator and the snapshot it started from
+        Return: RunCheckpoint
+        '''
+        checkpoint = cls(conn, run_id, generator, snapshot_xmin)
+        if run_id is None:
+            return checkpoint
+        started = await conn.fetchval("SELECT min(snapshot_xmin) FROM export_checkpoint WHERE run_id = $1 AND generator = $2;", run_id, generator)
+        if started is None:
+            ## first visit of the run, the start is recorded so a resume keeps this snapshot
+            await checkpoint.record([None], 'started')
+        else:
+            checkpoint.snapshot_xmin = started
+            rows = await conn.fetch("""
+                SELECT DISTINCT ON (part_name) part_name, status FROM export_checkpoint
+                WHERE run_id = $1 AND generator = $2 AND part_name IS NOT NULL
+                ORDER BY part_name, checkpoint_no DESC;""", run_id, generator)
+            checkpoint.completed = {row['part_name'] for row in rows if row['status'] == 'done'}
+            if checkpoint.completed:
+                print(f'{generator}: resuming run {run_id}, {len(checkpoint.completed)} part(s) already written.')
+        return checkpoint
+
+    def pending(self, part_list):
+        '''
+        Return: the parts of part_list not written yet in this run
+        '''
+        return [part_name for part_name in part_list if part_name not in self.completed]
+
+    def done_parts(self, part_list):
+        '''
+        Return: the parts of part_list written in this run, including the ones of earlier attempts
+        '''
+        return [part_name for part_name in part_list if part_name in self.completed]
+
+    async def record(self, part_names, status, errors = None):
+        if self.run_id is None or not part_names:
+            return
+        query = """
+        INSERT INTO export_checkpoint (run_id, generator, part_name, status, error, snapshot_xmin, checkpoint_datetime)
+        SELECT $1, $2, part_name, $3, error, $4, $5 FROM unnest($6::text[], $7::text[]) AS c(part_name, error);
+        """
+        await self.conn.execute(query, self.run_id, self.generator, status, self.snapshot_xmin, datetime.now(),
+                                list(part_names), errors or [None] * len(part_names))
+
+    async def done(self, part_names):
+        '''
+        Does: records parts whose XML is written
+        '''
+        self.completed.update(part_names)
+        await self.record(part_names, 'done')
+
+    def fail(self, part_name, error):
+        '''
+        Does: keeps a part that could not be exported, recorded by finish()
+        '''
+        self.failed[part_name] = str(error)
+
+    async def finish(self):
+        '''
+        Does: records the failed parts
+        Return: True if no part failed, the watermark can be saved
+        '''
+        await self.record(list(self.failed), 'failed', list(self.failed.values()))
+        if self.failed:
+            print(f'{self.generator}: {len(self.failed)} part(s) failed, the watermark is kept for the next run.')
+        return not self.failed
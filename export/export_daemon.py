@@ -0,0 +1,180 @@
+'''
+Export daemon driven by the insert notifications of the database.
+
+create_tables.py installs an AFTER INSERT statement trigger on every data table that calls
+pg_notify('incoming_data_notification') with the table, the number of rows, their primary key
+range and the part names inserted. The daemon LISTENs on that channel and runs the
+incremental export once a burst of inserts has settled: a station uploading a module writes
+tens of rows within a second, and they should end up in one export cycle, not tens.
+
+    - a cycle starts DEBOUNCE seconds after the last notification of a burst, and at the
+      latest MAX_DELAY seconds after its first one, so a steady stream of inserts is still exported
+    - every generator runs incrementally from its watermark (export_watermark.py), so only the
+      parts with rows changed since its last run are regenerated
+    - notifications arriving during a cycle start the next one
+    - with -upl True the files of the cycle are uploaded with dbloader_scp_xml.py
+    - a cycle runs at startup and after every reconnect, for the inserts the daemon missed
+
+The export tables written by the cycles themselves (export_watermark, export_run,
+export_checkpoint) have no insert trigger, see 'notify' in dbase_info/tables.yaml.
+
+    python export/export_daemon.py -dbp <password> -k <key>
+'''
+import os, sys, argparse, asyncio, time, datetime, traceback, json
+import pwinput
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from HGC_DB_postgres.export.src import get_conn
+from HGC_DB_postgres.export.export_pipeline import get_generator_scripts, run_generators, scp_files, str2bool, GENERATED_XMLS_DIR
+from HGC_DB_postgres.export.render_pool import set_render_workers, close_executor
+
+CHANNEL = 'incoming_data_notification'
+DEBOUNCE = 5.0     ## seconds without a notification before a burst is exported
+MAX_DELAY = 60.0   ## seconds after the first notification of a burst it is exported at the latest
+KEEPALIVE = 30.0   ## seconds between checks of the listening connection
+
+class Burst:
+    '''
+    Notifications received since the last export cycle started.
+    '''
+    def __init__(self):
+        self.event = asyncio.Event()
+        self.first = self.last = None
+        self.count = 0
+        self.changes = {}
+
+    def notify(self, connection = None, pid = None, channel = None, payload = ''):
+        '''
+        Does: records a notification and the parts of its payload, used as the asyncpg listener callback
+        '''
+        now = time.monotonic()
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.count += 1
+        try:
+            change = json.loads(payload)
+            pk_ranges, parts = self.changes.setdefault(change['table'], ({}, set()))
+            ## the parts of a large statement come in several notifications with the same pk range
+            pk_ranges[tuple(change['pk'])] = change['rows']
+            parts.update(change['parts'])
+        except (ValueError, KeyError, TypeError):
+            pass  ## empty payload of the startup catch-up, or of the row triggers of older databases
+        self.event.set()
+
+    def summary(self):
+        '''
+        Return: 'table: rows row(s), parts part(s)' of every table inserted into during the burst
+        '''
+        return ', '.join(f'{table}: {sum(pk_ranges.values())} row(s), {len(parts)} part(s)' for table, (pk_ranges, parts) in sorted(self.changes.items()))
+
+    async def settled(self, debounce = DEBOUNCE, max_delay = MAX_DELAY):
+        '''
+        Does: waits for a notification, then until the burst is quiet for debounce seconds or max_delay passed,
+              and clears it so notifications of the coming cycle start the next one
+        Return: (number of notifications, summary of the inserted rows) of the burst
+        '''
+        await self.event.wait()
+        while True:
+            now = time.monotonic()
+            wait = min(self.last + debounce - now, self.first + max_delay - now)
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        count, summary = self.count, self.summary()
+        self.event.clear()
+        self.first = self.last = None
+        self.count = 0
+        self.changes = {}
+        return count, summary
+
+async def listen(dbpassword, encryption_key, burst):
+    '''
+    Does: keeps a connection LISTENing on CHANNEL, reconnects when it is lost.
+          Inserts made while the daemon was not listening are caught up by a cycle after every (re)connect.
+    '''
+    while True:
+        try:
+            conn = await get_conn(dbpassword, encryption_key)
+        except Exception as e:
+            print(f'Cannot connect to listen on {CHANNEL}: {e}. Retrying in {KEEPALIVE:.0f} s.')
+            await asyncio.sleep(KEEPALIVE)
+            continue
+        try:
+            await conn.add_listener(CHANNEL, burst.notify)
+            print(f'Listening on {CHANNEL}.')
+            burst.notify()
+            while True:
+                await asyncio.sleep(KEEPALIVE)
+                await conn.execute('SELECT 1;')
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f'Lost the connection listening on {CHANNEL}: {e}. Reconnecting.')
+        finally:
+            if not conn.is_closed():
+                await conn.close()
+
+async def export_cycle(dbpassword, encryption_key = None, upload = False, lxplus_username = None, lxplus_password = None):
+    '''
+    Does: runs every generator incrementally, then uploads the new files if upload.
+          Raises RuntimeError if the upload failed, the files stay pending for the next cycle.
+    Return: results of run_generators
+    '''
+    results = await run_generators(get_generator_scripts(), dbpassword = dbpassword, encryption_key = encryption_key)
+    if upload:
+        ## the scp script runs in a thread so the listener keeps receiving notifications
+        loop = asyncio.get_running_loop()
+        uploaded = await loop.run_in_executor(None, scp_files, lxplus_username, lxplus_password, GENERATED_XMLS_DIR, None, encryption_key)
+        if not uploaded:
+            raise RuntimeError(f'Upload of {GENERATED_XMLS_DIR} failed, the files not spooled are retried by the next cycle.')
+    return results
+
+async def run_daemon(dbpassword, encryption_key = None, upload = False, lxplus_username = None, lxplus_password = None, debounce = DEBOUNCE, max_delay = MAX_DELAY):
+    '''
+    Does: exports every burst of inserts until interrupted
+    '''
+    burst = Burst()
+    listener = asyncio.ensure_future(listen(dbpassword, encryption_key, burst))
+    try:
+        while True:
+            count, summary = await burst.settled(debounce, max_delay)
+            print(f'{datetime.datetime.now():%Y-%m-%d %H:%M:%S} Exporting after {count} notification(s). {summary}')
+            try:
+                await export_cycle(dbpassword, encryption_key, upload, lxplus_username, lxplus_password)
+            except Exception as e:
+                ## the watermarks of the failed generators are not saved, the next cycle retries their parts
+                traceback.print_exc()
+                print(f'Export cycle failed: {e}')
+    finally:
+        listener.cancel()
+
+def main():
+    parser = argparse.ArgumentParser(description="Listens for inserts in the database and exports the XMLs of the changed parts.")
+    parser.add_argument('-dbp', '--dbpassword', default=None, required=False, help="Password to access database.")
+    parser.add_argument('-k', '--encrypt_key', default=None, required=False, help="The encryption key")
+    parser.add_argument('-upl', '--upload_stat', default='False', required=False, help="Upload the XMLs of every cycle to DBLoader.")
+    parser.add_argument('-lxu', '--dbl_username', default=None, required=False, help="Username to access lxplus.")
+    parser.add_argument('-lxp', '--dbl_password', default=None, required=False, help="Password to access lxplus.")
+    parser.add_argument('-deb', '--debounce', type=float, default=DEBOUNCE, required=False, help=f"Seconds without a new insert before exporting. Default is {DEBOUNCE:.0f}.")
+    parser.add_argument('-maxd', '--max_delay', type=float, default=MAX_DELAY, required=False, help=f"Seconds after the first insert of a burst to export at the latest. Default is {MAX_DELAY:.0f}.")
+    parser.add_argument('-rw', '--render_workers', type=int, default=None, required=False, help="Number of processes rendering the XMLs, 0 to render in the main process. Default is the number of cores.")
+    args = parser.parse_args()
+
+    dbpassword = args.dbpassword or pwinput.pwinput(prompt='Enter database shipper password: ', mask='*')
+    upload = str2bool(args.upload_stat)
+    lxplus_username, lxplus_password = args.dbl_username, args.dbl_password
+    if upload:
+        lxplus_username = lxplus_username or pwinput.pwinput(prompt='Enter lxplus username: ', mask='*')
+        lxplus_password = lxplus_password or pwinput.pwinput(prompt='Enter lxplus password: ', mask='*')
+    if args.render_workers is not None:
+        set_render_workers(args.render_workers)
+
+    try:
+        asyncio.run(run_daemon(dbpassword, args.encrypt_key, upload, lxplus_username, lxplus_password, args.debounce, args.max_delay))
+    except KeyboardInterrupt:
+        print('Export daemon stopped.')
+    finally:
+        close_executor()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+'''
+Dependency graph of the XML types, for generation and DBLoader upload.
+
+Every generator declares the XML type it writes and the XML types that have to reach DBLoader first:
+
+    XML_TYPE = ('module', 'cond_upload.xml')      ## (output subdirectory, template)
+    REQUIRES = [('module', 'assembly_upload.xml')]
+    UPLOAD = True                                 ## False for XML types not sent to the central DB
+
+A prerequisite of the same output subdirectory refers to the same part: the cond XML of a module
+only waits for the assembly XML of that module. A prerequisite of another subdirectory refers to
+the parts the XML is built from (a module assembly to its protomodule and hexaboard), so a file
+only waits for the files of that type holding one of the serial numbers it names in its
+SERIAL_NUMBER / *_SER_NUM tags. Aggregated files hold many parts, they wait for, and are waited
+for by, the whole type in their own subdirectory, and the files of the parts they name in others.
+
+The generators read the database independently and run in parallel. The uploads run as a DAG of
+files: a file is sent as soon as the files it depends on are in the DBLoader spool, instead of the
+whole build phase before everything else.
+'''
+import os, re, importlib.util
+
+XML_GENERATOR_DIR = 'export/generate_xmls_utils'## directory for py scripts to generate xmls
+GENERATOR_SUBDIRS = ['baseplate', 'hexaboard', 'module', 'protomodule', 'sensor', 'testing']
+
+def load_generator(script_path):
+    """Import a generator script as a module, without running its __main__ block."""
+    module_name = os.path.splitext(os.path.basename(script_path))[0]
+    spec = importlib.util.spec_from_file_location(module_name, script_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class XmlNode:
+    '''
+    XML type written by one generator script.
+    '''
+    def __init__(self, script_path, xml_type, requires = (), upload = True):
+        self.script_path = script_path
+        self.xml_type = tuple(xml_type)
+        self.requires = [tuple(xml_type) for xml_type in requires]
+        self.upload = upload
+
+    def __repr__(self):
+        return '/'.join(self.xml_type)
+
+def topological_order(nodes):
+    '''
+    Does: orders the nodes so every node comes after its prerequisites, prerequisites without a node are ignored
+    Return: list of XmlNode. Raises ValueError on a dependency cycle.
+    '''
+    by_type = {node.xml_type: node for node in nodes}
+    ordered, state = [], {}
+    def visit(node, path):
+        if state.get(node.xml_type) == 'done':
+            return
+        if state.get(node.xml_type) == 'visiting':
+            raise ValueError(f"Dependency cycle between XML types: {' -> '.join(map(str, path + [node]))}")
+        state[node.xml_type] = 'visiting'
+        for xml_type in node.requires:
+            if xml_type in by_type:
+                visit(by_type[xml_type], path + [node])
+        state[node.xml_type] = 'done'
+        ordered.append(node)
+    for node in sorted(nodes, key = lambda node: node.xml_type):
+        visit(node, [])
+    return ordered
+
+def get_xml_nodes(generator_dir = XML_GENERATOR_DIR, subdirs = GENERATOR_SUBDIRS):
+    '''
+    Does: reads the XML_TYPE, REQUIRES and UPLOAD declarations of the generator scripts
+    Return: list of XmlNode in dependency order
+    '''
+    nodes = []
+    for subdir in subdirs:
+        subdir_path = os.path.join(generator_dir, subdir)
+        if not os.path.exists(subdir_path):
+            continue
+        for file in sorted(os.listdir(subdir_path)):
+            if not file.endswith('.py'):
+                continue
+            script_path = os.path.join(subdir_path, file)
+            module = load_generator(script_path)
+            if not hasattr(module, 'XML_TYPE'):
+                print(f'{script_path} declares no XML_TYPE, skipped.')
+                continue
+            nodes.append(XmlNode(script_path, module.XML_TYPE, getattr(module, 'REQUIRES', []), getattr(module, 'UPLOAD', True)))
+    return topological_order(nodes)
+
+SERIAL_TAG = re.compile(r'<(?:SERIAL_NUMBER|\w+_SER_NUM)>\s*([^<\s]+)\s*</')
+
+def is_aggregated(part):
+    return re.search(r'_x\d+$', part) is not None
+
+def read_serials(fname):
+    '''
+    Return: set of the serial numbers in the SERIAL_NUMBER and *_SER_NUM tags of an XML file, empty if it cannot be read
+    '''
+    try:
+        with open(fname, 'r', encoding='utf-8', errors='replace') as file:
+            return set(SERIAL_TAG.findall(file.read()))
+    except OSError:
+        return set()
+
+class UploadDAG:
+    '''
+    Upload order of a set of files. A file is ready once every file it depends on is spooled.
+    Files of an unknown XML type have no prerequisites.
+    '''
+    def __init__(self, files, nodes):
+        self.files = list(files)
+        templates = {}
+        for node in nodes:
+            templates.setdefault(node.xml_type[0], []).append(node)
+        self.xml_types, self.parts = {}, {}
+        for fname in self.files:
+            subdir, name = os.path.basename(os.path.dirname(fname)), os.path.basename(fname)
+            for node in templates.get(subdir, []):
+                if name.endswith('_' + node.xml_type[1]):
+                    self.xml_types[fname] = node.xml_type
+                    self.parts[fname] = name[:-len(node.xml_type[1]) - 1]
+                    break
+
+        by_type = {}
+        for fname, xml_type in self.xml_types.items():
+            by_type.setdefault(xml_type, []).append(fname)
+        requires = {node.xml_type: node.requires for node in nodes}
+        self.depends_on = {fname: set() for fname in self.files}
+        self.dependents = {fname: set() for fname in self.files}
+        self.serials = {}
+        for fname, xml_type in self.xml_types.items():
+            for required in requires.get(xml_type, []):
+                for prerequisite in by_type.get(required, []):
+                    if required[0] == xml_type[0]:
+                        ## same part, aggregated files wait for the whole type
+                        if not (is_aggregated(self.parts[fname]) or is_aggregated(self.parts[prerequisite])) and self.parts[prerequisite] != self.parts[fname]:
+                            continue
+                    elif not self.provided(prerequisite) & self.named(fname):
+                        ## other parts, only those the file is built from
+                        continue
+                    self.depends_on[fname].add(prerequisite)
+                    self.dependents[prerequisite].add(fname)
+        self.waiting = {fname: len(prerequisites) for fname, prerequisites in self.depends_on.items()}
+
+    def named(self, fname):
+        '''
+        Return: serial numbers named in a file
+        '''
+        if fname not in self.serials:
+            self.serials[fname] = read_serials(fname)
+        return self.serials[fname]
+
+    def provided(self, fname):
+        '''
+        Return: serial numbers of the parts a file uploads, its part or every part of an aggregated file
+        '''
+        return self.named(fname) if is_aggregated(self.parts[fname]) else {self.parts[fname]}
+
+    def __len__(self):
+        return len(self.files)
+
+    def xml_type(self, fname):
+        '''
+        Return: 'subdirectory/template' of a file, '' if unknown
+        '''
+        return '/'.join(self.xml_types.get(fname, ()))
+
+    def ready(self):
+        '''
+        Return: the files without prerequisites, to start with
+        '''
+        return [fname for fname in self.files if self.waiting[fname] == 0]
+
+    def spooled(self, fname):
+        '''
+        Does: marks a file as copied to the DBLoader spool
+        Return: the files that became ready
+        '''
+        ready = []
+        for dependent in sorted(self.dependents[fname]):
+            self.waiting[dependent] -= 1
+            if self.waiting[dependent] == 0:
+                ready.append(dependent)
+        return ready
+
+    def reject(self, fname):
+        '''
+        Does: marks a file as failed
+        Return: the files depending on it directly or indirectly, which are not uploaded
+        '''
+        skipped, stack = [], sorted(self.dependents[fname])
+        while stack:
+            dependent = stack.pop(0)
+            if self.waiting[dependent] < 0:
+                continue
+            self.waiting[dependent] = -1
+            skipped.append(dependent)
+            stack.extend(sorted(self.dependents[dependent]))
+        return skipped
@@ -7,10 +7,15 @@
 '''
 
 import os, sys, argparse, base64, subprocess, traceback
-import shutil, pwinput, datetime
+import shutil, pwinput, datetime, asyncio, time
 from cryptography.fernet import Fernet
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from HGC_DB_postgres.export.src import get_pool
+from HGC_DB_postgres.export.render_pool import set_render_workers, set_aggregation, close_executor
+from HGC_DB_postgres.export.xml_aggregate import MAX_PARTS, MAX_BYTES
+from HGC_DB_postgres.export.export_checkpoint import start_run, resume_run, finish_run
+from HGC_DB_postgres.export.export_dag import get_xml_nodes, load_generator
 
-XML_GENERATOR_DIR = 'export/generate_xmls_utils'## directory for py scripts to generate xmls
 GENERATED_XMLS_DIR = 'export/xmls_for_upload'##  directory to store the generated xmls. Feel free to change it. 
 
 # Ensure the generated XML directory exists
@@ -20,47 +25,71 @@ def str2bool(boolstr):
     dictstr = {'True': True, 'False': False}
     return dictstr[boolstr]
 
-def run_script(script_path, dbpassword, output_dir=GENERATED_XMLS_DIR, encryption_key = None):
-    """Run a Python script as a subprocess."""
-    # process = subprocess.run([sys.executable, script_path])
+async def run_generator(script_path, pool, dbpassword, output_dir=GENERATED_XMLS_DIR, encryption_key = None, full_run = False, run_id = None):
+    """Run the main coroutine of a generator script with a connection of the shared pool."""
+    start_time = time.perf_counter()
     try:
-        process = subprocess.run([sys.executable, script_path,'-dbp', dbpassword, '-dir', output_dir ,'-k', encryption_key], check=True)
-    except subprocess.CalledProcessError as e:
+        module = load_generator(script_path)
+        await module.main(dbpassword = dbpassword, output_dir = output_dir, encryption_key = encryption_key, pool = pool, full_run = full_run, run_id = run_id)
+        status = 'done'
+    except Exception as e:
         traceback.print_exc()
-        print(f"Error occurred while running the script: {e}")
-
-def generate_xmls(dbpassword, encryption_key = None):
-    """Recursively loop through specific subdirectories under generate_xmls directory and run all Python scripts."""
-    tasks = []
-    # Specific subdirectories to process
-    subdirs = ['baseplate', 'hexaboard', 'module', 'protomodule', 'sensor', 'testing']
-    scripts_to_run = []
-
-    for subdir in subdirs:
-        subdir_path = os.path.join(XML_GENERATOR_DIR, subdir)
-        
-        if os.path.exists(subdir_path):
-            for file in os.listdir(subdir_path):
-                
-                ## We only upload build_upload.xml for all parts EXCEPT protomodule and modules. 
-                if (subdir_path.split('/')[-1] in ['protomodule', 'module']) and (file.endswith('build_xml.py') == False):
-                    script_path = os.path.join(subdir_path, file)
-                    scripts_to_run.append(script_path)
-                    
-                elif subdir_path.split('/')[-1] not in ['protomodule', 'module']:
-                    script_path = os.path.join(subdir_path, file)
-                    scripts_to_run.append(script_path)
-
-    #Run all the scripts asynchronously
-    total_scripts = len(scripts_to_run)
-    completed_scripts = 0
-    for script_path in scripts_to_run:
-        run_script(script_path = script_path, dbpassword = dbpassword, encryption_key = encryption_key)
-        completed_scripts += 1
-        print('-'*10)
-        print(f'Executed -- {script_path}.')
-        print(f"Progress: {completed_scripts}/{total_scripts} XML file types generated.")
-        print('-'*10); print('')
+        print(f"Error occurred while running the script {script_path}: {e}")
+        status = 'failed'
+    return script_path, status, time.perf_counter() - start_time
+
+async def open_run(conn, full_run = False, resume = False):
+    """Start a new export run, or reopen the last unfinished one (resume = True) or a given run id.
+    A resumed run keeps the full_run of its first attempt. Return: (run_id, full_run)"""
+    if resume is not False:
+        run = await resume_run(conn, None if resume is True else resume)
+        if run is not None:
+            print(f'Resuming export run {run[0]}.')
+            return run
+        print('No export run to resume, starting a new one.')
+    return await start_run(conn, full_run), full_run
+
+async def run_generators(scripts_to_run, dbpassword, encryption_key = None, full_run = False, resume = False):
+    """Run all generator scripts concurrently under one event loop, sharing one connection pool.
+    The parts written are checkpointed under one export run, so an interrupted run can be resumed."""
+    start_time = time.perf_counter()
+    pool = await get_pool(dbpassword, encryption_key, max_size = max(len(scripts_to_run), 1))
+    try:
+        async with pool.acquire() as conn:
+            run_id, full_run = await open_run(conn, full_run, resume)
+        results = await asyncio.gather(*[run_generator(script_path = script_path, pool = pool, dbpassword = dbpassword, encryption_key = encryption_key, full_run = full_run, run_id = run_id) for script_path in scripts_to_run])
+        async with pool.acquire() as conn:
+            await finish_run(conn, run_id, generators_ok = all(status == 'done' for _, status, _ in results))
+    finally:
+        await pool.close()
+
+    print('-'*10)
+    for script_path, status, elapsed in sorted(results, key = lambda result: result[2], reverse = True):
+        print(f'{elapsed:8.2f} s  {status:6s}  {script_path}')
+    print(f"Generated {len([r for r in results if r[1] == 'done'])}/{len(results)} XML file types in {time.perf_counter() - start_time:.2f} s.")
+    print('-'*10); print('')
+    return results
+
+def get_generator_scripts():
+    """List the generator scripts of the XML types uploaded to the central DB, in dependency order.
+    The generators declare their XML type and prerequisites (XML_TYPE, REQUIRES, UPLOAD), see export_dag.py."""
+    return [node.script_path for node in get_xml_nodes() if node.upload]
+
+def generate_xmls(dbpassword, encryption_key = None, full_run = False, render_workers = None, aggregation = None, resume = False):
+    """Recursively loop through specific subdirectories under generate_xmls directory and run all Python scripts.
+    aggregation = (max_parts, max_bytes) packs the parts of each build and cond template into files with repeated DATA_SET/PART blocks.
+    resume = True continues the last unfinished export run, or the run of that id, skipping the parts it already wrote."""
+    if render_workers is not None:
+        set_render_workers(render_workers)
+    if aggregation is not None:
+        set_aggregation(*aggregation)
+    scripts_to_run = get_generator_scripts()
+
+    #Run all the scripts concurrently, the XMLs are rendered on the render processes
+    try:
+        asyncio.run(run_generators(scripts_to_run, dbpassword = dbpassword, encryption_key = encryption_key, full_run = full_run, resume = resume))
+    finally:
+        close_executor()
 
 def scp_files(lxplus_username, lxplus_password, directory, search_date, encryption_key = None):
     """Call the scp script to transfer files."""
@@ -69,11 +98,14 @@ def scp_files(lxplus_username, lxplus_password, directory, search_date, encrypti
                        'export/dbloader_scp_xml.py', 
                        '-lxu', lxplus_username, 
                        '-lxp', lxplus_password, 
-                       '-dir', directory,
-                       '-date', str(search_date),
-                       '-k', encryption_key]
+                       '-dir', directory]
+        if encryption_key is not None:
+            scp_command.extend(['-k', encryption_key])
+        if search_date is not None:
+            scp_command.extend(['-date', str(search_date)])
     
         process = subprocess.run(scp_command, check=True)
+        return True
 
     except Exception as e:
         traceback.print_exc()
@@ -105,11 +137,18 @@ def main():
     parser.add_argument('-lxp', '--dbl_password', default=None, required=False, help="Password to access lxplus.")
     parser.add_argument('-k', '--encrypt_key', default=None, required=False, help="The encryption key")
     parser.add_argument('-dir','--directory', type=valid_directory, default=GENERATED_XMLS_DIR, help="The directory to process. Default is ../../xmls_for_dbloader_upload.")
-    parser.add_argument('-date', '--date', type=lambda s: datetime.datetime.strptime(s, '%Y-%m-%d').date(), default=today, help=f"Date for XML generated (format: YYYY-MM-DD). Default is today's date: {today}")
+    parser.add_argument('-date', '--date', type=lambda s: datetime.datetime.strptime(s, '%Y-%m-%d').date(), default=None, help=f"Upload the XMLs modified on this date (format: YYYY-MM-DD), i.e. {today}. Default is every file not uploaded yet.")
     parser.add_argument('-gen', '--generate_stat', default='True', required=False, help="Generate XMLs.")
     parser.add_argument('-upl', '--upload_stat', default='True', required=False, help="Upload to DBLoader without generate.")
     parser.add_argument('-delx', '--del_xml', default='False', required=False, help="Delete XMLs after upload.")
+    parser.add_argument('-full', '--full_export', default='False', required=False, help="Export every pending part, ignoring the last run of each generator.")
+    parser.add_argument('-rw', '--render_workers', type=int, default=None, required=False, help="Number of processes rendering the XMLs, 0 to render in the main process. Default is the number of cores.")
+    parser.add_argument('-agg', '--aggregate', default='False', required=False, help="Pack the parts of each build and cond XML type into files with repeated DATA_SET/PART blocks.")
+    parser.add_argument('-aggn', '--aggregate_parts', type=int, default=MAX_PARTS, required=False, help=f"Maximum number of parts per aggregated XML. Default is {MAX_PARTS}.")
+    parser.add_argument('-aggs', '--aggregate_mb', type=float, default=MAX_BYTES / 1024 / 1024, required=False, help=f"Maximum size of an aggregated XML in MB. Default is {MAX_BYTES // 1024 // 1024}.")
+    parser.add_argument('-resume', '--resume_run', default='False', required=False, help="True to resume the last export run that did not finish, or the run id to resume. Parts already written in that run are skipped.")
     args = parser.parse_args()
+    resume = str2bool(args.resume_run) if args.resume_run in ['True', 'False'] else int(args.resume_run)
 
     dbpassword = args.dbpassword or pwinput.pwinput(prompt='Enter database shipper password: ', mask='*')
     lxplus_username = args.dbl_username or pwinput.pwinput(prompt='Enter lxplus username: ', mask='*')
@@ -120,7 +159,9 @@ def main():
 
     ## Step 1: Generate XML files
     if str2bool(args.generate_stat):
-        generate_xmls(dbpassword = dbpassword, encryption_key = encryption_key)
+        generate_xmls(dbpassword = dbpassword, encryption_key = encryption_key, full_run = str2bool(args.full_export), render_workers = args.render_workers,
+                      aggregation = (args.aggregate_parts, int(args.aggregate_mb * 1024 * 1024)) if str2bool(args.aggregate) else None,
+                      resume = resume)
 
     ## Step 2: SCP files to central DB
 
@@ -0,0 +1,109 @@
+'''
+Incremental export with per-generator watermarks.
+
+Every successful generator run inserts a row in export_watermark with the snapshot xmin
+taken before it read the database, i.e. every transaction below it had finished. The insert and
+update triggers of the data tables log the parts every transaction changed in export_change_log
+(see log_change() in create/create_tables.py). The next run only selects parts with a pending row
+and a change logged by a transaction not older than that watermark, so a daily export costs time
+proportional to the parts inserted or updated since the last run.
+
+The status updates of the generators (xml_gen_datetime, xml_upload_success) are not logged, so
+an exported part does not count as changed again, for its own generator or for the other
+generators reading the same tables.
+
+The log is pruned below the oldest watermark of the generators export_pipeline.py and
+export_daemon.py run, the ones declaring UPLOAD = True (see export_dag.py). A generator run by
+hand, i.e. one with UPLOAD = False, does not hold the log back. When its watermark is below the
+pruned range its next run is a full run.
+'''
+import os, sys
+from datetime import datetime
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from HGC_DB_postgres.export.export_dag import get_xml_nodes
+
+GENERATOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'generate_xmls_utils')
+
+_scheduled_generators = None
+
+def get_scheduled_generators():
+    '''
+    Return: names of the generators run by export_pipeline.py and export_daemon.py, read once per process
+    '''
+    global _scheduled_generators
+    if _scheduled_generators is None:
+        _scheduled_generators = sorted(os.path.splitext(os.path.basename(node.script_path))[0]
+                                       for node in get_xml_nodes(GENERATOR_DIR) if node.upload)
+    return _scheduled_generators
+
+async def get_prune_horizon(conn):
+    '''
+    Return: txid below which export_change_log is pruned, the oldest latest watermark of the scheduled generators, or None
+    '''
+    query = """
+    SELECT min(snapshot_xmin) FROM (
+        SELECT DISTINCT ON (generator) snapshot_xmin FROM export_watermark
+        WHERE generator = ANY($1)
+        ORDER BY generator, watermark_no DESC) latest;
+    """
+    return await conn.fetchval(query, get_scheduled_generators())
+
+async def get_snapshot_xmin(conn):
+    '''
+    Does: oldest transaction still running, every transaction below it is committed or aborted
+    Return: 64-bit txid
+    '''
+    return await conn.fetchval("SELECT txid_snapshot_xmin(txid_current_snapshot());")
+
+async def get_watermark(conn, generator):
+    '''
+    Does: reads the last successful run of a generator
+    Return: record (snapshot_xmin, run_datetime) or None
+    '''
+    query = """
+    SELECT snapshot_xmin, run_datetime FROM export_watermark
+    WHERE generator = $1
+    ORDER BY watermark_no DESC LIMIT 1;
+    """
+    return await conn.fetchrow(query, generator)
+
+async def get_export_parts(conn, generator, part_col, part_tables, full_run = False, pending_col = 'xml_upload_success'):
+    '''
+    params: generator name, part name column (i.e. module_name), tables the parts are read from,
+            full_run to ignore the watermark and take every part with a pending row
+    Return: (sorted part list, snapshot_xmin to save with save_watermark once the run succeeded)
+    '''
+    snapshot_xmin = await get_snapshot_xmin(conn)
+    watermark = None if full_run else await get_watermark(conn, generator)
+    if watermark is not None and generator not in get_scheduled_generators():
+        ## the changes since an older watermark may be pruned already
+        horizon = await get_prune_horizon(conn)
+        if horizon is not None and watermark['snapshot_xmin'] < horizon:
+            watermark = None
+
+    params, changed_filter = [], lambda table: ''
+    if watermark is not None:
+        params = [watermark['snapshot_xmin']]
+        changed_filter = lambda table: f"""AND {part_col} IN (
+        SELECT part_name FROM export_change_log WHERE table_name = '{table}' AND part_col = '{part_col}' AND txid >= $1)"""
+
+    query = '\nUNION\n'.join([f"""SELECT {part_col} FROM {table}
+    WHERE {part_col} IS NOT NULL AND {pending_col} IS NULL {changed_filter(table)}""" for table in part_tables]) + ';'
+    rows = await conn.fetch(query, *params)
+    part_list = sorted(row[part_col] for row in rows)
+    print(f"{generator}: {len(part_list)} part(s) to export ({'full run' if watermark is None else 'changed since ' + str(watermark['run_datetime'])}).")
+    return part_list, snapshot_xmin
+
+async def save_watermark(conn, generator, snapshot_xmin, status_xid, parts_exported, full_run = False):
+    '''
+    Does: records a successful run of a generator
+    '''
+    query = """
+    INSERT INTO export_watermark (generator, run_datetime, snapshot_xmin, status_xid, parts_exported, full_run)
+    VALUES ($1, $2, $3, $4, $5, $6);
+    """
+    await conn.execute(query, generator, datetime.now(), snapshot_xmin, status_xid, parts_exported, full_run)
+    ## changes below the oldest watermark of the scheduled generators were seen by every one of them
+    horizon = await get_prune_horizon(conn)
+    if horizon is not None:
+        await conn.execute("DELETE FROM export_change_log WHERE txid < $1;", horizon)
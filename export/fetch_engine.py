@@ -0,0 +1,323 @@
+'''
+Set-based fetch of the database values that fill an XML template.
+
+The entries of a table_to_xml_var.yaml section are grouped by dbase_table and the
+latest pending row of every part is pulled with one query per table, so an export
+costs O(tables) round trips instead of O(parts x fields).
+
+Part names are never formatted into the SQL. Every statement binds the part list as $1
+and is prepared once on the connection of the export, so it is parsed and planned once.
+'''
+import re, asyncio, argparse, yaml
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from HGC_DB_postgres.export.define_global_var import LOCATION
+from HGC_DB_postgres.export.src import get_kind_of_part, get_conn, get_parts_name
+
+## ordering used to pick the latest row of a part in each table
+LATEST_ROW_ORDER = {'module_assembly': 'ass_run_date DESC, ass_time_begin DESC',
+                    'proto_assembly': 'ass_run_date DESC, ass_time_begin DESC',
+                    'module_inspect': 'date_inspect DESC, time_inspect DESC',
+                    'proto_inspect': 'date_inspect DESC, time_inspect DESC',
+                    'hxb_inspect': 'date_inspect DESC, time_inspect DESC',
+                    'bp_inspect': 'date_inspect DESC, time_inspect DESC',
+                    'back_wirebond': 'date_bond DESC, time_bond DESC',
+                    'front_wirebond': 'date_bond DESC, time_bond DESC',
+                    'bond_pull_test': 'date_bond DESC, time_bond DESC',
+                    'back_encap': 'date_encap DESC, time_encap DESC',
+                    'front_encap': 'date_encap DESC, time_encap DESC',
+                    'module_pedestal_test': 'date_test DESC, time_test DESC',
+                    'hxb_pedestal_test': 'date_test DESC, time_test DESC',
+                    'baseplate': 'bp_received DESC',
+                    'sensor': 'sen_received DESC'}
+
+_identifier = re.compile(r'^[a-z_][a-z0-9_]*$')
+
+def split_dbase_col(dbase_col):
+    '''
+    Does: splits a dbase_col of the yaml into plain column names, i.e. 'ass_run_date, ass_time_begin'
+    Return: list of column names, or None if dbase_col is an SQL expression
+    '''
+    cols = [col.strip() for col in str(dbase_col).split(',')]
+    if all(_identifier.match(col) for col in cols):
+        return cols
+    return None
+
+def group_entries_by_table(xml_data, part_col, extra_cols = None):
+    '''
+    Does: groups the yaml entries that read columns of a single table by their dbase_table
+    Return: {dbase_table: [select items]}
+    '''
+    tables = {table: list(cols) for table, cols in (extra_cols or {}).items()}
+    for entry in xml_data:
+        dbase_col, dbase_table = entry.get('dbase_col'), entry.get('dbase_table')
+        if not dbase_col or not dbase_table or entry.get('nested_query'):
+            continue
+        cols = split_dbase_col(dbase_col)
+        if cols is None:
+            ## expressions are selected under the name of the xml variable
+            cols = [f"({dbase_col}) AS {entry['xml_temp_val'].lower()}"]
+        select_items = tables.setdefault(dbase_table, [])
+        for col in cols:
+            if col != part_col and col not in select_items:
+                select_items.append(col)
+    return tables
+
+def table_query(table, select_items, part_col, pending_col = 'xml_upload_success'):
+    '''
+    Does: builds the statement that selects the latest pending row of every part bound to $1 from one table
+    Return: query
+    '''
+    order_by = f", {LATEST_ROW_ORDER[table]}" if table in LATEST_ROW_ORDER else ''
+    return f"""
+    SELECT DISTINCT ON ({part_col}) {', '.join([part_col] + select_items)}
+    FROM {table}
+    WHERE {part_col} = ANY($1)
+    AND {pending_col} IS NULL
+    ORDER BY {part_col}{order_by};
+    """
+
+def nested_query(entry, part_table, part_col, pending_col = 'xml_upload_success'):
+    '''
+    Does: builds the statement of a yaml nested_query for all parts bound to $1.
+          A nested_query written for a single part, i.e. ... WHERE module_name = '{module_name}', is run as a
+          subquery per part name instead of formatting the name into the SQL.
+    Return: query selecting (part_name, value)
+    '''
+    query = entry['nested_query'].strip().rstrip('";').strip()
+    part_placeholder = f"'{{{part_col}}}'"
+    if part_placeholder in query:
+        query = query.replace(part_placeholder, 'parts.part_name')
+        return f"""SELECT parts.part_name, ({query}) FROM unnest($1::text[]) AS parts(part_name);"""
+    query = re.sub(r'^\s*SELECT\s', f'SELECT DISTINCT ON ({part_table}.{part_col}) {part_table}.{part_col} AS part_name, ',
+                   query, count=1, flags=re.IGNORECASE)
+    return query + f""" WHERE {part_table}.{part_col} = ANY($1) AND {part_table}.{pending_col} IS NULL ORDER BY {part_table}.{part_col};"""
+
+async def prepare_statement(conn, query):
+    '''
+    Does: prepares a statement on conn, so it is parsed and planned once per export however many parts are bound to it
+    Return: PreparedStatement, or None if the statement is invalid
+    '''
+    try:
+        return await conn.prepare(query)
+    except Exception as e:
+        print('QUERY:', query)
+        print('ERROR:', e)
+        return None
+
+async def prepare_section(conn, xml_data, part_col, part_table, extra_cols = None, pending_col = 'xml_upload_success'):
+    '''
+    Does: prepares the statements of a yaml section on conn, one per dbase_table and one per nested_query
+    Return: ({dbase_table: PreparedStatement}, {xml_var: PreparedStatement}), invalid statements are left out
+    '''
+    table_statements, nested_statements = {}, {}
+    for table, select_items in group_entries_by_table(xml_data, part_col, extra_cols).items():
+        statement = await prepare_statement(conn, table_query(table, select_items, part_col, pending_col))
+        if statement is not None:
+            table_statements[table] = statement
+    for entry in xml_data:
+        if entry.get('nested_query'):
+            statement = await prepare_statement(conn, nested_query(entry, part_table, part_col, pending_col))
+            if statement is not None:
+                nested_statements[entry['xml_temp_val']] = statement
+    return table_statements, nested_statements
+
+async def fetch_statement(statement, part_list):
+    try:
+        return await statement.fetch(part_list)
+    except Exception as e:
+        print('QUERY:', statement.get_query())
+        print('ERROR:', e)
+        return []
+
+async def stream_table_rows(conn, table, select_items, part_col, part_list, pending_col = 'xml_upload_success', prefetch = 10):
+    '''
+    Does: selects the latest pending row of every part like fetch_part_rows, read through a server-side cursor so only
+          prefetch rows are held at a time. Used for tables with large array columns. Must be iterated inside a transaction.
+    Return: async generator of (part_name, {db_col: value})
+    '''
+    statement = await conn.prepare(table_query(table, select_items, part_col, pending_col))
+    async for row in statement.cursor(part_list, prefetch=prefetch):
+        yield row[part_col], dict(row)
+
+async def fetch_part_rows_by_table(conn, xml_data, part_col, part_list, part_table, extra_cols = None, pending_col = 'xml_upload_success'):
+    '''
+    Does: same as fetch_part_rows with one statement per dbase_table and nested_query,
+          used when the compiled statement of a section cannot be prepared
+    Return: {part_name: {dbase_table: {db_col: value}, 'nested_query': {xml_var: value}}}
+    '''
+    part_rows = {part_name: {'nested_query': {}} for part_name in part_list}
+    if not part_list:
+        return part_rows
+
+    # Part names are always bound as $1, the statements are the same for every export
+    table_statements, nested_statements = await prepare_section(conn, xml_data, part_col, part_table, extra_cols, pending_col)
+    for table, statement in table_statements.items():
+        for row in await fetch_statement(statement, part_list):
+            part_rows[row[part_col]][table] = dict(row)
+
+    for xml_var, statement in nested_statements.items():
+        for row in await fetch_statement(statement, part_list):
+            part_rows[row[0]]['nested_query'][xml_var] = row[1]
+    return part_rows
+
+_select_alias = re.compile(r'\sAS\s+([a-z_][a-z0-9_]*)\s*$', re.IGNORECASE)
+
+class CompiledSection:
+    def __init__(self, query, part_col, table_cols, nested_cols):
+        self.query = query              ## one statement for the whole section, part names bound as $1
+        self.part_col = part_col
+        self.table_cols = table_cols    ## [(dbase_table, found column, [(db_col, column)])]
+        self.nested_cols = nested_cols  ## [(xml_var, found column, column)]
+
+    def split_row(self, row):
+        '''
+        Does: splits a row of the compiled statement into the per table rows build_db_values reads.
+              Tables and nested queries without a pending row for the part are left out, as in fetch_part_rows_by_table.
+        Return: {dbase_table: {db_col: value}, 'nested_query': {xml_var: value}}
+        '''
+        part_rows = {'nested_query': {}}
+        for table, found, cols in self.table_cols:
+            if row[found]:
+                table_row = {self.part_col: row['part_name']}
+                table_row.update({db_col: row[col] for db_col, col in cols})
+                part_rows[table] = table_row
+        for xml_var, found, col in self.nested_cols:
+            if row[found]:
+                part_rows['nested_query'][xml_var] = row[col]
+        return part_rows
+
+def compile_section(xml_data, part_col, part_table, extra_cols = None, pending_col = 'xml_upload_success'):
+    '''
+    Does: compiles a yaml section into one statement. The latest pending row of every dbase_table and the
+          nested queries are CTEs, left joined to the part names bound as $1, so the section costs one round trip
+          however many tables and fields it reads.
+    Return: CompiledSection
+    '''
+    ctes, selects, joins = [], ['parts.part_name'], []
+    table_cols, nested_cols = [], []
+    for n, (table, select_items) in enumerate(group_entries_by_table(xml_data, part_col, extra_cols).items()):
+        alias = f't{n}'
+        ctes.append(f"{alias} AS ({table_query(table, select_items, part_col, pending_col).strip().rstrip(';')})")
+        joins.append(f"LEFT JOIN {alias} ON {alias}.{part_col} = parts.part_name")
+        selects.append(f"{alias}.{part_col} IS NOT NULL AS {alias}_found")
+        cols = []
+        for item in select_items:
+            match = _select_alias.search(item)
+            db_col = match.group(1) if match else item
+            selects.append(f"{alias}.{db_col} AS {alias}_{db_col}")
+            cols.append((db_col, f'{alias}_{db_col}'))
+        table_cols.append((table, f'{alias}_found', cols))
+
+    nested_entries = [entry for entry in xml_data if entry.get('nested_query')]
+    for n, entry in enumerate(nested_entries):
+        alias = f'n{n}'
+        ctes.append(f"{alias}(part_name, value) AS ({nested_query(entry, part_table, part_col, pending_col).strip().rstrip(';')})")
+        joins.append(f"LEFT JOIN {alias} ON {alias}.part_name = parts.part_name")
+        selects.append(f"{alias}.part_name IS NOT NULL AS {alias}_found")
+        selects.append(f"{alias}.value AS {alias}_value")
+        nested_cols.append((entry['xml_temp_val'], f'{alias}_found', f'{alias}_value'))
+
+    with_clause = ('WITH ' + ',\n'.join(ctes) + '\n') if ctes else ''
+    query = (with_clause + 'SELECT ' + ',\n    '.join(selects) +
+             '\nFROM unnest($1::text[]) AS parts(part_name)\n' + '\n'.join(joins) + ';')
+    return CompiledSection(query, part_col, table_cols, nested_cols)
+
+async def fetch_part_rows(conn, xml_data, part_col, part_list, part_table, extra_cols = None, pending_col = 'xml_upload_success'):
+    '''
+    params: yaml section, part name column (i.e. module_name), parts to export,
+            table the part is assembled in (used to filter nested queries),
+            additional {dbase_table: [db_col]} to fetch alongside the yaml entries
+    Does: runs the compiled statement of the section, prepared on the connection of the export
+    Return: {part_name: {dbase_table: {db_col: value}, 'nested_query': {xml_var: value}}}
+    '''
+    part_rows = {part_name: {'nested_query': {}} for part_name in part_list}
+    if not part_list:
+        return part_rows
+    compiled = compile_section(xml_data, part_col, part_table, extra_cols, pending_col)
+    statement = await prepare_statement(conn, compiled.query)
+    if statement is None:
+        print('Compiled section statement failed, fetching one statement per table.')
+        return await fetch_part_rows_by_table(conn, xml_data, part_col, part_list, part_table, extra_cols, pending_col)
+    for row in await fetch_statement(statement, part_list):
+        part_rows[row['part_name']] = compiled.split_row(row)
+    return part_rows
+
+def build_db_values(xml_data, part_name, part_rows):
+    '''
+    Does: resolves every xml variable of a yaml section from the rows fetched for one part
+    Return: {xml_var: value}; variables without a pending row are left out
+    '''
+    db_values = {}
+    for entry in xml_data:
+        xml_var = entry['xml_temp_val']
+        if xml_var in ['LOCATION', 'INSTITUTION', 'MANUFACTURER']:
+            db_values[xml_var] = LOCATION
+        elif xml_var in ['ID', 'BARCODE']:
+            db_values[xml_var] = part_name
+        elif xml_var == 'KIND_OF_PART':
+            db_values[xml_var] = get_kind_of_part(part_name)
+        elif xml_var.startswith('KIND_OF_PART_'):
+            continue
+        elif entry.get('nested_query'):
+            if xml_var in part_rows.get('nested_query', {}):
+                db_values[xml_var] = part_rows['nested_query'][xml_var]
+        else:
+            dbase_col, dbase_table = entry.get('dbase_col'), entry.get('dbase_table')
+            row = part_rows.get(dbase_table)
+            if not dbase_col or row is None:
+                continue
+            cols = split_dbase_col(dbase_col)
+            if cols is None:
+                db_values[xml_var] = row[xml_var.lower()]
+            elif len(cols) == 2:
+                ## date and time columns are combined into a timestamp, NULL columns are left empty
+                run_date, run_time = ('' if row[col] is None else row[col] for col in cols)
+                db_values[xml_var] = f"{run_date}T{run_time}"
+            else:
+                db_values[xml_var] = row[cols[0]]
+
+    ## KIND_OF_PART_<CHILD> is decoded from the serial number filled for <CHILD>, i.e. KIND_OF_PART_PCB from PCB
+    for entry in xml_data:
+        xml_var = entry['xml_temp_val']
+        if xml_var.startswith('KIND_OF_PART_'):
+            child_name = db_values.get(xml_var[len('KIND_OF_PART_'):])
+            db_values[xml_var] = get_kind_of_part(child_name) if child_name else ''
+    return db_values
+
+async def explain_section(conn, compiled, part_list, analyze = False):
+    '''
+    Does: runs EXPLAIN on the compiled statement of a section with part_list bound
+    Return: plan as text
+    '''
+    rows = await conn.fetch(f"EXPLAIN {'(ANALYZE) ' if analyze else ''}{compiled.query}", part_list)
+    return '\n'.join(row[0] for row in rows)
+
+async def main(section, part_col, part_table, dbpassword, encryption_key = None, explain = False, analyze = False):
+    with open('export/table_to_xml_var.yaml', 'r') as file:
+        xml_data = yaml.safe_load(file)[section]
+    compiled = compile_section(xml_data, part_col, part_table)
+    print(compiled.query)
+    if not explain:
+        return
+    conn = await get_conn(dbpassword, encryption_key)
+    try:
+        part_list = [part_name for part_name in await get_parts_name(part_col, part_table, conn) if part_name]
+        print(f'\nPlan for {len(part_list)} part(s) of {part_table}:')
+        print(await explain_section(conn, compiled, part_list, analyze))
+    finally:
+        await conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prints the statement a table_to_xml_var.yaml section is compiled into, and its plan.")
+    parser.add_argument('-s', '--section', required=True, help="Section of table_to_xml_var.yaml, i.e. module_build.")
+    parser.add_argument('-pc', '--part_col', default='module_name', required=False, help="Part name column, i.e. module_name.")
+    parser.add_argument('-pt', '--part_table', default='module_assembly', required=False, help="Table the part is assembled in, i.e. module_assembly.")
+    parser.add_argument('-dbp', '--dbpassword', default=None, required=False, help="Password to access database.")
+    parser.add_argument('-k', '--encrypt_key', default=None, required=False, help="The encryption key")
+    parser.add_argument('-explain', '--explain', default='False', required=False, help="True to print the plan for every part of part_table.")
+    parser.add_argument('-analyze', '--analyze', default='False', required=False, help="True to run the statement with EXPLAIN ANALYZE.")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.section, args.part_col, args.part_table, args.dbpassword, args.encrypt_key,
+                     explain = args.explain == 'True', analyze = args.analyze == 'True'))
@@ -6,9 +6,17 @@ import yaml, os, base64, sys, argparse, traceback
 from cryptography.fernet import Fernet
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', '..')))
 from HGC_DB_postgres.export.define_global_var import LOCATION
-from HGC_DB_postgres.export.src import get_conn, fetch_from_db, update_xml_with_db_values, get_parts_name, get_kind_of_part, update_timestamp_col
+from HGC_DB_postgres.export.src import get_conn, get_parts_name, update_status_cols
+from HGC_DB_postgres.export.render_pool import write_xmls
+from HGC_DB_postgres.export.fetch_engine import fetch_part_rows, build_db_values
+from HGC_DB_postgres.export.export_watermark import get_export_parts, save_watermark
+from HGC_DB_postgres.export.export_checkpoint import RunCheckpoint
 
-async def process_module(conn, yaml_file, xml_file_path, output_dir):
+## Node of the export DAG, see export_dag.py: (output subdirectory, template) and the XML types spooled to DBLoader first
+XML_TYPE = ('baseplate', 'cond_upload.xml')
+REQUIRES = [('baseplate', 'build_upload.xml')]
+
+async def process_module(conn, yaml_file, xml_file_path, output_dir, full_run = False, run_id = None):
     # Load the YAML file
     with open(yaml_file, 'r') as file:
         yaml_data = yaml.safe_load(file)
@@ -26,106 +34,60 @@ async def process_module(conn, yaml_file, xml_file_path, output_dir):
     # Construct the output file path
     # output_file_path = os.path.join(output_dir, os.path.basename(xml_file_path))
     bp_tables = ['baseplate', 'bp_inspect']
-    _bp_list = []
-    for bp_table in bp_tables:
-        _bp_list.extend(await get_parts_name('bp_name', bp_table, conn))
-    bp_list = list(set(_bp_list))
+    # Only parts with pending rows changed since the last successful run, unless full_run
+    bp_list, snapshot_xmin = await get_export_parts(conn, generator = 'generate_bp_cond_xml', part_col = 'bp_name', part_tables = bp_tables, full_run = full_run)
+    # Parts already written by an interrupted run are skipped when it is resumed
+    checkpoint = await RunCheckpoint.open(conn, run_id, 'generate_bp_cond_xml', snapshot_xmin)
+    snapshot_xmin = checkpoint.snapshot_xmin
+
+    # Fetch the latest pending rows of all parts at once, one compiled statement for the section
+    part_rows = await fetch_part_rows(conn, wb_data, part_col = 'bp_name', part_list = checkpoint.pending(bp_list), part_table = 'baseplate')
 
-    for bp_name in bp_list:
-        # Fetch database values for the XML template variables
+    render_jobs = []
+    for bp_name in checkpoint.pending(bp_list):
         print(f'--> {bp_name}...')
+        db_values = {}
         try:
-            db_values = {}
-
-            for entry in wb_data:
-                xml_var = entry['xml_temp_val']
-
-                if xml_var in ['LOCATION', 'INSTITUTION']:
-                    db_values[xml_var] = LOCATION
-                elif xml_var == 'ID':
-                    db_values[xml_var] = bp_name
-                elif xml_var == 'KIND_OF_PART':
-                    db_values[xml_var] = get_kind_of_part(bp_name)
-                else:
-                    dbase_col = entry['dbase_col']
-                    dbase_table = entry['dbase_table']
-
-                    # Skip entries without a database column or table
-                    if not dbase_col and not dbase_table:
-                        continue
-
-                    # Ignore nested queries for now
-                    if entry['nested_query']:
-                        query = entry['nested_query'] + f" WHERE {dbase_table}.bp_name = '{bp_name}' AND xml_upload_success IS NULL;"
-                        
-                        # print(f'Executing query: {query}')
-
-                    else:
-                        # Modify the query to get the latest entry
-                        if dbase_table in ['baseplate']:
-                            query = f"""
-                            SELECT {dbase_col} FROM {dbase_table}
-                            WHERE bp_name = '{bp_name}'
-                            AND xml_upload_success IS NULL
-                            LIMIT 1;
-                            """
-                        else:
-                            query = f"""
-                            SELECT {dbase_col} FROM {dbase_table} 
-                            WHERE bp_name = '{bp_name}'
-                            AND xml_upload_success IS NULL
-                            ORDER BY date_inspect DESC, time_inspect DESC LIMIT 1;
-                            """
-                    try:
-                        results = await fetch_from_db(query, conn)  # Use conn directly
-                    except Exception as e:
-                        print('QUERY:', query)
-                        print('ERROR:', e)
-
-                    if results:
-                        if xml_var == "RUN_BEGIN_TIMESTAMP_":
-                            # Fetching both ass_run_date and ass_time_begin
-                            run_date = results.get("date_inspect", "")
-                            time_begin = results.get("time_inspect", "")
-                            db_values[xml_var] = f"{run_date}T{time_begin}"
-                        elif xml_var == "RUN_END_TIMESTAMP_":
-                            run_date = results.get("ass_run_date", "")
-                            time_end = results.get("ass_time_end", "")
-                            db_values[xml_var] = f"{run_date}T{time_end}"
-                        elif xml_var == "CURE_BEGIN_TIMESTAMP_":
-                            run_date = results.get("ass_run_date", "")
-                            time_end = results.get("ass_time_begin", "")
-                            db_values[xml_var] = f"{run_date}T{time_end}"
-                        elif xml_var == "CURE_END_TIMESTAMP_":
-                            run_date = results.get("cure_date_end", "")
-                            time_end = results.get("cure_time_end", "")
-                            db_values[xml_var] = f"{run_date}T{time_end}"
-                        else:
-                            db_values[xml_var] = results.get(dbase_col, '') if not entry['nested_query'] else list(results.values())[0]
+            # Fill the XML template variables from the fetched rows
+            db_values = build_db_values(wb_data, bp_name, part_rows[bp_name])
         except Exception as e:
             print('#'*30, f'ERROR','#'*30 ); traceback.print_exc(); print('')
-            
+            checkpoint.fail(bp_name, e)
+            continue
+
         output_file_name = f'{bp_name}_{os.path.basename(xml_file_path)}'
         output_file_path = os.path.join(output_dir, output_file_name)
-        await update_xml_with_db_values(xml_file_path, output_file_path, db_values)
-        await update_timestamp_col(conn,
-                                   update_flag=True,
-                                   table_list=db_tables,
-                                   column_name='xml_gen_datetime',
-                                   part='baseplate',
-                                   part_name=bp_name)
-
-async def main(dbpassword, output_dir, encryption_key = None):
+        render_jobs.append((output_file_path, db_values))
+
+    # Render and write the XMLs on the render processes, the event loop stays free for the other generators
+    await write_xmls(xml_file_path, render_jobs, checkpoint = checkpoint)
+
+    # Status of all exported parts in one transaction, ignored by the next incremental run
+    status_xid = await update_status_cols(conn,
+                                          table_list=db_tables,
+                                          part='baseplate',
+                                          part_names=checkpoint.done_parts(bp_list),
+                                          column_name='xml_gen_datetime')
+    if await checkpoint.finish():
+        await save_watermark(conn, 'generate_bp_cond_xml', snapshot_xmin, status_xid, len(bp_list), full_run)
+
+async def main(dbpassword, output_dir, encryption_key = None, pool = None, full_run = False, run_id = None):
     # Configuration
     yaml_file = 'export/table_to_xml_var.yaml'  # Path to YAML file
     xml_file_path = 'export/template_examples/baseplate/cond_upload.xml'# XML template file path
     xml_output_dir = output_dir + '/baseplate'  # Directory to save the updated XML
 
-    # Create PostgreSQL connection pool
+    # Use a connection of the shared pool when run by export_pipeline
+    if pool is not None:
+        async with pool.acquire() as conn:
+            await process_module(conn, yaml_file, xml_file_path, xml_output_dir, full_run, run_id)
+        return
+
+    # Create PostgreSQL connection
     conn = await get_conn(dbpassword, encryption_key)
 
     try:
-        await process_module(conn, yaml_file, xml_file_path, xml_output_dir)
+        await process_module(conn, yaml_file, xml_file_path, xml_output_dir, full_run, run_id)
     finally:
         await conn.close()
 
@@ -135,11 +97,13 @@ if __name__ == "__main__":
     parser.add_argument('-dbp', '--dbpassword', default=None, required=False, help="Password to access database.")
     parser.add_argument('-k', '--encrypt_key', default=None, required=False, help="The encryption key")
     parser.add_argument('-dir','--directory', default=None, help="The directory to process. Default is ../../xmls_for_dbloader_upload.")
+    parser.add_argument('-full', '--full_export', default='False', required=False, help="Export every pending part, ignoring the last run.")
     args = parser.parse_args()   
 
     dbpassword = args.dbpassword
     output_dir = args.directory
     encryption_key = args.encrypt_key
+    full_run = args.full_export == 'True'
 
     # if len(sys.argv) > 4:
     #     print("Usage: script_b.py <dbpassword> <output_dir> <encryption_key")
@@ -152,4 +116,4 @@ if __name__ == "__main__":
     # except:
     #     encryption_key = None
 
-    asyncio.run(main(dbpassword, output_dir, encryption_key))
+    asyncio.run(main(dbpassword = dbpassword, output_dir = output_dir, encryption_key = encryption_key, full_run = full_run))
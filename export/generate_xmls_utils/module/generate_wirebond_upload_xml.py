@@ -6,9 +6,17 @@ import yaml, os, base64, sys, argparse, traceback
 from cryptography.fernet import Fernet
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', '..')))
 from HGC_DB_postgres.export.define_global_var import LOCATION
-from HGC_DB_postgres.export.src import get_conn, fetch_from_db, update_xml_with_db_values, get_parts_name, get_kind_of_part, update_timestamp_col
+from HGC_DB_postgres.export.src import get_conn, get_parts_name, update_status_cols
+from HGC_DB_postgres.export.render_pool import write_xmls
+from HGC_DB_postgres.export.fetch_engine import fetch_part_rows, build_db_values
+from HGC_DB_postgres.export.export_watermark import get_export_parts, save_watermark
+from HGC_DB_postgres.export.export_checkpoint import RunCheckpoint
 
-async def process_module(conn, yaml_file, xml_file_path, output_dir):
+## Node of the export DAG, see export_dag.py: (output subdirectory, template) and the XML types spooled to DBLoader first
+XML_TYPE = ('module', 'wirebond_upload.xml')
+REQUIRES = [('module', 'assembly_upload.xml')]
+
+async def process_module(conn, yaml_file, xml_file_path, output_dir, full_run = False, run_id = None):
     # Load the YAML file
     with open(yaml_file, 'r') as file:
         yaml_data = yaml.safe_load(file)
@@ -22,136 +30,71 @@ async def process_module(conn, yaml_file, xml_file_path, output_dir):
 
     db_tables = ['back_wirebond', 'front_wirebond', 'bond_pull_test', 'back_encap', 'front_encap']
     module_tables = ['module_assembly', 'mod_hxb_other_test', 'module_info', 'module_inspect', 'module_iv_test', 'module_pedestal_test', 'module_pedestal_plots', 'module_qc_summary']
-    _module_list = []
-    for module_table in module_tables:
-        _module_list.extend(await get_parts_name('module_name', module_table, conn))
-    module_list = list(set(_module_list))
-
-    for module in module_list:
+    # Only parts with pending rows changed since the last successful run, unless full_run
+    module_list, snapshot_xmin = await get_export_parts(conn, generator = 'generate_wirebond_upload_xml', part_col = 'module_name', part_tables = module_tables, full_run = full_run)
+    # Parts already written by an interrupted run are skipped when it is resumed
+    checkpoint = await RunCheckpoint.open(conn, run_id, 'generate_wirebond_upload_xml', snapshot_xmin)
+    snapshot_xmin = checkpoint.snapshot_xmin
+
+    # The comment columns of these tables are concatenated instead of read through the yaml nested_query
+    comment_vars = {'WIREBOND_COMMENTS_CONCAT': ['back_wirebond', 'front_wirebond'],
+                    'ENCAPSULATION_COMMENTS_CONCAT': ['back_encap', 'front_encap']}
+    wb_entries = [entry for entry in wb_data if entry['xml_temp_val'] not in comment_vars]
+    comment_cols = {table: ['comment'] for tables in comment_vars.values() for table in tables}
+
+    # Fetch the latest pending rows of all parts at once, one compiled statement for the section
+    part_rows = await fetch_part_rows(conn, wb_entries, part_col = 'module_name', part_list = checkpoint.pending(module_list), part_table = 'module_assembly', extra_cols = comment_cols)
+
+    render_jobs = []
+    for module in checkpoint.pending(module_list):
         print(f'--> {module}...')
+        db_values = {}
         try:
-            # Fetch database values for the XML template variables
-            db_values = {}
-
-            for entry in wb_data:
-                xml_var = entry['xml_temp_val']
-
-                if xml_var in ['LOCATION', 'INSTITUTION']:
-                    db_values[xml_var] = LOCATION
-                elif xml_var == 'ID':
-                    db_values[xml_var] = module
-                elif xml_var == 'KIND_OF_PART':
-                    db_values[xml_var] = get_kind_of_part(module)
-                else:
-                    dbase_col = entry['dbase_col']
-                    dbase_table = entry['dbase_table']
-
-                    # Skip entries without a database column or table
-                    if not dbase_col and not dbase_table:
-                        continue
-
-                    # Ignore nested queries for now
-                    if entry['nested_query']:
-                        if dbase_col == 'comment':
-                            query = f"""
-                            (
-                                SELECT comment AS back_wirebond_comment
-                                FROM back_wirebond
-                                WHERE module_name = '{module}'
-                                AND xml_upload_success IS NULL
-                                ORDER BY date_bond DESC, time_bond DESC
-                                LIMIT 1
-                            )
-                            UNION ALL
-                            (
-                                SELECT comment AS front_wirebond_comment
-                                FROM front_wirebond
-                                WHERE module_name = '{module}'
-                                AND xml_upload_success IS NULL
-                                ORDER BY date_bond DESC, time_bond DESC
-                                LIMIT 1
-                            );
-                            """
-                        else:
-                            query = entry['nested_query'] + f" WHERE {dbase_table}.module_name = '{module}' AND xml_upload_success IS NULL;"
-                        
-                        # print(f'Executing query: {query}')
-
-                    else:
-                        # Modify the query to get the latest entry
-                        if dbase_table in ['back_encap', 'front_encap']:
-                            query = f"""
-                            SELECT {dbase_col} FROM {dbase_table}
-                            WHERE module_name = '{module}'
-                            AND xml_upload_success IS NULL
-                            ORDER BY date_encap DESC, time_encap DESC
-                            LIMIT 1;
-                            """
-                        elif dbase_table == 'module_info':
-                            query = f"""
-                            SELECT {dbase_col} FROM {dbase_table}
-                            WHERE module_name = '{module}'
-                            AND xml_upload_success IS NULL;
-                            """
-                        else:
-                            query = f"""
-                            SELECT {dbase_col} FROM {dbase_table} 
-                            WHERE module_name = '{module}'
-                            AND xml_upload_success IS NULL
-                            ORDER BY date_bond DESC, time_bond DESC LIMIT 1;
-                            """
-                    # print(f'Executing query -- \n\t{query}')
-                    try:
-                        results = await fetch_from_db(query, conn)  # Use conn directly
-                    except Exception as e:
-                        print('QUERY:', query)
-                        print('ERROR:', e)
-
-                    if results:
-                        if xml_var == "RUN_BEGIN_TIMESTAMP_":
-                            # Fetching both ass_run_date and ass_time_begin
-                            run_date = results.get("date_bond", "")
-                            time_begin = results.get("time_bond", "")
-                            db_values[xml_var] = f"{run_date}T{time_begin}"
-                        elif xml_var == "RUN_NAME_TIME_STAMP":
-                            run_date = results.get("date_bond", "")
-                            time_end = results.get("time_bond", "")
-                            db_values[xml_var] = f"{run_date}T{time_end}"
-                        elif xml_var == "WIREBOND_COMMENTS_CONCAT":
-                            bk_comment = results.get("back_wirebond_comment", "")
-                            fr_comment = results.get("front_wirebond_comment", "")
-                            db_values[xml_var] = f"{bk_comment}-{fr_comment}"
-                        elif xml_var == "ENCAPSULATION_COMMENTS_CONCAT":
-                            bk_comment = results.get("back_encap_comment", "")
-                            fr_comment = results.get("front_encap_comment", "")
-                            db_values[xml_var] = f"{bk_comment}-{fr_comment}"
-                        else:
-                            db_values[xml_var] = results.get(dbase_col, '') if not entry['nested_query'] else list(results.values())[0]
-
+            # Fill the XML template variables from the fetched rows
+            db_values = build_db_values(wb_entries, module, part_rows[module])
+            for xml_var, (bk_table, fr_table) in comment_vars.items():
+                ## always filled, "-" without wirebond or encapsulation rows
+                bk_comment = (part_rows[module].get(bk_table) or {}).get('comment') or ''
+                fr_comment = (part_rows[module].get(fr_table) or {}).get('comment') or ''
+                db_values[xml_var] = f"{bk_comment}-{fr_comment}"
         except Exception as e:
             print('#'*30, f'ERROR','#'*30 ); traceback.print_exc(); print('')
-            
+            checkpoint.fail(module, e)
+            continue
+
         output_file_name = f'{module}_{os.path.basename(xml_file_path)}'
         output_file_path = os.path.join(output_dir, output_file_name)
-        await update_xml_with_db_values(xml_file_path, output_file_path, db_values)
-        await update_timestamp_col(conn,
-                                   update_flag=True,
-                                   table_list=db_tables,
-                                   column_name='xml_gen_datetime',
-                                   part='module',
-                                   part_name=module)
-        
-async def main(dbpassword, output_dir, encryption_key = None):
+        render_jobs.append((output_file_path, db_values))
+
+    # Render and write the XMLs on the render processes, the event loop stays free for the other generators
+    await write_xmls(xml_file_path, render_jobs, checkpoint = checkpoint)
+
+    # Status of all exported parts in one transaction, ignored by the next incremental run
+    status_xid = await update_status_cols(conn,
+                                          table_list=db_tables,
+                                          part='module',
+                                          part_names=checkpoint.done_parts(module_list),
+                                          column_name='xml_gen_datetime')
+    if await checkpoint.finish():
+        await save_watermark(conn, 'generate_wirebond_upload_xml', snapshot_xmin, status_xid, len(module_list), full_run)
+
+async def main(dbpassword, output_dir, encryption_key = None, pool = None, full_run = False, run_id = None):
     # Configuration
     yaml_file = 'export/table_to_xml_var.yaml'  # Path to YAML file
     xml_file_path = 'export/template_examples/module/wirebond_upload.xml'# XML template file path
     xml_output_dir = output_dir + '/module'  # Directory to save the updated XML
 
-    # Create PostgreSQL connection pool
+    # Use a connection of the shared pool when run by export_pipeline
+    if pool is not None:
+        async with pool.acquire() as conn:
+            await process_module(conn, yaml_file, xml_file_path, xml_output_dir, full_run, run_id)
+        return
+
+    # Create PostgreSQL connection
     conn = await get_conn(dbpassword, encryption_key)
 
     try:
-        await process_module(conn, yaml_file, xml_file_path, xml_output_dir)
+        await process_module(conn, yaml_file, xml_file_path, xml_output_dir, full_run, run_id)
     finally:
         await conn.close()
 
@@ -161,10 +104,12 @@ if __name__ == "__main__":
     parser.add_argument('-dbp', '--dbpassword', default=None, required=False, help="Password to access database.")
     parser.add_argument('-k', '--encrypt_key', default=None, required=False, help="The encryption key")
     parser.add_argument('-dir','--directory', default=None, help="The directory to process. Default is ../../xmls_for_dbloader_upload.")
+    parser.add_argument('-full', '--full_export', default='False', required=False, help="Export every pending part, ignoring the last run.")
     args = parser.parse_args()   
 
     dbpassword = args.dbpassword
     output_dir = args.directory
     encryption_key = args.encrypt_key
+    full_run = args.full_export == 'True'
 
-    asyncio.run(main(dbpassword = dbpassword, output_dir = output_dir, encryption_key = encryption_key))
+    asyncio.run(main(dbpassword = dbpassword, output_dir = output_dir, encryption_key = encryption_key, full_run = full_run))
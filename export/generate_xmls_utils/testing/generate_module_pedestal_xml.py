@@ -0,0 +1,51 @@
+import asyncio
+import os, sys, argparse
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', '..')))
+from HGC_DB_postgres.export.src import get_conn
+from HGC_DB_postgres.export.pedestal_export import export_pedestal
+
+## Node of the export DAG, see export_dag.py: (output subdirectory, template) and the XML types spooled to DBLoader first
+XML_TYPE = ('module', 'module_pedestal_test.xml')
+REQUIRES = [('module', 'assembly_upload.xml')]
+UPLOAD = False ## pedestal XMLs were never sent to the central DB, run the script on its own to generate until the upload is validated
+
+async def process_module(conn, yaml_file, xml_file_path, output_dir, full_run = False, run_id = None):
+    await export_pedestal(conn, 'generate_module_pedestal_xml', 'module_pedestal', 'module_pedestal_test', 'module', 'module_name',
+                          yaml_file, xml_file_path, output_dir, full_run, run_id)
+
+async def main(dbpassword, output_dir, encryption_key = None, pool = None, full_run = False, run_id = None):
+    # Configuration
+    yaml_file = 'export/table_to_xml_var.yaml'  # Path to YAML file
+    xml_file_path = 'export/template_examples/testing/module_pedestal_test.xml'# XML template file path
+    xml_output_dir = output_dir + '/module'  # Directory to save the updated XML
+
+    # Use a connection of the shared pool when run by export_pipeline
+    if pool is not None:
+        async with pool.acquire() as conn:
+            await process_module(conn, yaml_file, xml_file_path, xml_output_dir, full_run, run_id)
+        return
+
+    # Create PostgreSQL connection
+    conn = await get_conn(dbpassword, encryption_key)
+
+    try:
+        await process_module(conn, yaml_file, xml_file_path, xml_output_dir, full_run, run_id)
+    finally:
+        await conn.close()
+
+# Run the asyncio program
+if __name__ == "__main__":
+    
+    parser = argparse.ArgumentParser(description="A script that modifies a table and requires the -t argument.")
+    parser.add_argument('-dbp', '--dbpassword', default=None, required=False, help="Password to access database.")
+    parser.add_argument('-k', '--encrypt_key', default=None, required=False, help="The encryption key")
+    parser.add_argument('-dir','--directory', default=None, help="The directory to process. Default is ../../xmls_for_dbloader_upload.")
+    parser.add_argument('-full', '--full_export', default='False', required=False, help="Export every pending part, ignoring the last run.")
+    args = parser.parse_args()   
+
+    dbpassword = args.dbpassword
+    output_dir = args.directory
+    encryption_key = args.encrypt_key
+    full_run = args.full_export == 'True'
+
+    asyncio.run(main(dbpassword = dbpassword, output_dir = output_dir, encryption_key = encryption_key, full_run = full_run))
@@ -0,0 +1,148 @@
+'''
+Kind-of-part decoder for serial numbers.
+
+The code tables under 'kind_of_part' in export/resource.yaml are loaded once. Decoded serials
+are kept in an LRU cache, since the generators decode the same module, protomodule and PCB
+serials several times per export. decode_many() decodes a batch in one pass.
+
+The same tables are compiled into the SQL function kind_of_part(text), created by
+create/create_tables.py, i.e. SELECT module_name, kind_of_part(module_name) FROM module_info;
+'''
+import json, yaml
+from functools import lru_cache
+
+RESOURCE_YAML = 'export/resource.yaml'
+CACHE_SIZE = 65536
+
+_code_tables = None
+
+def get_code_tables():
+    '''
+    Does: reads the kind_of_part code tables of resource.yaml on first use
+    Return: {part_type, resolution, geometry, sensor_thickness, material, sensor, sensor_geometry}
+    '''
+    global _code_tables
+    if _code_tables is None:
+        with open(RESOURCE_YAML, 'r') as file:
+            _code_tables = yaml.safe_load(file)['kind_of_part']
+    return _code_tables
+
+@lru_cache(maxsize=CACHE_SIZE)
+def decode(part_name):
+    '''
+    params: part_name can be module_name, hxb_name, proto_name, sen_name, bp_name and so on.
+    Does: decodes the kind of part from the serial number. Unknown codes raise KeyError.
+    Return: kind_of_part, '' for hexaboards, baseplates and empty names
+    '''
+    if not part_name:
+        return ''
+    codes = get_code_tables()
+
+    if part_name.replace('_', '').isdigit():
+        ## this is for sensor.
+        ## 2) convension v2
+        ## TXXXXX_N: [thickness / resolution]XXXXX_[geometry]
+        sen_thickness, resolution = codes['sensor'][part_name[0]][0:2]
+        sen_geometry = codes['sensor_geometry'][part_name[-1]]
+        return f'{sen_thickness}um Si Sensor {resolution} {sen_geometry}'
+
+    part_id = (part_name[0:3].replace('320', '') + part_name[3:]).replace('-', '')
+    part_type = codes['part_type'][part_id[0]]
+    if part_type in ['Hexaboard', 'Baseplate']: ## Fill out here once it's finalized.
+        return ''
+
+    if part_type == 'Sensor':
+        ## 1) convension v1
+        ## 320-ST-TTT-NNNNNN
+        ### T-TTT: [resolution]-[sen_thickness][geometry][sensor structure]
+        resolution = codes['resolution'][part_id[1]]
+        sen_thickness = codes['sensor_thickness'][part_id[2]]
+        geometry = codes['geometry'][part_id[3]]
+        return f'{sen_thickness}um Si {part_type} {resolution} {geometry}'
+
+    resolution = codes['resolution'][part_id[1]]
+    geometry = codes['geometry'][part_id[2]]
+    sen_thickness = codes['sensor_thickness'][part_id[3]]
+    bp_material = codes['material'][part_id[4]]
+    module_type = ''
+    if bp_material == 'CuW':
+        module_type = 'EM'
+    elif bp_material in ['Ti', 'CF']:
+        module_type = 'HAD'
+    return f'{module_type} {sen_thickness}um Si {part_type} {resolution} {geometry}'
+
+_no_default = object()
+
+def decode_many(part_names, default = _no_default):
+    '''
+    Does: decodes a batch of serial numbers, every distinct serial once.
+          With a default, serials with unknown codes get the default instead of raising KeyError.
+    Return: list of kind_of_part in the order of part_names
+    '''
+    decoded = {}
+    for part_name in set(part_names):
+        try:
+            decoded[part_name] = decode(part_name)
+        except (KeyError, IndexError):
+            if default is _no_default:
+                raise
+            decoded[part_name] = default
+    return [decoded[part_name] for part_name in part_names]
+
+def kind_of_part_function_sql():
+    '''
+    Does: compiles the code tables into an SQL function with the same rules as decode().
+          Unknown codes return NULL instead of raising.
+    Return: CREATE OR REPLACE FUNCTION kind_of_part(text) statement
+    '''
+    codes = json.dumps(get_code_tables()).replace("'", "''")
+    return f"""
+        CREATE OR REPLACE FUNCTION kind_of_part(part_name TEXT)
+        RETURNS TEXT AS $$
+        DECLARE
+            codes CONSTANT jsonb := '{codes}'::jsonb;
+            part_id TEXT;
+            part_type TEXT;
+            resolution TEXT;
+            geometry TEXT;
+            sen_thickness TEXT;
+            bp_material TEXT;
+            module_type TEXT := '';
+        BEGIN
+            IF part_name IS NULL OR part_name = '' THEN
+                RETURN '';
+            END IF;
+
+            IF replace(part_name, '_', '') ~ '^[0-9]+$' THEN
+                sen_thickness := codes->'sensor'->left(part_name, 1)->>0;
+                resolution := codes->'sensor'->left(part_name, 1)->>1;
+                geometry := codes->'sensor_geometry'->>right(part_name, 1);
+                RETURN sen_thickness || 'um Si Sensor ' || resolution || ' ' || geometry;
+            END IF;
+
+            part_id := replace(replace(left(part_name, 3), '320', '') || substr(part_name, 4), '-', '');
+            part_type := codes->'part_type'->>substr(part_id, 1, 1);
+            IF part_type IN ('Hexaboard', 'Baseplate') THEN
+                RETURN '';
+            ELSIF part_type = 'Sensor' THEN
+                resolution := codes->'resolution'->>substr(part_id, 2, 1);
+                sen_thickness := codes->'sensor_thickness'->>substr(part_id, 3, 1);
+                geometry := codes->'geometry'->>substr(part_id, 4, 1);
+                RETURN sen_thickness || 'um Si ' || part_type || ' ' || resolution || ' ' || geometry;
+            END IF;
+
+            resolution := codes->'resolution'->>substr(part_id, 2, 1);
+            geometry := codes->'geometry'->>substr(part_id, 3, 1);
+            sen_thickness := codes->'sensor_thickness'->>substr(part_id, 4, 1);
+            bp_material := codes->'material'->>substr(part_id, 5, 1);
+            IF bp_material IS NULL THEN
+                RETURN NULL;
+            ELSIF bp_material = 'CuW' THEN
+                module_type := 'EM';
+            ELSIF bp_material IN ('Ti', 'CF') THEN
+                module_type := 'HAD';
+            END IF;
+            RETURN module_type || ' ' || sen_thickness || 'um Si ' || part_type || ' ' || resolution || ' ' || geometry;
+        END;
+        $$ LANGUAGE plpgsql IMMUTABLE;
+        """
@@ -0,0 +1,69 @@
+'''
+Export of the pedestal test XMLs, shared by the module and hexaboard pedestal generators in
+generate_xmls_utils/testing.
+
+A pedestal test row holds per-channel arrays of a few thousand values, so the rows are read one
+at a time through a server-side cursor and every XML is streamed to its file (xml_stream.py)
+instead of rendered in memory.
+'''
+import os, sys, traceback
+import yaml
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from HGC_DB_postgres.export.src import update_status_cols
+from HGC_DB_postgres.export.fetch_engine import group_entries_by_table, stream_table_rows, build_db_values
+from HGC_DB_postgres.export.export_watermark import get_export_parts, save_watermark
+from HGC_DB_postgres.export.export_checkpoint import RunCheckpoint
+from HGC_DB_postgres.export.xml_stream import stream_template
+from HGC_DB_postgres.export.upload_manifest import record_generated
+
+CHUNK_SIZE = 64  ## parts read per cursor transaction and checkpointed together
+
+async def export_pedestal(conn, generator, yaml_key, table, part, part_col, yaml_file, xml_file_path, output_dir, full_run = False, run_id = None, chunk_size = CHUNK_SIZE):
+    '''
+    params: generator name, section of table_to_xml_var.yaml, pedestal table, part ('module', 'hexaboard') and its name column
+    Does: streams the XML of every part with a pending pedestal row changed since the last run, unless full_run,
+          and checkpoints them every chunk_size parts
+    '''
+    with open(yaml_file, 'r') as file:
+        xml_data = yaml.safe_load(file)[yaml_key]
+    if not xml_data:
+        print("No data found in YAML file")
+        return
+    db_tables = [table]
+
+    # Only parts with pending rows changed since the last successful run, unless full_run
+    part_list, snapshot_xmin = await get_export_parts(conn, generator = generator, part_col = part_col, part_tables = db_tables, full_run = full_run)
+    # Parts already written by an interrupted run are skipped when it is resumed
+    checkpoint = await RunCheckpoint.open(conn, run_id, generator, snapshot_xmin)
+    snapshot_xmin = checkpoint.snapshot_xmin
+
+    # The per-channel arrays are read one row at a time through a cursor and streamed to the XML.
+    # The cursor needs a transaction, the parts are read in chunks and checkpointed once the
+    # transaction of their chunk is closed, so a crash does not roll back the checkpoints.
+    select_items = group_entries_by_table(xml_data, part_col)[table]
+    pending = checkpoint.pending(part_list)
+    for start in range(0, len(pending), chunk_size):
+        written = []
+        async with conn.transaction():
+            async for part_name, row in stream_table_rows(conn, table, select_items, part_col, pending[start:start + chunk_size]):
+                print(f'--> {part_name}...')
+                try:
+                    db_values = build_db_values(xml_data, part_name, {table: row})
+                    output_file_name = f'{part_name}_{os.path.basename(xml_file_path)}'
+                    output_file_path = os.path.join(output_dir, output_file_name)
+                    sha256 = stream_template(xml_file_path, output_file_path, db_values)
+                    record_generated(output_file_path, xml_file_path, sha256 = sha256)
+                    written.append(part_name)
+                except Exception as e:
+                    print('#'*30, f'ERROR','#'*30 ); traceback.print_exc(); print('')
+                    checkpoint.fail(part_name, e)
+        await checkpoint.done(written)
+
+    # Status of all exported parts in one transaction, ignored by the next incremental run
+    status_xid = await update_status_cols(conn,
+                                          table_list=db_tables,
+                                          part=part,
+                                          part_names=checkpoint.done_parts(part_list),
+                                          column_name='xml_gen_datetime')
+    if await checkpoint.finish():
+        await save_watermark(conn, generator, snapshot_xmin, status_xid, len(part_list), full_run)
@@ -0,0 +1,165 @@
+'''
+Rendering stage of the export, run on a pool of worker processes.
+
+Filling the compiled templates is pure Python and holds the GIL, so for thousands of parts it
+blocked the event loop the generators share and kept the export on one core. The generators
+now queue (output_file_path, db_values) jobs and hand them over in chunks. Each worker renders
+and writes its files and returns their sha256, and the parent records them in the upload
+manifest in job order. A file's content only depends on its own values, so the output does not
+depend on the number of workers.
+
+The worker count defaults to the number of cores. It can be set with -rw/--render_workers of
+export_pipeline.py or a 'render_workers' entry in dbase_info/conn.yaml. 0 renders in the event loop.
+
+With aggregation on (-agg of export_pipeline.py) the workers return the rendered build and cond
+XMLs and the parent packs the parts of each template into files with repeated DATA_SET/PART
+blocks, see xml_aggregate.py.
+'''
+import os, sys, asyncio
+from concurrent.futures import ProcessPoolExecutor
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from HGC_DB_postgres.export.xml_template import get_template, render_template
+from HGC_DB_postgres.export.upload_manifest import record_generated, content_hash
+from HGC_DB_postgres.src.db_session import get_conn_info
+from HGC_DB_postgres.export.xml_aggregate import aggregate, aggregated_file_name, can_aggregate
+
+CHUNK_SIZE = 64  ## parts per job sent to a worker
+
+_executor = None
+_workers = None
+_aggregation = None  ## (max_parts, max_bytes) when aggregated output is on
+
+def set_render_workers(workers):
+    '''
+    Does: sets the number of render processes, before the first export of the process
+    '''
+    global _workers
+    _workers = workers
+
+def set_aggregation(max_parts, max_bytes):
+    '''
+    Does: turns on aggregated output of the build and cond XMLs, at most max_parts parts and about max_bytes bytes per file
+    '''
+    global _aggregation
+    _aggregation = (max_parts, max_bytes)
+
+def get_render_workers():
+    '''
+    Return: -rw/--render_workers if set, else render_workers of conn.yaml, else the number of cores
+    '''
+    if _workers is not None:
+        return _workers
+    workers = get_conn_info().get('render_workers')
+    if workers is None:
+        workers = os.cpu_count() or 1
+    return workers
+
+def get_executor():
+    '''
+    Does: starts the render processes on first use
+    Return: ProcessPoolExecutor, or None when rendering in the event loop
+    '''
+    global _executor
+    workers = get_render_workers()
+    if workers <= 0:
+        return None
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=workers)
+    return _executor
+
+def close_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+
+def render_chunk(xml_file_path, jobs):
+    '''
+    Does: renders and writes a chunk of parts, the template is compiled once per worker
+    Return: [(output_file_path, sha256)]
+    '''
+    template = get_template(xml_file_path)
+    written = []
+    for output_file_path, db_values in jobs:
+        rendered = render_template(template, db_values)
+        os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+        with open(output_file_path, 'wb') as file:
+            file.write(rendered)
+        written.append((output_file_path, content_hash(rendered)))
+    return written
+
+def render_chunk_content(xml_file_path, jobs):
+    '''
+    Does: renders a chunk of parts without writing them, for aggregated output
+    Return: [(output_file_path, rendered XML as bytes)]
+    '''
+    template = get_template(xml_file_path)
+    return [(output_file_path, render_template(template, db_values)) for output_file_path, db_values in jobs]
+
+def write_aggregated(xml_file_path, rendered_jobs):
+    '''
+    Does: packs the rendered parts into aggregated files next to where the per-part files would be
+    Return: [(output_file_path, sha256)]
+    '''
+    max_parts, max_bytes = _aggregation
+    template_name = os.path.basename(xml_file_path)
+    output_dir = os.path.dirname(rendered_jobs[0][0])
+    ## per-part file names are {part}_{template}
+    rendered_parts = [(os.path.basename(output_file_path)[:-len(template_name) - 1], rendered) for output_file_path, rendered in rendered_jobs]
+    os.makedirs(output_dir, exist_ok=True)
+    written = []
+    for part_names, content in aggregate(rendered_parts, max_parts, max_bytes):
+        output_file_path = os.path.join(output_dir, aggregated_file_name(part_names, template_name))
+        with open(output_file_path, 'wb') as file:
+            file.write(content)
+        written.append((output_file_path, content_hash(content)))
+    return written
+
+async def write_xmls(xml_file_path, jobs, chunk_size = CHUNK_SIZE, checkpoint = None):
+    '''
+    params: template path, [(output_file_path, db_values)], RunCheckpoint of the generator
+    Does: renders the jobs in chunks on the render processes, registers the files for upload
+          and checkpoints the parts of every chunk as soon as it is written
+    Return: number of files written
+    '''
+    if not jobs:
+        return 0
+    template_name = os.path.basename(xml_file_path)
+
+    async def register(written, part_names):
+        for output_file_path, sha256 in written:
+            record_generated(output_file_path, xml_file_path, sha256 = sha256)
+        if checkpoint is not None:
+            await checkpoint.done(part_names)
+
+    def chunk_parts(chunk):
+        ## per-part file names are {part}_{template}
+        return [os.path.basename(output_file_path)[:-len(template_name) - 1] for output_file_path, _ in chunk]
+
+    aggregated = _aggregation is not None and can_aggregate(template_name)
+    render = render_chunk_content if aggregated else render_chunk
+    workers = get_render_workers()
+    executor = get_executor()
+    ## spread small exports over all workers, large ones in chunks of chunk_size
+    size = min(chunk_size, -(-len(jobs) // max(workers, 1)))
+    chunks = [jobs[n:n + size] for n in range(0, len(jobs), size)]
+    if executor is None:
+        results = [render(xml_file_path, chunk) for chunk in chunks]
+        if not aggregated:
+            for chunk, result in zip(chunks, results):
+                await register(result, chunk_parts(chunk))
+    else:
+        loop = asyncio.get_running_loop()
+        futures = [loop.run_in_executor(executor, render, xml_file_path, chunk) for chunk in chunks]
+        if not aggregated:
+            ## the checkpoints share the generator's connection, the chunks are registered one at a time as they finish
+            for future in asyncio.as_completed(futures):
+                result = await future
+                await register(result, chunk_parts(result))
+        results = await asyncio.gather(*futures)
+    written = [item for result in results for item in result]
+
+    if aggregated:
+        written = write_aggregated(xml_file_path, written)
+        await register(written, chunk_parts(jobs))
+    return len(written)
@@ -0,0 +1,104 @@
+'''
+Local manifest of the generated XMLs and their DBLoader upload state.
+
+The generators record every XML they write with its part, template and content hash. The
+uploader asks the manifest for the files not yet acknowledged instead of walking the output
+tree, so files of earlier failed days are retried and byte-identical files that were already
+uploaded are not sent again.
+
+    state: 'pending' -> generated, not uploaded yet (or changed since the last upload)
+           'spooled' -> the file with uploaded_sha256 was copied to the dbloader spool
+           'failed'  -> the last upload attempt failed, retried by the next upload
+           'missing' -> the file was deleted before it could be uploaded
+
+DBLoader loads the spool on its own, its outcome is not tracked here.
+'''
+import os, sqlite3, hashlib
+from datetime import datetime
+
+MANIFEST_FILE = 'export/logs/xml_manifest.sqlite'
+
+_create_sql = """
+CREATE TABLE IF NOT EXISTS xml_files (
+    path TEXT PRIMARY KEY,
+    part TEXT,
+    template TEXT,
+    sha256 TEXT,
+    generated_at TEXT,
+    state TEXT,
+    uploaded_sha256 TEXT,
+    uploaded_at TEXT,
+    attempts INTEGER DEFAULT 0,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS xml_files_not_uploaded ON xml_files (state) WHERE state IN ('pending', 'failed');
+"""
+
+_connections = {}
+
+def get_manifest(manifest_file = MANIFEST_FILE):
+    '''
+    Does: opens the manifest once per process and creates its table on first use
+    Return: sqlite3 connection
+    '''
+    key = os.path.abspath(manifest_file)
+    if key not in _connections:
+        os.makedirs(os.path.dirname(key), exist_ok=True)
+        conn = sqlite3.connect(key)
+        conn.execute('PRAGMA journal_mode=WAL;')
+        conn.execute('PRAGMA synchronous=NORMAL;')
+        conn.executescript(_create_sql)
+        _connections[key] = conn
+    return _connections[key]
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+def record_generated(output_file_path, xml_file_path, content = None, manifest_file = MANIFEST_FILE, sha256 = None):
+    '''
+    Does: records a generated XML. Output files are named {part}_{template}, i.e. 320MLF3CXCM0001_cond_upload.xml.
+          A file identical to the one already uploaded keeps its 'spooled' state.
+          Streamed files pass the sha256 computed while writing instead of the content.
+    '''
+    template = os.path.basename(xml_file_path)
+    part = os.path.basename(output_file_path)[:-len(template) - 1]
+    sha256 = sha256 or content_hash(content)
+    conn = get_manifest(manifest_file)
+    conn.execute("""
+        INSERT INTO xml_files (path, part, template, sha256, generated_at, state)
+        VALUES (?, ?, ?, ?, ?, 'pending')
+        ON CONFLICT (path) DO UPDATE SET
+            part = excluded.part, template = excluded.template, sha256 = excluded.sha256, generated_at = excluded.generated_at,
+            state = CASE WHEN xml_files.uploaded_sha256 = excluded.sha256 THEN 'spooled' ELSE 'pending' END;
+        """, (os.path.abspath(output_file_path), part, template, sha256, datetime.now().isoformat()))
+    conn.commit()
+
+def get_pending_files(directory = None, manifest_file = MANIFEST_FILE):
+    '''
+    Does: lists the files not acknowledged yet, optionally only under directory. Uses the partial index on state.
+    Return: list of paths
+    '''
+    conn = get_manifest(manifest_file)
+    rows = conn.execute("SELECT path FROM xml_files WHERE state IN ('pending', 'failed') ORDER BY path;").fetchall()
+    prefix = os.path.join(os.path.abspath(directory), '') if directory else ''
+    return [path for (path,) in rows if path.startswith(prefix)]
+
+def record_upload_results(results, manifest_file = MANIFEST_FILE):
+    '''
+    Does: stores the per-file results of UploadScheduler ({'file', 'status', 'attempts', 'error', 'datetime'}), skipped files stay pending
+    '''
+    conn = get_manifest(manifest_file)
+    for result in results:
+        path = os.path.abspath(result['file'])
+        if result['status'] == 'spooled':
+            conn.execute("""
+                UPDATE xml_files SET state = 'spooled', uploaded_sha256 = sha256, uploaded_at = ?, attempts = attempts + ?, last_error = NULL
+                WHERE path = ?;""", (result['datetime'], result['attempts'], path))
+        elif result['status'] == 'skipped':
+            ## not attempted, a file it depends on failed. It stays in its state for the next upload.
+            conn.execute("UPDATE xml_files SET last_error = ? WHERE path = ?;", (result['error'], path))
+        else:
+            conn.execute("""
+                UPDATE xml_files SET state = ?, attempts = attempts + ?, last_error = ?
+                WHERE path = ?;""", ('missing' if result['attempts'] == 0 else 'failed', result['attempts'], result['error'], path))
+    conn.commit()
@@ -0,0 +1,80 @@
+'''
+Aggregated output: many parts of one template type in a single XML.
+
+A DBLoader file holds one HEADER (the RUN) and any number of DATA_SET blocks, and a build
+file any number of PART blocks under PARTS. Parts whose rendered XML only differs inside
+those blocks are packed into one file, up to a number of parts and a file size, so the
+filesystem entry, the transfer and the DBLoader job are paid per file instead of per part.
+Parts with a different HEADER, i.e. another run timestamp or operator, go to different
+files, since a file can only describe one run.
+
+Only the build and cond XMLs are aggregated. The HEADER of the other types names the part
+itself (the serial number in RUN_TYPE/RUN_NAME of the IV and pedestal tests), so no two parts
+would share a file, and the assembly and wirebond runs are left one per file.
+'''
+
+MAX_PARTS = 100
+MAX_BYTES = 5 * 1024 * 1024
+AGGREGATED_TEMPLATES = ['build_upload.xml', 'cond_upload.xml']
+
+def can_aggregate(template_name):
+    return template_name in AGGREGATED_TEMPLATES
+
+def split_rendered(rendered):
+    '''
+    Does: splits a rendered XML into the text before the repeatable blocks, the blocks and the text after them.
+          The blocks are the DATA_SET elements, or the content of PARTS for build files.
+    Return: (prefix, blocks, suffix) as str, or None if the XML has neither
+    '''
+    start, end = rendered.find('<DATA_SET'), rendered.rfind('</DATA_SET>')
+    if start >= 0 and end > start:
+        end += len('</DATA_SET>')
+    else:
+        start, end = rendered.find('<PARTS>'), rendered.rfind('</PARTS>')
+        if start < 0 or end < start:
+            return None
+        start += len('<PARTS>')
+        while rendered[start] in ' \t\r\n':
+            start += 1
+        while rendered[end - 1] in ' \t\r\n':
+            end -= 1
+    return rendered[:start], rendered[start:end], rendered[end:]
+
+def aggregate(rendered_parts, max_parts = MAX_PARTS, max_bytes = MAX_BYTES):
+    '''
+    params: [(part_name, rendered XML as bytes)] in export order
+    Does: groups the parts by the text around their blocks and packs each group into files
+          of at most max_parts parts and about max_bytes bytes
+    Return: [(part_names, XML as bytes)], in the order of the first part of each file
+    '''
+    groups = {}
+    for part_name, rendered in rendered_parts:
+        text = rendered.decode('UTF-8')
+        split = split_rendered(text)
+        if split is None:
+            groups[(part_name, None)] = ('', [(part_name, text)], '')
+            continue
+        prefix, block, suffix = split
+        groups.setdefault((prefix, suffix), (prefix, [], suffix))[1].append((part_name, block))
+
+    files = []
+    for prefix, blocks, suffix in groups.values():
+        ## blocks are joined with the indentation the first block had in the template
+        separator = '\n' + prefix[prefix.rfind('\n') + 1:] if prefix.strip() else ''
+        batch, size = [], len(prefix) + len(suffix)
+        for part_name, block in blocks:
+            if batch and (len(batch) >= max_parts or size + len(block) > max_bytes):
+                files.append(([name for name, _ in batch], (prefix + separator.join(b for _, b in batch) + suffix).encode('UTF-8')))
+                batch, size = [], len(prefix) + len(suffix)
+            batch.append((part_name, block))
+            size += len(block) + len(separator)
+        files.append(([name for name, _ in batch], (prefix + separator.join(b for _, b in batch) + suffix).encode('UTF-8')))
+    return files
+
+def aggregated_file_name(part_names, template_name):
+    '''
+    Return: {first part}_{template} for a single part, {first part}_x{count}_{template} for a batch
+    '''
+    if len(part_names) == 1:
+        return f'{part_names[0]}_{template_name}'
+    return f'{part_names[0]}_x{len(part_names)}_{template_name}'
@@ -0,0 +1,105 @@
+'''
+Streaming XML writer for test payloads with per-channel arrays.
+
+The pedestal tests carry two dozen REAL[]/SMALLINT[] arrays over every channel. Instead of
+rendering the whole document as one string, the template tree is walked once per part and
+written with lxml's incremental xmlfile: literal elements are copied as they are and array
+values are formatted in chunks straight into the output file. Memory stays bounded by one
+database row and one chunk of numbers, whatever the channel count.
+
+Arrays are written as [v1,v2,...], the same text as str(list) without spaces.
+'''
+import os, re, hashlib
+from lxml import etree
+
+ARRAY_CHUNK = 512  ## numbers formatted per write
+
+_placeholder = re.compile(r'^\{\{ (.+?) \}\}$')
+_stream_templates = {}
+
+def get_stream_template(xml_file_path):
+    '''
+    Does: parses a template on first use and keeps its tree for the rest of the process
+    Return: root element
+    '''
+    key = os.path.abspath(xml_file_path)
+    if key not in _stream_templates:
+        _stream_templates[key] = etree.parse(xml_file_path).getroot()
+    return _stream_templates[key]
+
+def format_array(values, chunk = ARRAY_CHUNK):
+    '''
+    Does: formats a list of numbers chunk by chunk, without building the str(list) of the whole array
+    Return: generator of text pieces
+    '''
+    yield '['
+    for start in range(0, len(values), chunk):
+        yield (',' if start else '') + ','.join(map(str, values[start:start + chunk]))
+    yield ']'
+
+class HashingWriter:
+    '''
+    File wrapper that hashes what is written, so the manifest gets the sha256 of a streamed file
+    without reading it back.
+    '''
+    def __init__(self, file):
+        self.file = file
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self.file.write(data)
+
+def get_value(db_values, xml_var):
+    ## same key matching as xml_template.render_template
+    if xml_var == 'ID' and 'ID' in db_values:
+        return True, db_values['ID']
+    for key, value in db_values.items():
+        if key.lower() == xml_var:
+            return True, value
+    return False, None
+
+def write_text(xf, text, db_values):
+    match = _placeholder.match(text)
+    if not match:
+        xf.write(text)
+        return
+    found, value = get_value(db_values, match.group(1))
+    if not found:
+        xf.write(text)
+    elif isinstance(value, (list, tuple)):
+        for piece in format_array(value):
+            xf.write(piece)
+    elif value is not None:
+        xf.write(str(value))
+
+def write_element(xf, element, db_values):
+    '''
+    Does: writes an element of the template and its children, filling {{ var }} placeholders from db_values
+    '''
+    if not isinstance(element.tag, str):
+        xf.write(element, with_tail=False)  ## comments and processing instructions
+        return
+    with xf.element(element.tag, dict(element.attrib), nsmap=element.nsmap if element.getparent() is None else None):
+        if element.text:
+            write_text(xf, element.text, db_values)
+        for child in element:
+            write_element(xf, child, db_values)
+            if child.tail:
+                xf.write(child.tail)
+
+def stream_template(xml_file_path, output_file_path, db_values):
+    '''
+    Does: writes the template filled with db_values to output_file_path incrementally.
+          Array values are written chunk by chunk, placeholders without a value are left as they are.
+    Return: sha256 hex digest of the written file
+    '''
+    root = get_stream_template(xml_file_path)
+    os.makedirs(os.path.dirname(output_file_path) or '.', exist_ok=True)
+    with open(output_file_path, 'wb') as file:
+        writer = HashingWriter(file)
+        with etree.xmlfile(writer, encoding='UTF-8') as xf:
+            xf.write_declaration(standalone=True)
+            write_element(xf, root, db_values)
+        writer.write(b'\n')
+    return writer.sha256.hexdigest()
@@ -0,0 +1,77 @@
+'''
+Compiled XML templates for the export generators.
+
+Each template under export/template_examples/ is parsed once and serialized with a
+marker in place of every {{ var }} placeholder found in element text. Rendering a
+part then only joins the literal fragments with the escaped values, so its cost
+scales with the number of placeholders instead of placeholders x tree size.
+'''
+import os, re
+from lxml import etree
+
+_placeholder = re.compile(r'\{\{ (.+?) \}\}')
+_slot_marker = '\ue000{}\ue001'  ## private-use characters, never found in the templates
+_slot_split = re.compile('\ue000(\\d+)\ue001')
+_compiled_templates = {}
+
+class CompiledTemplate:
+    def __init__(self, fragments, slots):
+        self.fragments = fragments  ## literal text around the slots, len(slots) + 1 items
+        self.slots = slots          ## placeholder variable name of every slot
+
+def compile_template(xml_file_path):
+    '''
+    Does: parses an XML template once and records where every {{ var }} placeholder sits
+    Return: CompiledTemplate
+    '''
+    tree = etree.parse(xml_file_path)
+    slots = []
+
+    def mark_slot(match):
+        slots.append(match.group(1))
+        return _slot_marker.format(len(slots) - 1)
+
+    for element in tree.getroot().iterdescendants(tag=etree.Element):
+        if element.text and '{{' in element.text:
+            element.text = _placeholder.sub(mark_slot, element.text)
+
+    serialized = etree.tostring(tree, pretty_print=True, xml_declaration=True, encoding='UTF-8').decode('UTF-8')
+    parts = _slot_split.split(serialized)
+    fragments = parts[0::2]
+    slots = [slots[int(n)] for n in parts[1::2]]
+    return CompiledTemplate(fragments, slots)
+
+def get_template(xml_file_path):
+    '''
+    Does: compiles a template on first use and keeps it for the rest of the process
+    Return: CompiledTemplate
+    '''
+    key = os.path.abspath(xml_file_path)
+    if key not in _compiled_templates:
+        _compiled_templates[key] = compile_template(xml_file_path)
+    return _compiled_templates[key]
+
+def escape_text(value):
+    ## same escaping lxml applies to element text
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('\r', '&#13;')
+
+def render_template(template, db_values):
+    '''
+    Does: fills the slots of a compiled template. Keys are matched case-insensitively, except 'ID'.
+          Placeholders without a value are left as they are, None is written as an empty string.
+    Return: serialized XML as bytes
+    '''
+    db_values_lower = {k.lower(): v for k, v in db_values.items()}
+    output = [template.fragments[0]]
+    for xml_var, fragment in zip(template.slots, template.fragments[1:]):
+        if xml_var in db_values_lower:
+            value = db_values_lower[xml_var]
+        elif xml_var == 'ID' and 'ID' in db_values:
+            value = db_values['ID']
+        else:
+            output.append(f'{{{{ {xml_var} }}}}')
+            output.append(fragment)
+            continue
+        output.append(escape_text('' if value is None else str(value)))
+        output.append(fragment)
+    return ''.join(output).encode('UTF-8')
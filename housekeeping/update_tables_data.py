@@ -1,8 +1,10 @@
 import asyncio, asyncpg
-import glob, os, csv, yaml, argparse, base64, traceback
+import glob, os, sys, csv, yaml, argparse, base64, traceback
 import numpy as np
 import pwinput
 from cryptography.fernet import Fernet
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from HGC_DB_postgres.src.db_session import get_password, get_conn
 
 parser = argparse.ArgumentParser(description="A script that modifies a table and requires the -t argument.")
 parser.add_argument('-p', '--password', default=None, required=False, help="Password to access database.")
@@ -15,24 +17,10 @@ tables_subdir = 'postgres_tables'
 table_yaml_file = os.path.join(loc, 'tables.yaml')
 conn_yaml_file = os.path.join(loc, 'conn.yaml')
 
-db_params = {
-    'database': yaml.safe_load(open(conn_yaml_file, 'r')).get('dbname'),
-    'user': 'shipper',
-    'host': yaml.safe_load(open(conn_yaml_file, 'r')).get('db_hostname'),
-    'port': yaml.safe_load(open(conn_yaml_file, 'r')).get('port'),
-}
-
-if args.password is None:
-        dbpassword = pwinput.pwinput(prompt='Enter superuser password: ', mask='*')
-else:
-    if args.encrypt_key is None:
-        print("Encryption key not provided. Exiting..."); exit()
-    cipher_suite = Fernet((args.encrypt_key).encode())
-    dbpassword = cipher_suite.decrypt( base64.urlsafe_b64decode(args.password)).decode() ## Decode base64 to get encrypted string and then decrypt
-    db_params.update({'password': dbpassword})
+dbpassword = get_password(args.password, args.encrypt_key, prompt='Enter superuser password: ')
 
 async def update_module_info():
-    conn = await asyncpg.connect(**db_params)
+    conn = await get_conn(user = 'shipper', dbpassword = dbpassword)
     print('Connection successful.')
         
     try:    
@@ -1,18 +1,22 @@
-import requests, json, yaml, os, argparse, datetime
-import pwinput, asyncio, asyncpg, base64, traceback
+import requests, json, yaml, os, sys, argparse, datetime, time
+import pwinput, asyncio, asyncpg, base64, traceback, functools, sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 from cryptography.fernet import Fernet
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from HGC_DB_postgres.src.db_session import get_password, get_pool, get_conn_info
+from hgcapi_fixture import FixtureRecorder, FixtureServer, load_fixture, FIXTURE_FILE  ## sibling script, 'import' is not importable as a package
 
-loc = 'dbase_info'
-conn_yaml_file = os.path.join(loc, 'conn.yaml')
-conn_info = yaml.safe_load(open(conn_yaml_file, 'r'))
+conn_info = get_conn_info()
 inst_code  = conn_info.get('institution_abbr')
 
-db_params = {
-    'database': conn_info.get('dbname'),
-    'user': 'ogp_user',
-    'host': conn_info.get('db_hostname'),
-    'port': conn_info.get('port'),
-}
+HGCAPI_URL = 'https://hgcapi.web.cern.ch'
+CONCURRENCY = 8     ## HGCAPI requests in flight
+RATE_LIMIT = 20.0   ## requests per second per host, 0 for no limit
+TIMEOUT = 30        ## seconds per request
+PAGE_SIZE = 100     ## parts per page of the part listings
+BATCH_SIZE = 500    ## rows per staged insert
+CACHE_FILE = 'import/logs/hgcapi_cache.sqlite'
 
 partTrans = {'bp' : {'apikey':'baseplates', 'dbtabname': 'bp_inspect', 'db_col': 'bp_name', 'qc_cols': {'grade': 'grade' ,'thickness': 'thickness','comments': 'comment', 'flatness':'flatness', 'weight': 'weight'}},
              'sen':{'apikey':'sensors', 'dbtabname': 'sensor', 'db_col': 'sen_name', 'qc_cols': {'grade': 'grade' ,'thickness': 'thickness','comments': 'comment'}},
@@ -21,39 +25,172 @@ partTrans = {'bp' : {'apikey':'baseplates', 'dbtabname': 'bp_inspect', 'db_col':
              'ml' :{'apikey':'modules', 'dbtabname': 'module_inspect', 'db_col': 'module_name', 'qc_cols':  {'mod_grade': 'grade', 'mod_ave_thkns_mm': 'ave_thickness', "mod_max_thkns_mm": 'max_thickness', 'mod_fltns_mm': 'flatness', "pcb_plcment_x_offset": 'x_offset_mu', "pcb_plcment_y_offset": 'y_offset_mu',"pcb_plcment_ang_offset": 'ang_offset_deg'}},
             }
 
-def get_query_write(table_name, column_names):
-    pre_query = f""" INSERT INTO {table_name} ({', '.join(column_names)}) VALUES """
-    data_placeholder = ', '.join(['${}'.format(i) for i in range(1, len(column_names)+1)])
-    query = f"""{pre_query} {'({})'.format(data_placeholder)}"""
+def get_merge_query(table_name, stage_name, column_names, key_names):
+    cols = ', '.join(column_names)
+    stage_cols = ', '.join(f's.{col_name}' for col_name in column_names)
+    stage_keys = ', '.join(f's.{key_name}' for key_name in key_names)
+    match = ' AND '.join(f't.{key_name} = s.{key_name}' for key_name in key_names)
+    query = f"""INSERT INTO {table_name} ({cols})
+    SELECT DISTINCT ON ({stage_keys}) {stage_cols} FROM {stage_name} s
+    WHERE NOT EXISTS ( SELECT 1 FROM {table_name} t WHERE {match} )
+    ORDER BY {stage_keys};"""
     return query
 
-def check_exists_query(table_name, column_names):
-    pre_query = f"""SELECT EXISTS ( SELECT 1 FROM {table_name} WHERE """ 
-    data_placeholder = [f'{col_name} = ${n+1}' for n, col_name in enumerate(column_names)]
-    query = f'{pre_query} {" AND ".join(data_placeholder)} );'
-    return query
+async def write_rows(pool, table_name, db_rows, key_names):
+    '''
+    Does: COPYs rows into a temporary staging table and inserts the ones not in the table yet
+          (same part and date_inspect) with one statement, in one transaction
+    Return: number of rows inserted
+    '''
+    ## a module or protomodule without assembly QC has no QC columns, the rows are staged per set of columns
+    row_groups = {}
+    for db_dict in db_rows:
+        row_groups.setdefault(tuple(db_dict.keys()), []).append(tuple(db_dict.values()))
+    inserted = 0
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            for n, (column_names, records) in enumerate(row_groups.items()):
+                stage_name = f'{table_name}_stage_{n}'
+                await conn.execute(f"CREATE TEMP TABLE {stage_name} ON COMMIT DROP AS SELECT {', '.join(column_names)} FROM {table_name} WITH NO DATA;")
+                await conn.copy_records_to_table(stage_name, records = records, columns = list(column_names))
+                status = await conn.execute(get_merge_query(table_name, stage_name, column_names, key_names))
+                inserted += int(status.split()[-1])
+    return inserted
 
-async def write_to_db(pool, db_upload_data, partType = None):
+async def write_to_db(pool, db_rows, partType = None):
+    '''
+    Does: writes the rows of a part type with one staged insert, instead of a lookup and an insert per part.
+          If the batch fails, i.e. a value does not fit its column, the rows are written one by one so only the bad parts are lost.
+    Return: (number of rows inserted, part names of the rows rejected)
+    '''
     table_name = partTrans[partType]["dbtabname"]
-    check_col = {key: db_upload_data[key] for key in [partTrans[partType]["db_col"], "date_inspect"]}
-    async with pool.acquire() as conn:
-        check_exists = await conn.fetchval( check_exists_query(table_name, check_col.keys()), *check_col.values())
-        if not check_exists:
-            query = get_query_write(table_name, db_upload_data.keys())
-            await conn.execute(query, *db_upload_data.values())
+    key_names = [partTrans[partType]["db_col"], "date_inspect"]
+    try:
+        return await write_rows(pool, table_name, db_rows, key_names), []
+    except Exception as e:
+        if len(db_rows) == 1:
+            print(f'ERROR for single part upload for {db_rows[0]}', e)
+            return 0, [db_rows[0][key_names[0]]]
+        print(f'ERROR in writing {len(db_rows)} row(s) to {table_name}: {e}. Writing them one by one.')
+    inserted, rejected = 0, []
+    for db_dict in db_rows:
+        try:
+            inserted += await write_rows(pool, table_name, [db_dict], key_names)
+        except Exception as e:
+            print(f'ERROR for single part upload for {db_dict}', e)
+            rejected.append(db_dict[key_names[0]])
+    return inserted, rejected
 
-def get_url(partID = None, macID = None, partType = None):
+def get_url(partID = None, macID = None, partType = None, base_url = HGCAPI_URL, page = 0, limit = PAGE_SIZE):
     if partID is not None:
-        return f'https://hgcapi.web.cern.ch/mac/part/{partID}/full'
+        return f'{base_url}/mac/part/{partID}/full'
     elif partType is not None:
         if macID is not None:
-            return f'https://hgcapi.web.cern.ch/mac/parts/types/{partTrans[partType.lower()]["apikey"]}?page=0&limit=100&location={macID}'
-        return f'https://hgcapi.web.cern.ch/mac/parts/types/{partTrans[partType.lower()]["apikey"]}?page=0&limit=100'
+            return f'{base_url}/mac/parts/types/{partTrans[partType.lower()]["apikey"]}?page={page}&limit={limit}&location={macID}'
+        return f'{base_url}/mac/parts/types/{partTrans[partType.lower()]["apikey"]}?page={page}&limit={limit}'
     return
 
-def read_from_cern_db(partID = None, macID = None, partType = None ):
-    headers = {'Accept': 'application/json'}
-    response = requests.get(get_url(partID = partID, macID = macID, partType = partType), headers=headers)
+class HGCAPIClient:
+    '''
+    One keep-alive requests.Session shared by a pool of threads, so the event loop keeps writing
+    to postgres while the next parts are fetched. At most `concurrency` requests are in flight,
+    and every host gets at most `rate_limit` requests per second. A FixtureRecorder as `recorder`
+    keeps every response for an offline replay, see hgcapi_fixture.py.
+    '''
+    def __init__(self, base_url = HGCAPI_URL, concurrency = CONCURRENCY, rate_limit = RATE_LIMIT, timeout = TIMEOUT, recorder = None):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.timeout = timeout
+        self.rate_limit = rate_limit
+        self.session = requests.Session()
+        self.session.headers.update({'Accept': 'application/json'})
+        adapter = requests.adapters.HTTPAdapter(pool_connections = 1, pool_maxsize = concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers = concurrency)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.next_slot = {}  ## host -> earliest time of its next request
+
+    async def wait_for_slot(self, host):
+        if not self.rate_limit:
+            return
+        now = time.monotonic()
+        slot = max(now, self.next_slot.get(host, now))
+        self.next_slot[host] = slot + 1.0 / self.rate_limit
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def get(self, url, headers = None):
+        async with self.semaphore:
+            await self.wait_for_slot(urlsplit(url).netloc)
+            loop = asyncio.get_event_loop()
+            response = await loop.run_in_executor(self.executor, functools.partial(self.session.get, url, timeout = self.timeout, headers = headers))
+        if self.recorder is not None:
+            self.recorder.add(url, response)
+        return response
+
+    def close(self):
+        self.executor.shutdown()
+        self.session.close()
+
+class PartCache:
+    '''
+    On-disk cache of the imported part records: serial -> last update time, ETag, Last-Modified and JSON.
+    A record is stored once it is in postgres, so the next import skips the parts that did not change:
+    without a request if the listing has their update time, else with a conditional request.
+    '''
+    def __init__(self, cache_file = CACHE_FILE):
+        os.makedirs(os.path.dirname(cache_file) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(cache_file)
+        self.conn.execute('PRAGMA journal_mode=WAL;')
+        self.conn.execute('PRAGMA synchronous=NORMAL;')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS parts (
+                serial_number TEXT PRIMARY KEY,
+                part_type TEXT,
+                last_update TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                record TEXT,
+                fetched_at TEXT
+            );""")
+
+    def get(self, serial_number):
+        row = self.conn.execute("SELECT last_update, etag, last_modified FROM parts WHERE serial_number = ?;", (serial_number,)).fetchone()
+        if row is None:
+            return None
+        return {'last_update': row[0], 'etag': row[1], 'last_modified': row[2]}
+
+    def put(self, serial_number, part_type, data_full, etag = None, last_modified = None):
+        self.put_many([(serial_number, part_type, data_full, etag, last_modified)])
+
+    def put_many(self, records):
+        '''
+        Does: stores [(serial_number, part_type, data_full, etag, last_modified)] in one transaction
+        '''
+        fetched_at = datetime.datetime.now().isoformat()
+        self.conn.executemany("""
+            INSERT OR REPLACE INTO parts (serial_number, part_type, last_update, etag, last_modified, record, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?);""",
+            [(serial_number, part_type, get_last_update(data_full), etag, last_modified, json.dumps(data_full), fetched_at)
+             for serial_number, part_type, data_full, etag, last_modified in records])
+        self.conn.commit()
+
+    def clear(self):
+        self.conn.execute("DELETE FROM parts;")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+def get_last_update(record):
+    '''
+    Return: the update time of a part record or listing entry, as used by get_data_for_db, None if it has none
+    '''
+    return record.get('record_lastupdate_time') or record.get('record_insertion_time') or None
+
+async def read_from_cern_db(client, partID = None, macID = None, partType = None, page = 0, limit = PAGE_SIZE):
+    response = await client.get(get_url(partID = partID, macID = macID, partType = partType, base_url = client.base_url, page = page, limit = limit))
     if response.status_code == 200:
         data = response.json() ; 
 #         print(json.dumps(data, indent=2))
@@ -62,6 +199,25 @@ def read_from_cern_db(partID = None, macID = None, partType = None ):
         print(f'ERROR in reading from HGCAPI for partID : {partID} :: {response.status_code}')
         return None
 
+async def fetch_part_record(client, partID, cached = None):
+    '''
+    Does: reads the full record of a part, conditional on the ETag / Last-Modified of its cached record
+    Return: (status, data_full, etag, last_modified), status 'ok', 'unchanged' (304) or 'error'
+    '''
+    headers = {}
+    if cached is not None:
+        if cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+    response = await client.get(get_url(partID = partID, base_url = client.base_url), headers = headers)
+    if response.status_code == 304:
+        return 'unchanged', None, None, None
+    if response.status_code != 200:
+        print(f'ERROR in reading from HGCAPI for partID : {partID} :: {response.status_code}')
+        return 'error', None, None, None
+    return 'ok', response.json(), response.headers.get('ETag'), response.headers.get('Last-Modified')
+
 def form(data):
     if type(data) is str:
         if data.lstrip('-').replace('.',"").isdigit():
@@ -109,44 +265,174 @@ def get_data_for_db(data_full, partType):
 #     output_string = f'320{"".join(parts)}'
 #     return output_string
 
+async def import_part(client, partID, partType, cache = None, listed_update = None):
+    '''
+    Does: fetches one part from HGCAPI while the other parts are in flight, import_part_type writes the rows in batches.
+          A part whose update time matches its cached record is skipped.
+    Return: (status, db_dict, (partID, partType, data_full, etag, last_modified) for the cache), status 'fetched', 'unchanged' or 'failed'
+    '''
+    try:
+        cached = cache.get(partID) if cache is not None else None
+        if cached is not None and listed_update is not None and cached['last_update'] == listed_update:
+            return 'unchanged', None, None
+        status, data_full, etag, last_modified = await fetch_part_record(client, partID, cached)
+        if status != 'ok':
+            return ('unchanged' if status == 'unchanged' else 'failed'), None, None
+        if cached is not None and get_last_update(data_full) == cached['last_update']:
+            cache.put(partID, partType, data_full, etag, last_modified)
+            return 'unchanged', None, None
+        db_dict = get_data_for_db(data_full, partType = partType)
+        if db_dict is None:
+            return 'failed', None, None
+        # print(db_dict)
+        return 'fetched', db_dict, (partID, partType, data_full, etag, last_modified)
+    except:
+        traceback.print_exc()
+    return 'failed', None, None
+
+async def iter_part_pages(client, partType, macID = None, page_size = PAGE_SIZE):
+    '''
+    Does: streams the part listing of a type page by page. The next page is requested while the
+          current one is processed. HGCAPI may return fewer parts than page_size per page, so the
+          length of the first page is the page size, and the listing ends with an empty page or
+          a page shorter than the first one.
+    Return: async generator of lists of parts
+    '''
+    page, served_size = 0, None
+    next_page = asyncio.ensure_future(read_from_cern_db(client, macID = macID, partType = partType, page = page, limit = page_size))
+    try:
+        while next_page is not None:
+            part_list = await next_page
+            next_page = None
+            if part_list is None:
+                print(f'ERROR: listing of {partTrans[partType]["apikey"]} stopped at page {page}, the parts of the next pages are not imported.')
+                return
+            parts = part_list['parts']
+            served_size = len(parts) if served_size is None else served_size
+            if parts and len(parts) >= served_size:
+                page += 1
+                next_page = asyncio.ensure_future(read_from_cern_db(client, macID = macID, partType = partType, page = page, limit = page_size))
+            if parts:
+                yield parts
+    finally:
+        if next_page is not None:
+            next_page.cancel()
+
+async def write_batch(pool, partType, batch, cache = None, counts = None):
+    '''
+    Does: writes a batch of (db_dict, cache record) with one staged insert, caches the parts written
+    Return: counts updated with the parts written and failed and the rows inserted
+    '''
+    counts = counts if counts is not None else dict.fromkeys(['written', 'unchanged', 'failed', 'inserted'], 0)
+    try:
+        inserted, rejected = await write_to_db(pool, [db_dict for db_dict, _ in batch], partType = partType)
+        rejected = set(rejected)
+        written = [record for db_dict, record in batch if db_dict[partTrans[partType]["db_col"]] not in rejected]
+        if cache is not None:
+            cache.put_many(written)
+        counts['written'] += len(written)
+        counts['failed'] += len(batch) - len(written)
+        counts['inserted'] += inserted
+    except Exception as e:
+        print(f'ERROR in writing {partTrans[partType]["apikey"]} to postgres', e)
+        traceback.print_exc()
+        counts['failed'] += len(batch)
+    return counts
+
+async def import_part_type(client, pool, partType, page_size = PAGE_SIZE, cache = None, batch_size = BATCH_SIZE):
+    '''
+    Does: imports the parts of a type. Listing, fetching and writing overlap: the parts of a page are fetched while
+          the next pages are listed, and the fetched rows are written in batches of batch_size while the other fetches run.
+    Return: {'written', 'unchanged', 'failed', 'inserted'} counts
+    '''
+    print(f'Reading {partTrans[partType]["apikey"]} from HGCAPI ...' )
+    counts = dict.fromkeys(['written', 'unchanged', 'failed', 'inserted'], 0)
+    results = asyncio.Queue()
+
+    async def fetch(serial_number, listed_update):
+        await results.put(await import_part(client, serial_number, partType, cache, listed_update))
+
+    async def write():
+        batch = []
+        while True:
+            result = await results.get()
+            if result is not None:
+                status, db_dict, record = result
+                if status == 'fetched':
+                    batch.append((db_dict, record))
+                else:
+                    counts[status] += 1
+            if batch and (result is None or len(batch) >= batch_size):
+                await write_batch(pool, partType, batch, cache, counts)
+                batch = []
+            if result is None:
+                return
+
+    writer = asyncio.ensure_future(write())
+    tasks, seen = [], set()
+    try:
+        async for parts in iter_part_pages(client, partType, macID = inst_code.upper(), page_size = page_size):
+            ## a part listed twice is imported once
+            for p in parts:
+                if p['serial_number'] not in seen:
+                    seen.add(p['serial_number'])
+                    tasks.append(asyncio.ensure_future(fetch(p['serial_number'], get_last_update(p))))
+        await asyncio.gather(*tasks)
+    finally:
+        await results.put(None)
+        await writer
+    print(f'Writing {partTrans[partType]["apikey"]} to postgres complete, {counts["written"]}/{len(tasks)} part(s) written ({counts["inserted"]} new row(s)), {counts["unchanged"]} unchanged since the last import, {counts["failed"]} failed.')
+    return counts
+
 async def main():
     parser = argparse.ArgumentParser(description="A script that modifies a table and requires the -t argument.")
     parser.add_argument('-p', '--password', default=None, required=False, help="Password to access database.")
     parser.add_argument('-pid', '--pardID', default=None, required=False, help="Part ID to query from HGC API.")
     parser.add_argument('-k', '--encrypt_key', default=None, required=False, help="The encryption key")
+    parser.add_argument('-api', '--api_url', default=HGCAPI_URL, required=False, help=f"HGCAPI base URL. Default is {HGCAPI_URL}.")
+    parser.add_argument('-n', '--concurrency', type=int, default=CONCURRENCY, required=False, help=f"HGCAPI requests in flight. Default is {CONCURRENCY}.")
+    parser.add_argument('-ps', '--page_size', type=int, default=PAGE_SIZE, required=False, help=f"Parts per page of the HGCAPI part listings. Default is {PAGE_SIZE}.")
+    parser.add_argument('-bs', '--batch_size', type=int, default=BATCH_SIZE, required=False, help=f"Rows written to postgres per staged insert. Default is {BATCH_SIZE}.")
+    parser.add_argument('-full', '--full_import', default='False', required=False, help="Fetch and write every part again, ignoring the cache of the last import, i.e. after the local tables were emptied.")
+    parser.add_argument('-rec', '--record', default=None, required=False, help=f"Save the HGCAPI responses of this import to a fixture file, e.g. {FIXTURE_FILE}. The cache of the last import is not used.")
+    parser.add_argument('-rep', '--replay', default=None, required=False, help="Read the parts from a recorded fixture file served by a local stand-in of HGCAPI instead of HGCAPI.")
+    parser.add_argument('-scale', '--replay_scale', type=int, default=1, required=False, help="With -rep, serve every recorded part this many times with synthetic serial numbers. Default is 1.")
+    parser.add_argument('-lat', '--replay_latency', type=float, default=0.0, required=False, help="With -rep, seconds every request is delayed by. Default is 0.")
+    parser.add_argument('-rate', '--rate_limit', type=float, default=RATE_LIMIT, required=False, help=f"Maximum HGCAPI requests per second, 0 for no limit. Default is {RATE_LIMIT:.0f}.")
     args = parser.parse_args()
 
-    if args.password is None:
-        dbpassword = pwinput.pwinput(prompt='Enter superuser password: ', mask='*')
-    else:
-        if args.encrypt_key is None:
-            print("Encryption key not provided. Exiting..."); exit()
-        cipher_suite = Fernet((args.encrypt_key).encode())
-        dbpassword = cipher_suite.decrypt( base64.urlsafe_b64decode(args.password)).decode() ## Decode base64 to get encrypted string and then decrypt
-        db_params.update({'password': dbpassword})
-
-    pool = await asyncpg.create_pool(**db_params)
-    for pt in ['bp','hxb','sen', 'pml', 'ml']:
-        print(f'Reading {partTrans[pt]["apikey"]} from HGCAPI ...' )
-        parts = (read_from_cern_db(macID = inst_code.upper(), partType = pt))['parts']
-        for p in parts:
-            try:
-                data_full = read_from_cern_db(partID = p['serial_number'])
-                if data_full is not None:
-                    db_dict = get_data_for_db(data_full, partType = pt)
-                    if db_dict is not None:
-                        try:
-                            # print(db_dict)
-                            await write_to_db(pool, db_dict, partType = pt)
-                        except Exception as e:
-                            print(f'ERROR for single part upload for {data_full} {db_dict}', e)
-                            traceback.print_exc()
-                            print('Dictionary:', (db_dict))
-            except:
-                traceback.print_exc()
-        print(f'Writing {partTrans[pt]["apikey"]} to postgres complete.')
-        print('-'*40); print('\n')
-    await pool.close()
-    print('Refresh postgres tables')
-
-asyncio.run(main())
\ No newline at end of file
+    dbpassword = get_password(args.password, args.encrypt_key, prompt='Enter superuser password: ')
+
+    api_url, stand_in, recorder = args.api_url, None, None
+    if args.replay is not None:
+        stand_in = FixtureServer(load_fixture(args.replay), args.replay_scale, args.replay_latency)
+        api_url = stand_in.start()
+        print(f'Replaying {args.replay} at {api_url}, scale {stand_in.scale}, latency {args.replay_latency} s.')
+    if args.record is not None:
+        recorder = FixtureRecorder(api_url)
+
+    start_time = time.perf_counter()
+    pool = await get_pool(user = 'ogp_user', dbpassword = dbpassword)
+    client = HGCAPIClient(api_url, concurrency = max(args.concurrency, 1), rate_limit = args.rate_limit, recorder = recorder)
+    ## recording needs the full response of every part, the cache would turn them into 304s or skip them
+    cache = PartCache() if recorder is None else None
+    if cache is not None and args.full_import == 'True':
+        cache.clear()
+    try:
+        ## the part types are fetched concurrently, the client bounds the requests in flight
+        await asyncio.gather(*[import_part_type(client, pool, pt, max(args.page_size, 1), cache, max(args.batch_size, 1)) for pt in ['bp','hxb','sen', 'pml', 'ml']])
+    finally:
+        client.close()
+        if cache is not None:
+            cache.close()
+        await pool.close()
+        if stand_in is not None:
+            stand_in.stop()
+    if recorder is not None:
+        parts, records = recorder.save(args.record)
+        print(f'Recorded {parts} listed part(s) and {records} record(s) to {args.record}.')
+    print('-'*40)
+    print(f'Refresh postgres tables. Import took {time.perf_counter() - start_time:.1f} s.')
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,213 @@
+'''
+Recorded HGCAPI responses, to run and benchmark get_parts_from_hgcapi.py without access to HGCAPI.
+
+Record mode (-rec of get_parts_from_hgcapi.py) keeps every part listing and /full response of an
+import and saves them as one gzipped JSON fixture:
+
+    {"base_url": ..., "recorded": ..., "listings": {apikey: {"body": {...}, "parts": [...]}},
+     "records": {serial_number: {"record": {...}, "etag": ..., "last_modified": ...}}}
+
+The listing pages are stored merged, so the fixture replays with any page size.
+
+Replay mode (-rep of get_parts_from_hgcapi.py, or this script on its own) serves a fixture from a
+local HTTP stand-in of HGCAPI:
+    - every part can be repeated scale times, the copies get the serial numbers {serial}-S1, {serial}-S2, ...
+    - every request can be delayed by latency seconds, like a remote server
+    - ETag / If-None-Match and Last-Modified / If-Modified-Since behave as in HGCAPI
+    - the page size of the listings can be capped at max_limit parts, whatever limit is requested
+
+    python import/hgcapi_fixture.py import/logs/hgcapi_fixture.json.gz -port 8765 -scale 10 -lat 0.05
+'''
+import os, re, gzip, json, time, datetime, threading, argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+FIXTURE_FILE = 'import/logs/hgcapi_fixture.json.gz'
+LISTING_PATH = re.compile(r'/mac/parts/types/(?P<apikey>\w+)$')
+RECORD_PATH = re.compile(r'/mac/part/(?P<serial>[^/]+)/full$')
+
+def synthetic_serial(serial_number, copy_no):
+    return serial_number if copy_no == 0 else f'{serial_number}-S{copy_no}'
+
+def copy_part(entry, serial_number, copy_no):
+    '''
+    Return: the listing entry or record of serial_number with every mention of the serial number replaced by the one of the copy
+    '''
+    if copy_no == 0:
+        return entry
+    return json.loads(json.dumps(entry).replace(json.dumps(serial_number), json.dumps(synthetic_serial(serial_number, copy_no))))
+
+class FixtureRecorder:
+    '''
+    Collects the HGCAPI responses of an import, HGCAPIClient calls add() for every response.
+    '''
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.pages = {}    ## apikey -> {page: listing body}
+        self.records = {}
+        self.lock = threading.Lock()
+
+    def add(self, url, response):
+        if response.status_code != 200:
+            return
+        parts = urlsplit(url)
+        listing, record = LISTING_PATH.search(parts.path), RECORD_PATH.search(parts.path)
+        with self.lock:
+            if listing is not None:
+                page = int(parse_qs(parts.query).get('page', ['0'])[0])
+                self.pages.setdefault(listing.group('apikey'), {})[page] = response.json()
+            elif record is not None:
+                self.records[record.group('serial')] = {'record': response.json(),
+                                                        'etag': response.headers.get('ETag'),
+                                                        'last_modified': response.headers.get('Last-Modified')}
+
+    def save(self, fixture_file = FIXTURE_FILE):
+        '''
+        Does: merges the listing pages of every part type and writes the fixture
+        Return: (number of listed parts, number of records)
+        '''
+        listings = {}
+        for apikey, pages in self.pages.items():
+            entries, seen = [], set()
+            for page in sorted(pages):
+                for entry in pages[page].get('parts', []):
+                    if entry['serial_number'] not in seen:
+                        seen.add(entry['serial_number'])
+                        entries.append(entry)
+            body = {key: value for key, value in pages[min(pages)].items() if key != 'parts'}
+            listings[apikey] = {'body': body, 'parts': entries}
+        fixture = {'base_url': self.base_url, 'recorded': datetime.datetime.now().isoformat(),
+                   'listings': listings, 'records': self.records}
+        os.makedirs(os.path.dirname(fixture_file) or '.', exist_ok=True)
+        with gzip.open(fixture_file, 'wt', encoding='utf-8') as file:
+            json.dump(fixture, file, separators=(',', ':'))
+        return sum(len(listing['parts']) for listing in listings.values()), len(self.records)
+
+def load_fixture(fixture_file = FIXTURE_FILE):
+    with gzip.open(fixture_file, 'rt', encoding='utf-8') as file:
+        return json.load(file)
+
+class FixtureServer:
+    '''
+    Local HTTP stand-in of HGCAPI serving a fixture, in a background thread.
+    '''
+    def __init__(self, fixture, scale = 1, latency = 0.0, host = '127.0.0.1', port = 0, max_limit = None):
+        self.fixture = fixture
+        self.scale = max(int(scale), 1)
+        self.latency = latency
+        self.max_limit = max_limit
+        self.requests = 0
+        self.listings = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def listing(self, apikey):
+        '''
+        Return: the listed parts of a type, with the copies of every part after the recorded ones
+        '''
+        with self.lock:
+            if apikey not in self.listings:
+                entries = self.fixture['listings'][apikey]['parts']
+                self.listings[apikey] = [copy_part(entry, entry['serial_number'], copy_no) for copy_no in range(self.scale) for entry in entries]
+            return self.listings[apikey]
+
+    def record(self, serial_number):
+        '''
+        Return: (record, etag, last_modified) of a recorded part or of a copy, None if unknown
+        '''
+        copy_no, match = 0, re.match(r'(?P<serial>.+)-S(?P<copy_no>\d+)$', serial_number)
+        if match is not None and 0 < int(match.group('copy_no')) < self.scale:
+            serial_number, copy_no = match.group('serial'), int(match.group('copy_no'))
+        recorded = self.fixture['records'].get(serial_number)
+        if recorded is None:
+            return None
+        etag = recorded['etag']
+        if etag is not None and copy_no:
+            etag = f'{etag[:-1]}-S{copy_no}"' if etag.endswith('"') else f'{etag}-S{copy_no}'
+        return copy_part(recorded['record'], serial_number, copy_no), etag, recorded['last_modified']
+
+    def make_handler(self):
+        stand_in = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True  ## headers and body are written separately, keep-alive would wait for delayed ACKs
+
+            def log_message(self, format, *args):
+                pass
+
+            def send(self, status, body = None, headers = None):
+                content = b'' if body is None else json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                for key, value in (headers or {}).items():
+                    if value is not None:
+                        self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                with stand_in.lock:
+                    stand_in.requests += 1
+                if stand_in.latency:
+                    time.sleep(stand_in.latency)
+                parts = urlsplit(self.path)
+                listing, record = LISTING_PATH.search(parts.path), RECORD_PATH.search(parts.path)
+                if listing is not None and listing.group('apikey') in stand_in.fixture['listings']:
+                    query = parse_qs(parts.query)
+                    entries = stand_in.listing(listing.group('apikey'))
+                    if 'page' in query or 'limit' in query:
+                        page, limit = int(query.get('page', ['0'])[0]), int(query.get('limit', [len(entries) or 1])[0])
+                        limit = min(limit, stand_in.max_limit or limit)
+                        entries = entries[page * limit:(page + 1) * limit]
+                    body = dict(stand_in.fixture['listings'][listing.group('apikey')]['body'], parts = entries)
+                    return self.send(200, body)
+                if record is not None:
+                    found = stand_in.record(record.group('serial'))
+                    if found is None:
+                        return self.send(404, {'detail': 'Part not found'})
+                    data_full, etag, last_modified = found
+                    headers = {'ETag': etag, 'Last-Modified': last_modified}
+                    if (etag is not None and self.headers.get('If-None-Match') == etag) or \
+                       (last_modified is not None and self.headers.get('If-Modified-Since') == last_modified):
+                        return self.send(304, headers = headers)
+                    return self.send(200, data_full, headers)
+                self.send(404, {'detail': 'Not found'})
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves a recorded HGCAPI fixture as a local stand-in of HGCAPI.")
+    parser.add_argument('fixture', nargs='?', default=FIXTURE_FILE, help=f"Fixture recorded with get_parts_from_hgcapi.py -rec. Default is {FIXTURE_FILE}.")
+    parser.add_argument('-port', '--port', type=int, default=8765, required=False, help="Port to listen on. Default is 8765.")
+    parser.add_argument('-scale', '--scale', type=int, default=1, required=False, help="Serve every recorded part this many times, with synthetic serial numbers. Default is 1.")
+    parser.add_argument('-lat', '--latency', type=float, default=0.0, required=False, help="Seconds every request is delayed by. Default is 0.")
+    parser.add_argument('-maxl', '--max_limit', type=int, default=None, required=False, help="Largest page of a listing, whatever limit is requested. Default is no cap.")
+    args = parser.parse_args()
+
+    server = FixtureServer(load_fixture(args.fixture), args.scale, args.latency, port = args.port, max_limit = args.max_limit)
+    print(f'Serving {args.fixture} at {server.url}, scale {server.scale}, latency {args.latency} s.')
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        print(f'Stopped after {server.requests} request(s).')
+    finally:
+        server.server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,15 @@
-import csv, os, glob, subprocess, random
+import csv, os, sys, glob, subprocess, random
 import asyncio, asyncpg, yaml, pwinput
 from datetime import datetime
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from HGC_DB_postgres.src.db_session import get_pool, get_conn_info
 
-loc = 'dbase_info'
-conn_yaml_file = os.path.join(loc, 'conn.yaml')
-conn_info = yaml.safe_load(open(conn_yaml_file, 'r'))
+conn_info = get_conn_info()
 inst_code  = conn_info.get('institution_abbr')
-db_params = {
-    'database': conn_info.get('dbname'),
-    'user': 'postgres',
-    'host': conn_info.get('db_hostname'),
-    'port': conn_info.get('port'),
-}
 
 async def get_conn_pool():
     dbpassword = (pwinput.pwinput(prompt='Enter user password: ', mask='*')).replace(" ", "")
-    db_params.update({'password': dbpassword})
-    pool = await asyncpg.create_pool(**db_params)
+    pool = await get_pool(user = 'postgres', dbpassword = dbpassword)
     return pool
 
 def get_query_write(table_name, column_names):
@@ -3,6 +3,8 @@ import asyncio, asyncpg
 import yaml, csv
 from cryptography.fernet import Fernet
 sys.path.append('../')
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from HGC_DB_postgres.src.db_session import get_password, get_conn
 import pwinput
 
 '''
@@ -167,25 +169,12 @@ async def main():
     tables_subdir = 'postgres_tables'
     table_yaml_file = os.path.join(loc, 'tables.yaml')
     conn_yaml_file = os.path.join(loc, 'conn.yaml')
-    conn_info = yaml.safe_load(open(conn_yaml_file, 'r'))
-    db_params = {
-        'database': conn_info.get('dbname'),
-        'user': 'postgres',
-        'host': conn_info.get('db_hostname'),
-        'port': conn_info.get('port'),}
-    
+
     ## Database connection parameters for new database
-    if args.password is None:
-        dbpassword = pwinput.pwinput(prompt='Enter superuser password: ', mask='*')
-    else:
-        if args.encrypt_key is None:
-            print("Encryption key not provided. Exiting.."); exit()
-        cipher_suite = Fernet((args.encrypt_key).encode())
-        dbpassword = cipher_suite.decrypt( base64.urlsafe_b64decode(args.password)).decode() ## Decode base64 to get encrypted string and then decrypt
-        db_params.update({'password': dbpassword})
+    dbpassword = get_password(args.password, args.encrypt_key, prompt='Enter superuser password: ')
 
     # Establish a connection with database
-    conn = await asyncpg.connect(**db_params)
+    conn = await get_conn(user = 'postgres', dbpassword = dbpassword)
 
     # retrieve all table names from csv files
     all_table_names = []
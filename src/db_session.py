@@ -0,0 +1,108 @@
+'''
+Shared database session for the export, import, housekeeping, create and modify scripts.
+
+conn.yaml is read once and the Fernet-encrypted password is decrypted once per process.
+Connections come from one asyncpg pool per (user, database), so concurrent jobs reuse
+connections instead of paying setup and authentication cost for each of them.
+
+The pool can be tuned with an optional 'pool' section in dbase_info/conn.yaml, i.e.
+pool: {min_size: 1, max_size: 10, statement_cache_size: 100, command_timeout: 60}
+'''
+import os, base64
+import asyncpg, yaml, pwinput
+from cryptography.fernet import Fernet
+
+CONN_YAML_FILE = os.path.join('dbase_info', 'conn.yaml')
+DEFAULT_POOL_CONFIG = {'min_size': 1, 'max_size': 10, 'statement_cache_size': 100, 'command_timeout': 60}
+
+_conn_info = None
+_passwords = {}
+_pools = {}
+
+def get_conn_info():
+    '''
+    Does: reads dbase_info/conn.yaml on first use
+    Return: {dbname, port, db_hostname, institution_abbr, ...}
+    '''
+    global _conn_info
+    if _conn_info is None:
+        with open(CONN_YAML_FILE, 'r') as file:
+            _conn_info = yaml.safe_load(file)
+    return _conn_info
+
+def decrypt_password(dbpassword, encryption_key = None):
+    '''
+    Does: decrypts a base64 encoded, Fernet encrypted password. Plain passwords are returned as they are when no key is given.
+    Return: password
+    '''
+    if encryption_key is None:
+        return dbpassword
+    if (dbpassword, encryption_key) not in _passwords:
+        cipher_suite = Fernet((encryption_key).encode())
+        _passwords[(dbpassword, encryption_key)] = cipher_suite.decrypt( base64.urlsafe_b64decode(dbpassword)).decode() ## Decode base64 to get encrypted string and then decrypt
+    return _passwords[(dbpassword, encryption_key)]
+
+def get_password(dbpassword = None, encryption_key = None, prompt = 'Enter superuser password: '):
+    '''
+    Does: prompts for the password if it is not given, otherwise decrypts it with the encryption key
+    Return: password
+    '''
+    if dbpassword is None:
+        return pwinput.pwinput(prompt=prompt, mask='*')
+    if encryption_key is None:
+        print("Encryption key not provided. Exiting..."); exit()
+    return decrypt_password(dbpassword, encryption_key)
+
+def get_db_params(user = 'shipper', dbpassword = None, encryption_key = None, database = None):
+    '''
+    Does: builds the asyncpg connection parameters from conn.yaml
+    Return: db_params
+    '''
+    conn_info = get_conn_info()
+    db_params = {
+        'database': database or conn_info.get('dbname'),
+        'user': user,
+        'host': conn_info.get('db_hostname'),
+        'port': conn_info.get('port'),}
+    if dbpassword is not None:
+        db_params.update({'password': decrypt_password(dbpassword, encryption_key)})
+    return db_params
+
+def get_pool_config(**pool_config):
+    '''
+    Does: merges the defaults, the 'pool' section of conn.yaml and the arguments given, in that order
+    Return: keyword arguments for asyncpg.create_pool
+    '''
+    config = dict(DEFAULT_POOL_CONFIG)
+    config.update(get_conn_info().get('pool') or {})
+    config.update({key: value for key, value in pool_config.items() if value is not None})
+    config['max_size'] = max(config['max_size'], config['min_size'])
+    return config
+
+async def get_conn(user = 'shipper', dbpassword = None, encryption_key = None, database = None):
+    '''
+    Does: opens a single connection, for scripts that run one statement sequence
+    Return: connection
+    '''
+    conn = await asyncpg.connect(**get_db_params(user, dbpassword, encryption_key, database))
+    return conn
+
+async def get_pool(user = 'shipper', dbpassword = None, encryption_key = None, database = None, **pool_config):
+    '''
+    Does: creates the pool of (user, database) on first use and returns the same pool afterwards.
+          pool_config accepts min_size, max_size, statement_cache_size and command_timeout.
+    Return: pool
+    '''
+    db_params = get_db_params(user, dbpassword, encryption_key, database)
+    key = (db_params['user'], db_params['database'])
+    if key not in _pools or _pools[key].is_closing():
+        _pools[key] = await asyncpg.create_pool(**db_params, **get_pool_config(**pool_config))
+    return _pools[key]
+
+async def close_pools():
+    '''
+    Does: closes every pool opened in this process
+    '''
+    for pool in _pools.values():
+        await pool.close()
+    _pools.clear()
@@ -0,0 +1,179 @@
+'''
+UploadScheduler of export/dbloader_scp_xml.py against a local stand-in of lxplus and dbloader-hgcal:
+an SSH server in a background thread that forwards the second hop to itself and writes the SCP
+transfers to a spool directory.
+
+    python -m pytest -q tests
+'''
+import os, sys, json, socket, select, threading
+import paramiko
+import pytest
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(REPO_DIR))
+from HGC_DB_postgres.export.dbloader_scp_xml import UploadScheduler
+from HGC_DB_postgres.export.export_dag import UploadDAG
+from HGC_DB_postgres.export.upload_manifest import record_generated, record_upload_results, get_manifest, get_pending_files
+from test_export_dag import NODES, make_export
+
+PASSWORD = 'pw'
+DISCONNECTED = (EOFError, OSError, paramiko.SSHException)  ## a client closing its connection, i.e. after a rejected login
+
+class SSHStandIn:
+    '''
+    SSH server accepting PASSWORD, direct-tcpip channels (the lxplus hop) and scp -t (the spool).
+    '''
+    def __init__(self, spool_dir):
+        self.spool_dir = spool_dir
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.received = []  ## file names in arrival order
+        self.lock = threading.Lock()
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(50)
+        self.port = self.sock.getsockname()[1]
+        self.running = True
+
+    def make_interface(self, forwarded):
+        stand_in = self
+        class Interface(paramiko.ServerInterface):
+            def get_allowed_auths(self, username):
+                return 'password'
+            def check_auth_password(self, username, password):
+                return paramiko.AUTH_SUCCESSFUL if password == PASSWORD else paramiko.AUTH_FAILED
+            def check_channel_request(self, kind, chanid):
+                return paramiko.OPEN_SUCCEEDED
+            def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+                forwarded.add(chanid)
+                return paramiko.OPEN_SUCCEEDED
+            def check_channel_exec_request(self, channel, command):
+                threading.Thread(target = stand_in.scp_sink, args = (channel,), daemon = True).start()
+                return True
+        return Interface()
+
+    def scp_sink(self, channel):
+        try:
+            self.receive(channel)
+        except DISCONNECTED:
+            pass
+
+    def receive(self, channel):
+        file = channel.makefile('rb')
+        channel.sendall(b'\0')
+        while True:
+            line = file.readline()
+            if not line:
+                break
+            if line[:1] == b'C':
+                mode, size, name = line[1:].decode().strip().split(' ', 2)
+                channel.sendall(b'\0')
+                data = file.read(int(size))
+                file.read(1)
+                with open(os.path.join(self.spool_dir, name), 'wb') as spooled:
+                    spooled.write(data)
+                with self.lock:
+                    self.received.append(name)
+            channel.sendall(b'\0')
+        channel.send_exit_status(0)
+        channel.close()
+
+    def forward(self, channel):
+        ## the second hop, dbloader-hgcal is this server again
+        target = socket.create_connection(('127.0.0.1', self.port))
+        try:
+            while True:
+                readable, _, _ = select.select([channel, target], [], [])
+                data = channel.recv(65536) if channel in readable else target.recv(65536)
+                if not data:
+                    break
+                (target if channel in readable else channel).sendall(data)
+            channel.close()
+        except DISCONNECTED:
+            pass
+        finally:
+            target.close()
+
+    def handle(self, client):
+        transport = paramiko.Transport(client)
+        transport.add_server_key(self.host_key)
+        forwarded = set()
+        try:
+            transport.start_server(server = self.make_interface(forwarded))
+        except DISCONNECTED:
+            return
+        while transport.is_active():
+            channel = transport.accept(1)
+            if channel is not None and channel.chanid in forwarded:
+                threading.Thread(target = self.forward, args = (channel,), daemon = True).start()
+
+    def serve(self):
+        while self.running:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                break
+            threading.Thread(target = self.handle, args = (client,), daemon = True).start()
+
+    def start(self):
+        threading.Thread(target = self.serve, daemon = True).start()
+
+    def stop(self):
+        self.running = False
+        self.sock.close()
+
+@pytest.fixture
+def stand_in(tmp_path):
+    spool_dir = tmp_path / 'spool'
+    spool_dir.mkdir()
+    server = SSHStandIn(str(spool_dir))
+    server.start()
+    yield server
+    server.stop()
+
+def run_upload(stand_in, files, tmp_path, password = PASSWORD, retries = 3):
+    scheduler = UploadScheduler('user', password, workers = 4, retries = retries, backoff = 0.0,
+                                result_log = str(tmp_path / 'upload_log.jsonl'), jump_host = '127.0.0.1',
+                                target_host = '127.0.0.1', port = stand_in.port, remote_dir = stand_in.spool_dir + '/')
+    try:
+        return scheduler.run_dag(UploadDAG(files, NODES))
+    finally:
+        scheduler.close()
+
+def test_files_spooled_after_their_prerequisites(stand_in, tmp_path):
+    files = make_export(tmp_path / 'xmls')
+    results = run_upload(stand_in, files.values(), tmp_path)
+    assert [result['status'] for result in results] == ['spooled'] * len(files)
+    assert sorted(stand_in.received) == sorted(os.path.basename(fname) for fname in files.values())
+    for n in range(3):
+        arrival = {name: stand_in.received.index(os.path.basename(files[name])) for name in (f'320-XL-{n:04d}', f'320-PL-{n:04d}', f'320-ML-{n:04d}', f'320-ML-{n:04d}_cond')}
+        assert arrival[f'320-XL-{n:04d}'] < arrival[f'320-ML-{n:04d}'] < arrival[f'320-ML-{n:04d}_cond']
+        assert arrival[f'320-PL-{n:04d}'] < arrival[f'320-ML-{n:04d}']
+    with open(tmp_path / 'upload_log.jsonl') as log:
+        assert len([json.loads(line) for line in log]) == len(files)
+
+def test_failed_file_skips_its_dependents_only(stand_in, tmp_path):
+    files = make_export(tmp_path / 'xmls')
+    manifest_file = str(tmp_path / 'xml_manifest.sqlite')
+    for fname in files.values():
+        with open(fname, 'rb') as file:
+            record_generated(fname, os.path.basename(fname).split('_', 1)[1], file.read(), manifest_file = manifest_file)
+    os.remove(files['320-XL-0001'])
+    results = run_upload(stand_in, files.values(), tmp_path)
+    record_upload_results(results, manifest_file = manifest_file)
+
+    status = {result['file']: result['status'] for result in results}
+    assert status[files['320-XL-0001']] == 'failed'
+    assert status[files['320-ML-0001']] == status[files['320-ML-0001_cond']] == 'skipped'
+    assert len(stand_in.received) == len(files) - 3
+    states = dict(get_manifest(manifest_file).execute('SELECT path, state FROM xml_files;').fetchall())
+    assert states[files['320-XL-0001']] == 'missing'
+    assert states[files['320-ML-0002']] == 'spooled'
+    assert get_pending_files(manifest_file = manifest_file) == sorted([files['320-ML-0001'], files['320-ML-0001_cond']])
+
+def test_rejected_login_retried_then_failed(stand_in, tmp_path):
+    files = make_export(tmp_path / 'xmls', n_modules = 1)
+    results = run_upload(stand_in, files.values(), tmp_path, password = 'wrong', retries = 2)
+    assert sorted(result['status'] for result in results) == ['failed', 'failed', 'skipped', 'skipped']
+    assert all(result['attempts'] == 2 for result in results if result['status'] == 'failed')
+    assert stand_in.received == []
@@ -0,0 +1,42 @@
+'''
+Upload step of the export daemon cycle (export/export_daemon.py), with the generators and the
+scp script replaced.
+
+    python -m pytest -q tests
+'''
+import os, sys, asyncio, subprocess
+import pytest
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(REPO_DIR))
+from HGC_DB_postgres.export import export_daemon, export_pipeline
+
+@pytest.fixture
+def scp_commands(monkeypatch):
+    '''
+    Return: argv of every scp script run, the runs fail when the script would have failed
+    '''
+    commands = []
+    async def run_generators(scripts, dbpassword = None, encryption_key = None):
+        return []
+    def run(command, check = False):
+        commands.append(command)
+        if any(arg is None for arg in command):
+            raise TypeError('expected str, bytes or os.PathLike object, not NoneType')
+        if '-lxp' in command and command[command.index('-lxp') + 1] == 'wrong':
+            raise subprocess.CalledProcessError(1, command)
+    monkeypatch.setattr(export_daemon, 'run_generators', run_generators)
+    monkeypatch.setattr(export_pipeline.subprocess, 'run', run)
+    return commands
+
+def test_upload_without_key(scp_commands):
+    asyncio.run(export_daemon.export_cycle('dbpassword', None, upload = True, lxplus_username = 'user', lxplus_password = 'plain'))
+    assert len(scp_commands) == 1 and '-k' not in scp_commands[0]
+
+def test_upload_with_key(scp_commands):
+    asyncio.run(export_daemon.export_cycle('dbpassword', 'key', upload = True, lxplus_username = 'user', lxplus_password = 'encrypted'))
+    assert scp_commands[0][scp_commands[0].index('-k') + 1] == 'key'
+
+def test_failed_upload_fails_the_cycle(scp_commands):
+    with pytest.raises(RuntimeError):
+        asyncio.run(export_daemon.export_cycle('dbpassword', None, upload = True, lxplus_username = 'user', lxplus_password = 'wrong'))
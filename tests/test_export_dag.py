@@ -0,0 +1,55 @@
+'''
+UploadDAG edges between the XML files of an export, on small files written to a temporary directory.
+
+    python -m pytest -q tests
+'''
+import os, sys
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(REPO_DIR))
+from HGC_DB_postgres.export.export_dag import XmlNode, UploadDAG
+
+NODES = [XmlNode('hxb_build.py', ('hexaboard', 'build_upload.xml')),
+         XmlNode('proto_assembly.py', ('protomodule', 'assembly_upload.xml')),
+         XmlNode('module_assembly.py', ('module', 'assembly_upload.xml'), [('protomodule', 'assembly_upload.xml'), ('hexaboard', 'build_upload.xml')]),
+         XmlNode('module_cond.py', ('module', 'cond_upload.xml'), [('module', 'assembly_upload.xml')])]
+
+def write_xml(tmp_path, subdir, name, serials):
+    os.makedirs(tmp_path / subdir, exist_ok=True)
+    fname = str(tmp_path / subdir / name)
+    with open(fname, 'w') as file:
+        file.write('<ROOT>' + ''.join(f'<{tag}>{serial}</{tag}>' for tag, serial in serials) + '</ROOT>')
+    return fname
+
+def make_export(tmp_path, n_modules = 3):
+    files = {}
+    for n in range(n_modules):
+        hxb, proto, module = f'320-XL-{n:04d}', f'320-PL-{n:04d}', f'320-ML-{n:04d}'
+        files[hxb] = write_xml(tmp_path, 'hexaboard', f'{hxb}_build_upload.xml', [('SERIAL_NUMBER', hxb)])
+        files[proto] = write_xml(tmp_path, 'protomodule', f'{proto}_assembly_upload.xml', [('SERIAL_NUMBER', proto)])
+        files[module] = write_xml(tmp_path, 'module', f'{module}_assembly_upload.xml',
+                                  [('SERIAL_NUMBER', module), ('PRTO_SER_NUM', proto), ('PCB_SER_NUM', hxb)])
+        files[module + '_cond'] = write_xml(tmp_path, 'module', f'{module}_cond_upload.xml', [('SERIAL_NUMBER', module)])
+    return files
+
+def test_module_waits_for_its_own_parts(tmp_path):
+    files = make_export(tmp_path)
+    dag = UploadDAG(files.values(), NODES)
+    assert dag.depends_on[files['320-ML-0001']] == {files['320-XL-0001'], files['320-PL-0001']}
+    assert dag.depends_on[files['320-ML-0001_cond']] == {files['320-ML-0001']}
+    assert sorted(dag.ready()) == sorted(files[f'320-{kind}-{n:04d}'] for kind in ('XL', 'PL') for n in range(3))
+
+def test_failed_hexaboard_only_skips_its_module(tmp_path):
+    files = make_export(tmp_path)
+    dag = UploadDAG(files.values(), NODES)
+    assert sorted(dag.reject(files['320-XL-0001'])) == sorted([files['320-ML-0001'], files['320-ML-0001_cond']])
+    assert dag.spooled(files['320-PL-0002']) == []
+    assert dag.spooled(files['320-XL-0002']) == [files['320-ML-0002']]
+
+def test_aggregated_file_waits_for_the_parts_it_names(tmp_path):
+    files = make_export(tmp_path)
+    aggregated = write_xml(tmp_path, 'hexaboard', '320-XL-0000_x2_build_upload.xml', [('SERIAL_NUMBER', '320-XL-0005'), ('SERIAL_NUMBER', '320-XL-0006')])
+    module = write_xml(tmp_path, 'module', '320-ML-0005_assembly_upload.xml', [('SERIAL_NUMBER', '320-ML-0005'), ('PCB_SER_NUM', '320-XL-0005')])
+    dag = UploadDAG(list(files.values()) + [aggregated, module], NODES)
+    assert dag.depends_on[module] == {aggregated}
+    assert aggregated not in dag.depends_on[files['320-ML-0000']]
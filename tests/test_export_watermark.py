@@ -0,0 +1,27 @@
+'''
+Generators whose watermarks bound the pruning of export_change_log (export/export_watermark.py).
+
+    python -m pytest -q tests
+'''
+import os, sys
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(REPO_DIR))
+from HGC_DB_postgres.export.export_watermark import get_scheduled_generators
+from HGC_DB_postgres.export.export_dag import get_xml_nodes
+
+def test_hand_run_generators_do_not_hold_back_the_prune():
+    scheduled = get_scheduled_generators()
+    assert 'generate_bp_build_xml' in scheduled and 'generate_module_assembly_xml' in scheduled
+    for generator in ['generate_hxb_pedestal_xml', 'generate_module_build_xml', 'generate_proto_build_xml']:
+        assert generator not in scheduled
+
+def test_scheduled_generators_are_the_pipeline_generators():
+    ## export_pipeline.py get_generator_scripts() runs the UPLOAD = True nodes from the repository root
+    cwd = os.getcwd()
+    os.chdir(REPO_DIR)
+    try:
+        nodes = get_xml_nodes()
+    finally:
+        os.chdir(cwd)
+    assert get_scheduled_generators() == sorted(os.path.basename(node.script_path)[:-len('.py')] for node in nodes if node.upload)
@@ -0,0 +1,25 @@
+'''
+build_db_values of export/fetch_engine.py on fetched rows, without postgres.
+
+    python -m pytest -q tests
+'''
+import os, sys, datetime
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(REPO_DIR))
+from HGC_DB_postgres.export.fetch_engine import build_db_values
+
+XML_DATA = [{'xml_temp_val': 'RUN_BEGIN_TIMESTAMP_', 'dbase_col': 'date_bond, time_bond', 'dbase_table': 'back_wirebond', 'nested_query': None},
+            {'xml_temp_val': 'BACK_BONDS_DATE', 'dbase_col': 'date_bond', 'dbase_table': 'back_wirebond', 'nested_query': None}]
+
+def test_date_and_time_combined():
+    row = {'date_bond': datetime.date(2024, 10, 1), 'time_bond': datetime.time(10, 0)}
+    db_values = build_db_values(XML_DATA, '320-ML-F3CX-CM-0000', {'back_wirebond': row})
+    assert db_values['RUN_BEGIN_TIMESTAMP_'] == '2024-10-01T10:00:00'
+    assert db_values['BACK_BONDS_DATE'] == datetime.date(2024, 10, 1)
+
+def test_null_date_and_time_left_empty():
+    db_values = build_db_values(XML_DATA, '320-ML-F3CX-CM-0000', {'back_wirebond': {'date_bond': None, 'time_bond': None}})
+    assert db_values['RUN_BEGIN_TIMESTAMP_'] == 'T'
+    db_values = build_db_values(XML_DATA, '320-ML-F3CX-CM-0000', {'back_wirebond': {'date_bond': datetime.date(2024, 10, 1), 'time_bond': None}})
+    assert db_values['RUN_BEGIN_TIMESTAMP_'] == '2024-10-01T'
@@ -0,0 +1,31 @@
+'''
+Rounding of the IV arrays of export/electrical_testing_xml/generate_iv_xml.py against the per-number
+rounding it replaced.
+
+    python -m pytest -q tests
+'''
+import os, sys
+import numpy as np
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(REPO_DIR))
+from HGC_DB_postgres.export.electrical_testing_xml.generate_iv_xml import round_to_n_sig_figs
+
+def baseline_round_to_n_sig_figs(num, n = 4):
+    if num == 0:
+        return 0.0
+    else:
+        return round(num, n - int(np.floor(np.log10(abs(num)))) - 1)
+
+def test_halfway_cases_round_like_python():
+    values = [0.59415, 31.405, 6.7185e-05, -2.5e-9, 0.0, -0.0, 1234.5, 99995.0]
+    assert round_to_n_sig_figs(values) == [baseline_round_to_n_sig_figs(num) for num in values]
+    assert round_to_n_sig_figs(values)[:3] == [0.5941, 31.41, 6.719e-05]
+
+def test_same_as_baseline_on_measurements():
+    rng = np.random.default_rng(1)
+    ## currents, voltages and resistances, plus values on a 5th-digit grid where halfway cases are common
+    values = np.concatenate([rng.normal(0, 1e-6, 50000), rng.uniform(-900, 0, 50000), 10.0 ** rng.uniform(-9, 9, 50000),
+                             np.round(rng.uniform(0, 100, 50000), 3)]).tolist()
+    assert round_to_n_sig_figs(values) == [baseline_round_to_n_sig_figs(num) for num in values]
+    assert [str(num) for num in round_to_n_sig_figs(values, 3)] == [str(baseline_round_to_n_sig_figs(num, 3)) for num in values]
@@ -0,0 +1,130 @@
+'''
+get_parts_from_hgcapi.py against a local HGCAPI stand-in (import/hgcapi_fixture.py), without postgres:
+the rows handed to write_to_db are collected instead of written.
+
+    python -m pytest -q tests
+'''
+import os, sys, asyncio
+import pytest
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(REPO_DIR, 'import'))
+from hgcapi_fixture import FixtureServer
+
+N_PARTS = 60
+LAST_UPDATE = '2024-10-01T10:00:00'
+
+@pytest.fixture(scope='module')
+def hgcapi():
+    ## the import script reads dbase_info/conn.yaml relative to the repository root
+    cwd = os.getcwd()
+    os.chdir(REPO_DIR)
+    try:
+        import get_parts_from_hgcapi
+    finally:
+        os.chdir(cwd)
+    return get_parts_from_hgcapi
+
+def make_fixture(n_parts = N_PARTS):
+    serials = [f'320-BA-{n:05d}' for n in range(n_parts)]
+    qc = {'grade': 'A', 'thickness': '1.2', 'comments': 'ok', 'flatness': '0.1', 'weight': '10'}
+    return {'listings': {'baseplates': {'body': {}, 'parts': [{'serial_number': serial, 'record_lastupdate_time': LAST_UPDATE} for serial in serials]}},
+            'records': {serial: {'record': {'serial_number': serial, 'record_lastupdate_time': LAST_UPDATE, 'record_insertion_time': LAST_UPDATE, 'qc': {'baseplate': qc}},
+                                 'etag': f'"{serial}"', 'last_modified': None} for serial in serials}}
+
+@pytest.fixture
+def stand_in(hgcapi):
+    server = FixtureServer(make_fixture(), scale = 2, latency = 0.01)
+    server.start()
+    yield server
+    server.stop()
+
+def collect_writes(hgcapi, monkeypatch, server):
+    '''
+    Return: list of (rows, requests served by the stand-in so far) of every write_to_db call
+    '''
+    writes = []
+    async def write_to_db(pool, db_rows, partType = None):
+        writes.append((db_rows, server.requests))
+        return len(db_rows), []
+    monkeypatch.setattr(hgcapi, 'write_to_db', write_to_db)
+    return writes
+
+def run_import(hgcapi, server, cache = None, batch_size = 16, page_size = 25):
+    async def run():
+        client = hgcapi.HGCAPIClient(server.url, concurrency = 4, rate_limit = 0)
+        try:
+            return await hgcapi.import_part_type(client, None, 'bp', page_size = page_size, cache = cache, batch_size = batch_size)
+        finally:
+            client.close()
+    return asyncio.run(run())
+
+def test_pages_and_scaled_parts(hgcapi, stand_in):
+    async def run():
+        client = hgcapi.HGCAPIClient(stand_in.url, rate_limit = 0)
+        try:
+            return [parts async for parts in hgcapi.iter_part_pages(client, 'bp', page_size = 25)]
+        finally:
+            client.close()
+    pages = asyncio.run(run())
+    serials = [part['serial_number'] for parts in pages for part in parts]
+    assert [len(parts) for parts in pages] == [25, 25, 25, 25, 20]
+    assert len(set(serials)) == 2 * N_PARTS
+    assert '320-BA-00007-S1' in serials
+
+def test_listing_complete_when_the_server_caps_the_page_size(hgcapi):
+    server = FixtureServer(make_fixture(), scale = 2, max_limit = 10)
+    server.start()
+    async def run():
+        client = hgcapi.HGCAPIClient(server.url, rate_limit = 0)
+        try:
+            return [parts async for parts in hgcapi.iter_part_pages(client, 'bp', page_size = 25)]
+        finally:
+            client.close()
+    try:
+        pages = asyncio.run(run())
+    finally:
+        server.stop()
+    assert [len(parts) for parts in pages] == [10] * 12
+    assert len(set(part['serial_number'] for parts in pages for part in parts)) == 2 * N_PARTS
+
+def test_rows_written_in_batches_while_fetching(hgcapi, stand_in, monkeypatch):
+    writes = collect_writes(hgcapi, monkeypatch, stand_in)
+    counts = run_import(hgcapi, stand_in, batch_size = 16)
+    rows = [db_dict for db_rows, _ in writes for db_dict in db_rows]
+    assert counts['written'] == counts['inserted'] == 2 * N_PARTS
+    assert counts['failed'] == 0
+    assert sorted(db_dict['bp_name'] for db_dict in rows) == sorted(set(db_dict['bp_name'] for db_dict in rows))
+    assert all(len(db_rows) <= 16 for db_rows, _ in writes)
+    ## the first batch is written before the last part is fetched
+    assert writes[0][1] < stand_in.requests
+    assert rows[0]['grade'] == 'A' and rows[0]['thickness'] == 1.2
+
+def test_unchanged_parts_skipped_with_cache(hgcapi, stand_in, monkeypatch, tmp_path):
+    writes = collect_writes(hgcapi, monkeypatch, stand_in)
+    cache = hgcapi.PartCache(str(tmp_path / 'hgcapi_cache.sqlite'))
+    try:
+        run_import(hgcapi, stand_in, cache = cache)
+        requests = stand_in.requests
+        counts = run_import(hgcapi, stand_in, cache = cache)
+    finally:
+        cache.close()
+    assert counts['unchanged'] == 2 * N_PARTS
+    assert counts['written'] == 0
+    ## the listing has the update times, only the 5 listing pages are requested again
+    assert stand_in.requests - requests == 5
+    assert sum(len(db_rows) for db_rows, _ in writes) == 2 * N_PARTS
+
+def test_rejected_rows_are_not_cached(hgcapi, stand_in, monkeypatch, tmp_path):
+    async def write_to_db(pool, db_rows, partType = None):
+        rejected = [db_dict['bp_name'] for db_dict in db_rows if db_dict['bp_name'].endswith('3')]
+        return len(db_rows) - len(rejected), rejected
+    monkeypatch.setattr(hgcapi, 'write_to_db', write_to_db)
+    cache = hgcapi.PartCache(str(tmp_path / 'hgcapi_cache.sqlite'))
+    try:
+        counts = run_import(hgcapi, stand_in, cache = cache)
+        assert counts['failed'] == 6  ## 320-BA-00003 ... 320-BA-00053, the copies end in -S1
+        assert cache.get('320-BA-00003') is None
+        assert cache.get('320-BA-00004') is not None
+    finally:
+        cache.close()